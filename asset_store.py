@@ -0,0 +1,189 @@
+# asset_store.py
+"""
+Offline image ingestion into a memory-mapped asset store.
+
+Each source image is decoded once, normalized to premultiplied RGBA ("RGBa")
+and written as raw pixel files, one per mip level, next to a small JSON
+manifest. At render time the pixel files are memory-mapped and wrapped with
+Image.frombuffer, so worker processes share the decoded pages through the OS
+page cache instead of each decoding its own copy.
+
+Usage:
+    python asset_store.py ingest images/ [--store asset_store]
+"""
+import os
+import json
+import mmap
+import argparse
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+STORE_DIR = "asset_store"
+MANIFEST_NAME = "manifest.json"
+MIN_MIP_SIZE = 64
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+# Open mappings and parsed manifests are kept per process and reused while
+# their file is unchanged; mappings are keyed by path plus (mtime, size)
+_mapped_files: Dict[str, Tuple[Tuple[int, int], mmap.mmap]] = {}
+_manifest_cache: Dict[str, Tuple[float, Dict]] = {}
+
+
+def _asset_key(src: str) -> str:
+    """Normalize a source path into a manifest key"""
+    return os.path.normpath(src).replace(os.sep, '/')
+
+
+def _mip_sizes(width: int, height: int):
+    """Yield (width, height) for every mip level, largest first"""
+    while True:
+        yield width, height
+        if min(width, height) // 2 < MIN_MIP_SIZE:
+            break
+        width, height = width // 2, height // 2
+
+
+def load_manifest(store_dir: str = STORE_DIR) -> Dict:
+    """Load the store manifest, reusing the parsed copy while the file is unchanged"""
+    path = os.path.join(store_dir, MANIFEST_NAME)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {"assets": {}}
+
+    cached = _manifest_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    _manifest_cache[path] = (mtime, manifest)
+    return manifest
+
+
+def ingest_image(src: str, store_dir: str = STORE_DIR) -> Dict:
+    """Decode one image into premultiplied RGBA mip levels and return its manifest entry"""
+    key = _asset_key(src)
+    stat = os.stat(src)
+    base_name = key.replace('/', '__')
+
+    img = Image.open(src).convert("RGBA").convert("RGBa")
+    levels = []
+    for level, (w, h) in enumerate(_mip_sizes(*img.size)):
+        if (w, h) != img.size:
+            img = img.resize((w, h), resample=Image.LANCZOS)
+        file_name = f"{base_name}.mip{level}.rgba"
+        # Replaced atomically: renderers may have the previous file mapped
+        path = os.path.join(store_dir, file_name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(img.tobytes())
+        os.replace(tmp_path, path)
+        levels.append({"file": file_name, "width": w, "height": h})
+
+    return {
+        "source_mtime": stat.st_mtime,
+        "source_size": stat.st_size,
+        "mode": "RGBa",
+        "levels": levels
+    }
+
+
+def ingest_directory(src_dir: str = "images", store_dir: str = STORE_DIR) -> Dict:
+    """Ingest every image under src_dir into the store and rewrite the manifest"""
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = load_manifest(store_dir)
+    assets = dict(manifest.get("assets", {}))
+
+    for root, _, files in os.walk(src_dir):
+        for name in sorted(files):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            src = os.path.join(root, name)
+            key = _asset_key(src)
+            stat = os.stat(src)
+            entry = assets.get(key)
+            if entry and entry["source_mtime"] == stat.st_mtime and entry["source_size"] == stat.st_size:
+                print(f"Up to date: {key}")
+                continue
+            try:
+                assets[key] = ingest_image(src, store_dir)
+                print(f"Ingested: {key} ({len(assets[key]['levels'])} mip levels)")
+            except Exception as e:
+                print(f"Error ingesting {src}: {e}")
+
+    manifest = {"version": 1, "assets": assets}
+    tmp_path = os.path.join(store_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(store_dir, MANIFEST_NAME))
+    return manifest
+
+
+def _map_file(path: str) -> mmap.mmap:
+    """Return a shared read-only mapping of a pixel file, remapped when the file is replaced"""
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _mapped_files.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # The old mapping is released once no image uses it
+    _mapped_files[path] = (signature, mapped)
+    return mapped
+
+
+def open_asset(src: str, target_size: Optional[Tuple[int, int]] = None,
+               store_dir: str = STORE_DIR) -> Optional[Image.Image]:
+    """
+    Return a read-only premultiplied ("RGBa") image backed by the store, or None
+    when the asset was not ingested or the source changed since ingestion.
+
+    With target_size, the smallest mip level that still covers it is mapped.
+    """
+    entry = load_manifest(store_dir).get("assets", {}).get(_asset_key(src))
+    if not entry:
+        return None
+
+    try:
+        stat = os.stat(src)
+    except OSError:
+        return None
+    if entry["source_mtime"] != stat.st_mtime or entry["source_size"] != stat.st_size:
+        print(f"Asset store entry for {src} is stale, decoding source")
+        return None
+
+    level = entry["levels"][0]
+    if target_size:
+        target_w, target_h = target_size
+        for candidate in entry["levels"]:
+            if candidate["width"] >= target_w and candidate["height"] >= target_h:
+                level = candidate
+
+    try:
+        mapped = _map_file(os.path.join(store_dir, level["file"]))
+    except (OSError, ValueError) as e:
+        print(f"Error mapping asset {src}: {e}")
+        return None
+
+    size = (level["width"], level["height"])
+    if len(mapped) != size[0] * size[1] * 4:
+        print(f"Asset store file for {src} has the wrong size, decoding source")
+        return None
+    return Image.frombuffer(entry["mode"], size, mapped, "raw", entry["mode"], 0, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Poster asset store tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="Pre-decode images into the asset store")
+    ingest_parser.add_argument("src_dir", nargs="?", default="images")
+    ingest_parser.add_argument("--store", default=STORE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        result = ingest_directory(args.src_dir, args.store)
+        print(f"Asset store ready: {len(result['assets'])} assets in {args.store}")
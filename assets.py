@@ -1,42 +1,122 @@
-from PIL import Image, ImageDraw, ImageFilter, ImageEnhance, ImageFont
-from utils import hex_to_rgba, percent, get_anchor_pos
+from PIL import Image, ImageDraw, ImageFilter, ImageFont, ImageStat
+from functools import lru_cache
+from utils import get_anchor_pos
 import os
+from asset_store import open_asset
+from buffer_pool import acquire, release
+import numpy as np
 
+COLOR_FILTERS = ("grayscale", "brightness_contrast")
+LEVELS = np.arange(256, dtype=np.float32)
+IDENTITY_LUT = np.arange(256, dtype=np.uint8)
 
-def draw_image_layer(base, layer, width, height):
-    print("image layer called")
-    from PIL import ImageEnhance, ImageFilter
-    import os
 
-    src = layer.get('src')
-    if not src or not os.path.exists(src):
-        print(f"Image file not found: {src}")
-        return
-        
-    x = percent(layer.get('x', 0), width)
-    y = percent(layer.get('y', 0), height)
-    anchor = layer.get('anchor', 'top-left')
-    resize_w = layer.get('width', None)
-    resize_h = layer.get('height', None)
-    opacity = float(layer.get('opacity', 1.0))
-    angle = layer.get('angle', 0)
-    flip = bool(layer.get('flip', False))
-    flop = bool(layer.get('flop', False))
-    filters = layer.get('filters', [])
+def _blend_lut(degenerate, factor):
+    """Image.blend(degenerate, img, factor) on one band as a lookup table (blend truncates in float32)"""
+    degenerate = np.float32(degenerate)
+    values = degenerate + np.float32(factor) * (LEVELS - degenerate)
+    return np.clip(np.trunc(values), 0, 255).astype(np.uint8)
 
-    try:
-        img = Image.open(src).convert("RGBA")
-        print(f"Loaded image: {src}, size: {img.size}")
-    except Exception as e:
-        print(f"Error loading image {src}: {e}")
-        return
 
-    # Resize (support percent/string)
-    if resize_w and resize_h:
-        new_w = percent(resize_w, width)
-        new_h = percent(resize_h, height)
-        img = img.resize((new_w, new_h), resample=Image.LANCZOS)
-        print(f"Resized to: {new_w}x{new_h}")
+def _apply_color_filters(img, ops, opacity):
+    """
+    Apply consecutive color filters and the opacity multiply to an RGBA image.
+
+    Brightness and contrast are per-band lookups, so runs of them compose into
+    one table applied together with the alpha lookup. The image is only
+    materialized where the next step needs real pixels: grayscale conversion
+    and the contrast mean, which ImageEnhance takes from the clipped image.
+    """
+    lut = IDENTITY_LUT
+
+    def flush(img, lut):
+        if lut is IDENTITY_LUT:
+            return img
+        return img.point(lut.tolist() * 3 + IDENTITY_LUT.tolist())
+
+    for f in ops:
+        t = f.get('type')
+        if t == "grayscale":
+            img = flush(img, lut)
+            lut = IDENTITY_LUT
+            luma = img.convert('L')
+            img = Image.merge('RGBA', (luma, luma, luma, img.getchannel('A')))
+        elif t == "brightness_contrast":
+            brightness = float(f.get('brightness', 1.0))
+            contrast = float(f.get('contrast', 1.0))
+            if brightness != 1.0:
+                lut = _blend_lut(0, brightness)[lut]
+            if contrast != 1.0:
+                img = flush(img, lut)
+                mean = int(ImageStat.Stat(img.convert('L')).mean[0] + 0.5)
+                lut = _blend_lut(mean, contrast)
+
+    if opacity >= 1.0:
+        return flush(img, lut)
+    alpha_lut = np.floor(np.arange(256) * max(opacity, 0.0)).astype(np.uint8)
+    return img.point(lut.tolist() * 3 + alpha_lut.tolist())
+
+
+def apply_image_filters(img, filters, opacity=1.0):
+    """
+    Apply an image layer's filter chain and opacity to an RGBA image.
+
+    Output matches the per-filter ImageEnhance chain. Consecutive color
+    filters are composed into lookup tables and applied together with the
+    opacity multiply; gaussian_blur is the only stage that runs on its own.
+    """
+    pending = []
+    for f in filters or []:
+        t = f.get('type')
+        if t == "gaussian_blur":
+            if pending:
+                img = _apply_color_filters(img, pending, 1.0)
+                pending = []
+            img = img.filter(ImageFilter.GaussianBlur(f.get('radius', 5)))
+        elif t in COLOR_FILTERS:
+            pending.append(f)
+
+    if pending or opacity < 1.0:
+        img = _apply_color_filters(img, pending, opacity)
+    return img
+
+
+def draw_image_layer(base, layer, width, height, origin=(0, 0)):
+    # layer is a compiled_layers.ImageLayer (missing files are dropped at compile time);
+    # base covers the canvas from origin
+    print("image layer called")
+
+    src = layer.src
+    x, y = layer.x, layer.y
+    anchor = layer.anchor
+    opacity = layer.opacity
+    angle = layer.angle
+    flip = layer.flip
+    flop = layer.flop
+    filters = layer.filters
+    target_size = layer.target_size
+
+    # Prefer the pre-decoded, memory-mapped copy from the asset store
+    stored = open_asset(src, target_size)
+    if stored is not None:
+        print(f"Mapped image from asset store: {src}, size: {stored.size}")
+        if target_size and target_size != stored.size:
+            # Resample in premultiplied space, then un-premultiply once
+            stored = stored.resize(target_size, resample=Image.LANCZOS)
+            print(f"Resized to: {target_size[0]}x{target_size[1]}")
+        img = stored.convert("RGBA")
+    else:
+        try:
+            img = Image.open(src).convert("RGBA")
+            print(f"Loaded image: {src}, size: {img.size}")
+        except Exception as e:
+            print(f"Error loading image {src}: {e}")
+            return
+
+        # Resize (support percent/string)
+        if target_size:
+            img = img.resize(target_size, resample=Image.LANCZOS)
+            print(f"Resized to: {target_size[0]}x{target_size[1]}")
 
     # Flip/flop/rotate
     if flip:
@@ -46,27 +126,8 @@ def draw_image_layer(base, layer, width, height):
     if angle:
         img = img.rotate(angle, expand=1)
 
-    # Filters
-    for f in filters:
-        t = f.get('type')
-        if t == "gaussian_blur":
-            img = img.filter(ImageFilter.GaussianBlur(f.get('radius', 5)))
-        elif t == "grayscale":
-            # Better grayscale conversion
-            gray = img.convert('L')
-            img = Image.merge('LA', (gray, img.getchannel('A')))
-            img = img.convert('RGBA')
-        elif t == "brightness_contrast":
-            factor = f.get('brightness', 1.0)
-            img = ImageEnhance.Brightness(img).enhance(factor)
-            factor = f.get('contrast', 1.0)
-            img = ImageEnhance.Contrast(img).enhance(factor)
-
-    # Opacity
-    if opacity < 1.0:
-        alpha = img.getchannel('A')
-        alpha = alpha.point(lambda p: int(p * opacity))
-        img.putalpha(alpha)
+    # Filters + opacity in one fused pass (blur is the only separate stage)
+    img = apply_image_filters(img, filters, opacity)
 
     # Anchor positioning - Fix the logic
     img_w, img_h = img.size
@@ -106,7 +167,7 @@ def draw_image_layer(base, layer, width, height):
     if final_x < -img_w or final_y < -img_h or final_x > width or final_y > height:
         print(f"Warning: Image positioned outside canvas bounds")
     
-    base.alpha_composite(img, (final_x, final_y))
+    base.alpha_composite(img, (final_x - origin[0], final_y - origin[1]))
 
 # def draw_text_layer(base, layer, width, height):
 #     print("text layer called")
@@ -222,111 +283,159 @@ def draw_image_layer(base, layer, width, height):
 
 #     base.alpha_composite(txt_overlay)
 #     print("Text layer completed")
-def draw_text_layer(base, layer, width, height):
-    """
-    Renders a text layer on the given PIL Image (base), auto-fitting the font size
-    so the text always fits within (width, height) of its canvas region.
-    Includes fail-safes for font metrics quirks and robust anchor clamping.
-    """
-    from PIL import ImageFont, ImageDraw
-    import os
 
-    text = layer.get('text', '')
-    if not text:
-        print("No text provided")
-        return
-    
-    font_path = layer.get('font')
-    requested_size = int(layer.get('size', 32))
-    color = hex_to_rgba(layer.get('color', '#ffffff'))
-    x = percent(layer.get('x', 0), width)
-    y = percent(layer.get('y', 0), height)
-    anchor = layer.get('anchor', 'top-left')
-    align = layer.get('align', 'left')
-    opacity = float(layer.get('opacity', 1.0))
-    weight = layer.get('weight', 'normal')
-    stroke_color = hex_to_rgba(layer.get('stroke_color', '#000000')) if 'stroke_color' in layer else None
-    stroke_width = int(layer.get('stroke_width', 0))
-    line_height = float(layer.get('line_height', 1.0))
-    letter_spacing = int(layer.get('letter_spacing', 0))
-    transform = layer.get('transform', None)
-    shadow = layer.get('shadow', None)
-
-    # Text transform
+MIN_FONT_SIZE = 8
+
+
+@lru_cache(maxsize=256)
+def load_font(font_path, size):
+    """Font registry: load (and cache) a TrueType font, falling back to PIL's default"""
+    try:
+        if font_path and os.path.exists(font_path):
+            return ImageFont.truetype(font_path, size)
+    except Exception:
+        pass
+    return ImageFont.load_default()
+
+
+def apply_text_transform(text, transform):
     if transform == "uppercase":
-        text = text.upper()
+        return text.upper()
     elif transform == "lowercase":
-        text = text.lower()
+        return text.lower()
     elif transform == "capitalize":
-        text = text.title()
-
-    # Split lines and strip whitespace
-    lines = [line.strip() for line in text.split('\n')]
+        return text.title()
+    return text
+
+
+def _measure_lines(lines, font, size, line_height, letter_spacing):
+    """Measure lines at one font size; returns (block_w, block_h, line_sizes)"""
+    line_sizes = []
+    max_width = 0
+    total_height = 0
+    for line in lines:
+        bbox = font.getbbox(line)
+        w = bbox[2] - bbox[0]
+        h = bbox[3] - bbox[1]
+        line_sizes.append((w, h))
+        max_width = max(max_width, w + (len(line) - 1) * letter_spacing)
+        total_height += h
+    total_height += int(len(lines) - 1) * int(size * line_height - size)
+    return max_width, total_height, line_sizes
+
+
+def measure_text(text, font_path=None, size=32, box=None, line_height=1.0,
+                 letter_spacing=0, transform=None, fit=True):
+    """
+    Measure a text block without rendering it.
 
-    # Fit-text logic: find max font size that fits
-    min_font_size = 8
-    fit_font_size = requested_size
-    fit_font = None
-    text_block_w, text_block_h = None, None
+    With fit=True and a box (width, height), finds the largest font size
+    <= size (down to MIN_FONT_SIZE) whose block fits the box, using the same
+    metrics draw_text_layer uses. With fit=False the given size is measured
+    as-is.
 
-    dummy_img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
-    draw_dummy = ImageDraw.Draw(dummy_img)
-    
-    while fit_font_size >= min_font_size:
-        # Font load logic
-        try:
-            if font_path and os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, fit_font_size)
+    Returns a dict with the fitted 'size', whether it 'fits', the block
+    'width'/'height' and one 'lines' entry per line (text, x, y, width,
+    height) relative to the top-left of the block.
+    """
+    text = apply_text_transform(text, transform)
+    lines = [line.strip() for line in text.split('\n')]
+    size = int(size)
+
+    def fits_box(measured):
+        if box is None:
+            return True
+        return measured[0] <= box[0] and measured[1] <= box[1]
+
+    fitted_size = size
+    measured = _measure_lines(lines, load_font(font_path, size), size, line_height, letter_spacing)
+    fits = fits_box(measured)
+
+    if fit and not fits:
+        # Binary search for the largest size that fits
+        low, high = MIN_FONT_SIZE, size - 1
+        best = None
+        while low <= high:
+            mid = (low + high) // 2
+            candidate = _measure_lines(lines, load_font(font_path, mid), mid, line_height, letter_spacing)
+            if fits_box(candidate):
+                best = (mid, candidate)
+                low = mid + 1
             else:
-                font = ImageFont.load_default()
-        except Exception:
-            font = ImageFont.load_default()
-
-        line_widths = []
-        line_heights = []
-        max_line_width = 0
-        total_text_height = 0
-
-        for line in lines:
-            try:
-                bbox = draw_dummy.textbbox((0, 0), line, font=font)
-                w = bbox[2] - bbox[0]
-                h = bbox[3] - bbox[1]
-            except Exception:
-                w, h = draw_dummy.textsize(line, font=font)
-            line_widths.append(w)
-            line_heights.append(h)
-            max_line_width = max(max_line_width, w)
-            total_text_height += h
-
-        total_text_height += int(len(lines) - 1) * int(fit_font_size * line_height - fit_font_size)
-        spaced_line_widths = [lw + (len(line)-1)*letter_spacing for lw, line in zip(line_widths, lines)]
-        max_spaced_line_width = max(spaced_line_widths)
-
-        fits = (max_spaced_line_width <= width) and (total_text_height <= height)
-        if fits:
-            fit_font = font
-            text_block_w = max_spaced_line_width
-            text_block_h = total_text_height
-            break
-        fit_font_size -= 1
-
-    if fit_font is None:
-        fit_font = ImageFont.load_default()
-        min_font_size = int(layer.get("size", 32))
-        text_block_w = min_font_size * len(text) * 0.6
-        text_block_h = min_font_size * line_height * len(lines)
-
-    # --- ENTERPRISE FAIL-SAFES ---
-    # If font metrics are buggy and measured box is too small, force size
-    min_text_w = int(fit_font_size * len(text) * 0.6)
-    min_text_h = int(fit_font_size * line_height * len(lines))
-    if text_block_h < fit_font_size * 0.5:
-        print("WARN: Measured text box is much smaller than font size, forcing height to estimated.")
-        text_block_h = min_text_h
-    if text_block_w < fit_font_size * 0.5:
-        print("WARN: Measured text box is much smaller than font size, forcing width to estimated.")
-        text_block_w = min_text_w
+                high = mid - 1
+        if best:
+            fitted_size, measured = best
+            fits = True
+
+    font = load_font(font_path, fitted_size)
+    block_w, block_h, line_sizes = measured
+
+    if fit and not fits:
+        # Nothing fits: same estimate the renderer has always used
+        fitted_size = MIN_FONT_SIZE - 1
+        font = ImageFont.load_default()
+        requested = size
+        block_w = requested * len(text) * 0.6
+        block_h = requested * line_height * len(lines)
+        line_sizes = _measure_lines(lines, font, fitted_size, line_height, letter_spacing)[2]
+
+    # If font metrics are buggy and the measured box is too small, force the estimate
+    if block_h < fitted_size * 0.5:
+        block_h = int(fitted_size * line_height * len(lines))
+    if block_w < fitted_size * 0.5:
+        block_w = int(fitted_size * len(text) * 0.6)
+
+    line_boxes = []
+    cursor_y = 0
+    for line, (w, h) in zip(lines, line_sizes):
+        line_boxes.append({
+            "text": line,
+            "x": 0,
+            "y": cursor_y,
+            "width": w + max(0, len(line) - 1) * letter_spacing,
+            "height": h
+        })
+        cursor_y += int(h * line_height)
+
+    return {
+        "size": fitted_size,
+        "fits": fits,
+        "font": font,
+        "width": block_w,
+        "height": block_h,
+        "lines": line_boxes
+    }
+
+
+def draw_text_layer(base, layer, width, height, origin=(0, 0)):
+    """
+    Renders a text layer on the given PIL Image (base).
+
+    Layers resolved by the agent carry "fitted": true and are drawn at their
+    size as-is; older layers are auto-fitted here so the text fits within
+    (width, height) of its canvas region. layer is a compiled_layers.TextLayer.
+    base covers the canvas from origin; only that region is drawn.
+    """
+    requested_size = layer.size
+    color = layer.color
+    x, y = layer.x, layer.y
+    anchor = layer.anchor
+    opacity = layer.opacity
+    stroke_color = layer.stroke_color
+    stroke_width = layer.stroke_width
+    letter_spacing = layer.letter_spacing
+    shadow = layer.shadow
+
+    metrics = measure_text(
+        layer.text, layer.font_path, requested_size, (width, height),
+        line_height=layer.line_height, letter_spacing=letter_spacing,
+        transform=layer.transform, fit=not layer.fitted
+    )
+    fit_font = metrics['font']
+    fit_font_size = metrics['size']
+    text_block_w = metrics['width']
+    text_block_h = metrics['height']
+    lines = [line['text'] for line in metrics['lines']]
 
     # Clamp anchor position so block stays on canvas
     draw_x, draw_y = get_anchor_pos(anchor, width, height, int(text_block_w), int(text_block_h))
@@ -336,24 +445,27 @@ def draw_text_layer(base, layer, width, height):
     draw_x = max(0, min(draw_x, width - text_block_w))
     draw_y = max(0, min(draw_y, height - text_block_h))
 
-    # Create overlay for text drawing
-    txt_overlay = Image.new("RGBA", (width, height), (0,0,0,0))
+    # Create overlay for text drawing over the visible region. PIL truncates
+    # text coordinates, so the overlay only shifts them by whole pixels while
+    # they stay non-negative; that keeps glyph placement identical.
+    min_x = draw_x + min(0, shadow[0]) if shadow else draw_x
+    min_y = draw_y + min(0, shadow[1]) if shadow else draw_y
+    tx = min(origin[0], max(0, int(min_x)))
+    ty = min(origin[1], max(0, int(min_y)))
+    txt_overlay = acquire("RGBA", (origin[0] + base.size[0] - tx, origin[1] + base.size[1] - ty), (0,0,0,0))
     draw = ImageDraw.Draw(txt_overlay)
-    cursor_y = draw_y
 
     # Actual drawing
-    for idx, line in enumerate(lines):
+    for line_box in metrics['lines']:
+        line = line_box['text']
+        cursor_y = draw_y + line_box['y']
         if letter_spacing > 0:
             cx = draw_x
             for ch in line:
                 if shadow:
-                    sx = shadow.get('offset_x', 2)
-                    sy = shadow.get('offset_y', 2)
-                    scolor = hex_to_rgba(shadow.get('color', '#000000'))
-                    shadow_opacity = shadow.get('opacity', 0.5)
-                    scolor = (*scolor[:3], int(255 * shadow_opacity))
-                    draw.text((cx + sx, cursor_y + sy), ch, font=fit_font, fill=scolor)
-                draw.text((cx, cursor_y), ch, font=fit_font, fill=color, 
+                    sx, sy, scolor = shadow
+                    draw.text((cx + sx - tx, cursor_y + sy - ty), ch, font=fit_font, fill=scolor)
+                draw.text((cx - tx, cursor_y - ty), ch, font=fit_font, fill=color, 
                           stroke_fill=stroke_color, stroke_width=stroke_width)
                 try:
                     ch_w = draw.textlength(ch, font=fit_font)
@@ -362,26 +474,18 @@ def draw_text_layer(base, layer, width, height):
                 cx += ch_w + letter_spacing
         else:
             if shadow:
-                sx = shadow.get('offset_x', 2)
-                sy = shadow.get('offset_y', 2)
-                scolor = hex_to_rgba(shadow.get('color', '#000000'))
-                shadow_opacity = shadow.get('opacity', 0.5)
-                scolor = (*scolor[:3], int(255 * shadow_opacity))
-                draw.text((draw_x + sx, cursor_y + sy), line, font=fit_font, fill=scolor)
-            draw.text((draw_x, cursor_y), line, font=fit_font, fill=color, 
+                sx, sy, scolor = shadow
+                draw.text((draw_x + sx - tx, cursor_y + sy - ty), line, font=fit_font, fill=scolor)
+            draw.text((draw_x - tx, cursor_y - ty), line, font=fit_font, fill=color, 
                       stroke_fill=stroke_color, stroke_width=stroke_width)
-        try:
-            lh = draw.textbbox((0, 0), line, font=fit_font)[3] - draw.textbbox((0, 0), line, font=fit_font)[1]
-        except Exception:
-            lh = fit_font_size
-        cursor_y += int(lh * line_height)
 
     if opacity < 1.0:
         alpha = txt_overlay.getchannel('A')
         alpha = alpha.point(lambda p: int(p * opacity))
         txt_overlay.putalpha(alpha)
 
-    base.alpha_composite(txt_overlay)
+    base.alpha_composite(txt_overlay, (0, 0), (origin[0] - tx, origin[1] - ty))
+    release(txt_overlay)
     print("Text layer completed: size {}, anchor {}, x {}, y {}".format(fit_font_size, anchor, draw_x, draw_y))
     print("Requested size:", requested_size)
     print("Final font size:", fit_font_size)
@@ -392,38 +496,140 @@ def draw_text_layer(base, layer, width, height):
     print("Opacity:", opacity)
     print("Font loaded:", fit_font)
 
-def draw_ellipse(base, layer, width, height):
-    color = hex_to_rgba(layer['color'])
-    ele_w = percent(layer.get('width', 100), width)
-    ele_h = percent(layer.get('height', 100), height)
-    opacity = int(255 * layer.get('opacity', 1.0))
-    blur = layer.get('blur', 0)
-    anchor = layer.get('anchor', 'top-left')
-    x = percent(layer.get('x', 0), width)
-    y = percent(layer.get('y', 0), height)
+def draw_ellipse(base, layer, width, height, origin=(0, 0)):
+    # layer is a compiled_layers.Ellipse; base covers the canvas from origin
+    ele_w, ele_h = layer.size
     ellipse_img = Image.new("RGBA", (ele_w, ele_h), (0,0,0,0))
     draw = ImageDraw.Draw(ellipse_img)
-    draw.ellipse([0,0,ele_w,ele_h], fill=(*color[:3], opacity))
-    if blur > 0:
-        ellipse_img = ellipse_img.filter(ImageFilter.GaussianBlur(blur))
-    offset_x, offset_y = get_anchor_pos(anchor, width, height, ele_w, ele_h)
-    base.alpha_composite(ellipse_img, (int(offset_x + x), int(offset_y + y)))
-
-def draw_polygon(base, layer, width, height):
-    color = hex_to_rgba(layer['color'])
-    points = layer['points']
-    # Find bounding box
-    pxs = [percent(x, width) for x, _ in points]
-    pys = [percent(y, height) for _, y in points]
-    min_x, max_x = min(pxs), max(pxs)
-    min_y, max_y = min(pys), max(pys)
-    w, h = max_x - min_x, max_y - min_y
-    opacity = int(255 * layer.get('opacity', 1.0))
-    blur = layer.get('blur', 0)
-    poly_img = Image.new("RGBA", (w, h), (0,0,0,0))
+    draw.ellipse([0,0,ele_w,ele_h], fill=layer.fill)
+    if layer.blur > 0:
+        ellipse_img = ellipse_img.filter(ImageFilter.GaussianBlur(layer.blur))
+    base.alpha_composite(ellipse_img, (layer.position[0] - origin[0], layer.position[1] - origin[1]))
+
+def draw_polygon(base, layer, width, height, origin=(0, 0)):
+    # layer is a compiled_layers.Polygon, points relative to its bounding box;
+    # base covers the canvas from origin
+    poly_img = Image.new("RGBA", layer.size, (0,0,0,0))
     draw = ImageDraw.Draw(poly_img)
-    norm_pts = [(x - min_x, y - min_y) for x, y in zip(pxs, pys)]
-    draw.polygon(norm_pts, fill=(*color[:3], opacity))
-    if blur > 0:
-        poly_img = poly_img.filter(ImageFilter.GaussianBlur(blur))
-    base.alpha_composite(poly_img, (int(min_x), int(min_y)))
\ No newline at end of file
+    draw.polygon(layer.points, fill=layer.fill)
+    if layer.blur > 0:
+        poly_img = poly_img.filter(ImageFilter.GaussianBlur(layer.blur))
+    base.alpha_composite(poly_img, (layer.position[0] - origin[0], layer.position[1] - origin[1]))
+
+# Batches smaller than this always share a surface, however sparse
+MIN_BATCH_AREA = 128 * 128
+
+
+def draw_shape_instances(base, layer, width, height, origin=(0, 0)):
+    """
+    Draw many ellipses or polygons from one layer.
+
+    Runs of consecutive instances sharing (blur, opacity) are split into
+    compact batches. Each batch is rasterized in a single pass into one
+    surface cropped to its instances plus the blur radius, blurred once and
+    composited once, so instances keep their draw order. Within a batch,
+    later instances paint over earlier ones (opacity acts like a group
+    opacity where they overlap). layer is a compiled_layers.ShapeInstances,
+    whose instances are already resolved into pixel boxes. base covers the
+    canvas from origin; batches that do not reach it are skipped.
+    """
+    shape = layer.shape
+    template = layer.template
+
+    for (blur, opacity), run in layer.runs:
+        if opacity <= 0:
+            continue
+        # Crop batches to their instances plus the blur radius
+        for instances in _batch_instances(run, blur):
+            _draw_instance_batch(base, shape, template, instances, blur, opacity, blur, width, height, origin)
+
+
+def _instance_bounds(instance):
+    """Pixel bounds of one instance, widened to the circumscribed box when rotated"""
+    left, top, inst_w, inst_h, _, rotation = instance
+    if rotation % 360 == 0:
+        return left, top, left + inst_w, top + inst_h
+    cx, cy = left + inst_w / 2, top + inst_h / 2
+    radius = int(np.ceil(np.hypot(inst_w, inst_h) / 2))
+    return int(cx) - radius, int(cy) - radius, int(cx) + radius, int(cy) + radius
+
+
+def _batch_instances(instances, margin):
+    """
+    Split a run into batches of consecutive instances that share one surface.
+
+    An instance joins the current batch while the batch's padded bounding box
+    stays compact (at most twice the summed instance area, or a small fixed
+    area); otherwise it starts a new batch. Batches keep draw order, so sparse
+    instances get small surfaces instead of one canvas-sized one.
+    """
+    batches = []
+    box = None
+    covered = 0
+    for inst in instances:
+        x0, y0, x1, y1 = _instance_bounds(inst)
+        x0, y0, x1, y1 = x0 - margin, y0 - margin, x1 + margin, y1 + margin
+        area = (x1 - x0) * (y1 - y0)
+        if box is not None:
+            merged = (min(box[0], x0), min(box[1], y0), max(box[2], x1), max(box[3], y1))
+            merged_area = (merged[2] - merged[0]) * (merged[3] - merged[1])
+            if merged_area <= max(MIN_BATCH_AREA, 2 * (covered + area)):
+                batches[-1].append(inst)
+                box = merged
+                covered += area
+                continue
+        batches.append([inst])
+        box = (x0, y0, x1, y1)
+        covered = area
+    return batches
+
+
+def _draw_instance_batch(base, shape, template, instances, blur, opacity, margin, width, height, origin=(0, 0)):
+    """Rasterize one batch into a single surface, blur it once and composite it once"""
+    bounds = [_instance_bounds(inst) for inst in instances]
+    min_x = max(0, min(b[0] for b in bounds) - margin)
+    min_y = max(0, min(b[1] for b in bounds) - margin)
+    max_x = min(width, max(b[2] for b in bounds) + margin)
+    max_y = min(height, max(b[3] for b in bounds) + margin)
+    if max_x <= min_x or max_y <= min_y:
+        return
+    ox, oy = origin
+    if max_x <= ox or max_y <= oy or min_x >= ox + base.size[0] or min_y >= oy + base.size[1]:
+        return
+
+    size = (max_x - min_x, max_y - min_y)
+    alpha = int(255 * opacity)
+    colors = {inst[4][:3] for inst in instances}
+    if blur > 0 and len(colors) == 1:
+        # One colour: blur only the coverage, then fill it with the colour
+        # (a quarter of the blur work, and no dark fringe at the edges)
+        mask = Image.new("L", size, 0)
+        _rasterize_instances(ImageDraw.Draw(mask), shape, template, instances, min_x, min_y, lambda color: alpha)
+        surface = Image.new("RGBA", size, (*colors.pop(), 0))
+        surface.putalpha(mask.filter(ImageFilter.GaussianBlur(blur)))
+    else:
+        surface = Image.new("RGBA", size, (0, 0, 0, 0))
+        _rasterize_instances(ImageDraw.Draw(surface), shape, template, instances, min_x, min_y,
+                             lambda color: (*color[:3], alpha))
+        if blur > 0:
+            surface = surface.filter(ImageFilter.GaussianBlur(blur))
+    base.alpha_composite(surface, (min_x - ox, min_y - oy))
+
+
+def _rasterize_instances(draw, shape, template, instances, min_x, min_y, fill_for):
+    """Draw instances into a surface whose top-left is (min_x, min_y); fill_for maps an rgba to the fill"""
+    for left, top, inst_w, inst_h, color, rotation in instances:
+        x0, y0 = left - min_x, top - min_y
+        fill = fill_for(color)
+        if shape == 'polygon':
+            cx, cy = x0 + inst_w / 2, y0 + inst_h / 2
+            theta = np.deg2rad(rotation)
+            cos_t, sin_t = np.cos(theta), np.sin(theta)
+            pts = []
+            for u, v in template:
+                dx = (float(u) - 0.5) * inst_w
+                dy = (float(v) - 0.5) * inst_h
+                pts.append((cx + dx * cos_t - dy * sin_t, cy + dx * sin_t + dy * cos_t))
+            draw.polygon(pts, fill=fill)
+        else:
+            draw.ellipse([x0, y0, x0 + inst_w, y0 + inst_h], fill=fill)
@@ -1,49 +1,32 @@
 import numpy as np
 from PIL import Image, ImageDraw, ImageFilter
-from utils import hex_to_rgba, percent, get_anchor_pos
+from buffer_pool import acquire, acquire_array, release
+from compiled_layers import RadialGradient
 
 
-def draw_radial_gradient(base, layer, width, height):
-    # Support both old format (start_color, end_color) and new format (colors array)
-    if 'colors' in layer:
-        colors = [hex_to_rgba(color) for color in layer['colors']]
-        # Optional: custom stop positions (default: evenly spaced)
-        stops = layer.get('stops', None)
-        if stops is None:
-            stops = np.linspace(0, 1, len(colors))
-    else:
-        # Backward compatibility with old format
-        colors = [hex_to_rgba(layer['start_color']), hex_to_rgba(layer['end_color'])]
-        stops = [0, 1]
-    
-    center_x = percent(layer.get('x', '50%'), width)
-    center_y = percent(layer.get('y', '50%'), height)
-    grad_w = percent(layer.get('width', width), width)
-    grad_h = percent(layer.get('height', height), height)
-    opacity = layer.get('opacity', 1.0)
-    anchor = layer.get('anchor', 'top-left')
+def draw_radial_gradient(base, layer, width, height, origin=(0, 0)):
+    # layer is a compiled_layers.RadialGradient; base covers the canvas from origin
+    colors = layer.colors
+    stops = layer.stops
+    opacity = layer.opacity
     
-    # Create gradient on the full canvas size to avoid rectangular artifacts
-    y, x = np.ogrid[:height, :width]
+    # Evaluate the gradient for every visible canvas pixel (no rectangular artifacts)
+    ox, oy = origin
+    region_w, region_h = base.size
+    y, x = np.ogrid[oy:oy + region_h, ox:ox + region_w]
     
-    # Get the actual position where gradient center should be
-    offset_x, offset_y = get_anchor_pos(anchor, width, height, grad_w, grad_h)
-    actual_center_x = offset_x + center_x
-    actual_center_y = offset_y + center_y
+    # Calculate distance from the (anchored) center
+    dx = x - layer.center_x
+    dy = y - layer.center_y
     
-    # Calculate distance from center
-    dx = x - actual_center_x
-    dy = y - actual_center_y
-    
-    # Use the smaller dimension as radius for circular gradient
-    max_radius = min(grad_w, grad_h) / 2
+    max_radius = layer.max_radius
     distance = np.sqrt(dx**2 + dy**2)
     
     # Normalize distance (0 at center, 1 at max_radius)
     normalized_distance = np.clip(distance / max_radius, 0, 1)
     
-    # Create the gradient array for full canvas
-    grad_array = np.zeros((height, width, 4), dtype=np.uint8)
+    # Create the gradient array for the visible region
+    grad_array = acquire_array((region_h, region_w, 4))
     
     # Multi-color gradient blending
     for c in range(3):  # RGB channels
@@ -81,39 +64,29 @@ def draw_radial_gradient(base, layer, width, height):
     
     grad_img = Image.fromarray(grad_array, mode='RGBA')
     base.alpha_composite(grad_img, (0, 0))
+    release(grad_array)
 
-def draw_linear_gradient(base, layer, width, height):
-    colors = [hex_to_rgba(c) for c in layer.get('colors')]
-    stops = layer.get('stops', np.linspace(0, 1, len(colors)))
-    angle_deg = float(layer.get('angle', 0)) # 0: left-to-right, 90: top-to-bottom
-
-    opacity = layer.get('opacity', 1.0)
-    grad_w = percent(layer.get('width', width), width)
-    grad_h = percent(layer.get('height', height), height)
-    anchor = layer.get('anchor', 'top-left')
+def draw_linear_gradient(base, layer, width, height, origin=(0, 0)):
+    # layer is a compiled_layers.LinearGradient; base covers the canvas from origin
+    colors = layer.colors
+    stops = layer.stops
+    opacity = layer.opacity
+    x0, y0 = layer.start
 
-    # Angle in radians, origin at left border, angle 0 = horizontal
-    theta = np.deg2rad(angle_deg)
-
-    # Linear axis: compute start and end points based on anchor and angle
-    offset_x, offset_y = get_anchor_pos(anchor, width, height, grad_w, grad_h)
-    x0 = offset_x
-    y0 = offset_y
-    x1 = x0 + grad_w * np.cos(theta)
-    y1 = y0 + grad_h * np.sin(theta)
-
-    # Each pixel's projection onto the gradient vector
-    y, x = np.ogrid[:height, :width]
+    # Each visible pixel's projection onto the gradient vector
+    ox, oy = origin
+    region_w, region_h = base.size
+    y, x = np.ogrid[oy:oy + region_h, ox:ox + region_w]
     px = x - x0
     py = y - y0
-    grad_vec = np.array([x1-x0, y1-y0])
+    grad_vec = np.array(layer.vector)
     grad_vec_norm = np.linalg.norm(grad_vec)
     if grad_vec_norm == 0:
         grad_vec_norm = 1
     proj = (px * grad_vec[0] + py * grad_vec[1]) / grad_vec_norm**2
     normalized_pos = np.clip(proj, 0, 1)
 
-    grad_array = np.zeros((height, width, 4), dtype=np.uint8)
+    grad_array = acquire_array((region_h, region_w, 4))
     for c in range(3):
         color_values = np.full_like(normalized_pos, colors[0][c], dtype=float)
         for i in range(len(colors)-1):
@@ -131,19 +104,22 @@ def draw_linear_gradient(base, layer, width, height):
     grad_array[..., 3] = int((opacity * 255))
     grad_img = Image.fromarray(grad_array, mode='RGBA')
     base.alpha_composite(grad_img, (0,0))
+    release(grad_array)
 
 # MESH GRADIENT: Multiple color anchors
-def draw_mesh_gradient(base, layer, width, height):
-    control_points = layer['mesh_points'] # List of {"x":..., "y":..., "color":...} dicts
-    points = [(percent(pt["x"], width), percent(pt["y"], height)) for pt in control_points]
-    colors = [hex_to_rgba(pt["color"]) for pt in control_points]
-    opacity = layer.get('opacity', 1.0)
-    grad_array = np.zeros((height, width, 4), dtype=np.uint8)
-    y, x = np.ogrid[:height, :width]
+def draw_mesh_gradient(base, layer, width, height, origin=(0, 0)):
+    # layer is a compiled_layers.MeshGradient; base covers the canvas from origin
+    points = layer.points
+    colors = layer.colors
+    opacity = layer.opacity
+    ox, oy = origin
+    region_w, region_h = base.size
+    grad_array = acquire_array((region_h, region_w, 4))
+    y, x = np.ogrid[oy:oy + region_h, ox:ox + region_w]
     for c in range(3):
         # Inverse-distance weighted blending per channel
-        weighted = np.zeros((height, width), dtype=float)
-        total_w = np.zeros((height, width), dtype=float)
+        weighted = acquire_array((region_h, region_w), dtype=float)
+        total_w = acquire_array((region_h, region_w), dtype=float)
 
         for (px, py), color in zip(points, colors):
             dist = np.sqrt((x - px) ** 2 + (y - py) ** 2)
@@ -153,67 +129,69 @@ def draw_mesh_gradient(base, layer, width, height):
             weighted += color[c] * w
             total_w += w
         grad_array[..., c] = (weighted / total_w).astype(np.uint8)
+        release(weighted)
+        release(total_w)
     grad_array[..., 3] = int((opacity * 255))
     grad_img = Image.fromarray(grad_array, mode='RGBA')
     base.alpha_composite(grad_img,(0,0))
+    release(grad_array)
 
 # SHAPE BLUR GRADIENT: Gradient with blur in custom mask (ellipse/circle/rect)
-def draw_shape_blur_gradient(base, layer, width, height):
-    # Draw the base gradient first (reuse one of the other functions, e.g., radial or linear)
-    temp_img = Image.new('RGBA', (width, height), (0,0,0,0))
-    temp_layer = layer.copy()
-    temp_layer['opacity'] = 1.0  # blur works better before alpha adjustment
-    if layer.get('shape_gradient_type', 'linear') == 'radial':
-        draw_radial_gradient(temp_img, temp_layer, width, height)
+def draw_shape_blur_gradient(base, layer, width, height, origin=(0, 0)):
+    # layer is a compiled_layers.ShapeBlurGradient; base covers the canvas from origin.
+    # The blur reads neighbouring pixels, so the layer is built for the whole
+    # canvas and only the visible part is composited.
+    # Draw the base gradient first (compiled fully opaque: blur works better before alpha adjustment)
+    temp_img = acquire('RGBA', (width, height), (0,0,0,0))
+    if isinstance(layer.gradient, RadialGradient):
+        draw_radial_gradient(temp_img, layer.gradient, width, height)
     else:
-        draw_linear_gradient(temp_img, temp_layer, width, height)
+        draw_linear_gradient(temp_img, layer.gradient, width, height)
     # Create a mask for shape
-    shape = layer.get('shape', 'ellipse') # "ellipse" or "rect"
-    mask = Image.new('L', (width, height), 0)
-    draw = ImageDraw.Draw(mask)
-    shape_x = percent(layer.get('shape_x', '0%'), width)
-    shape_y = percent(layer.get('shape_y', '0%'), height)
-    shape_w = percent(layer.get('shape_width', '100%'), width)
-    shape_h = percent(layer.get('shape_height', '100%'), height)
-    rect = (shape_x, shape_y, shape_x + shape_w, shape_y + shape_h)
-    mask = Image.new('L', (width, height), 0)
+    mask = acquire('L', (width, height), 0)
     draw = ImageDraw.Draw(mask)
-    if shape == 'ellipse':
-        draw.ellipse(rect, fill=255)
+    if layer.shape == 'ellipse':
+        draw.ellipse(layer.rect, fill=255)
     else:
-        draw.rectangle(rect, fill=255)
+        draw.rectangle(layer.rect, fill=255)
     # Apply mask and blur
-    blurred = temp_img.filter(ImageFilter.GaussianBlur(radius=layer.get('blur_radius', 20)))
-    gradient_masked = Image.composite(blurred, Image.new('RGBA', (width,height)), mask)
-    gradient_masked.putalpha(int(layer.get('opacity', 1.0) * 255))
-    base.alpha_composite(gradient_masked, (0,0))
+    blurred = temp_img.filter(ImageFilter.GaussianBlur(radius=layer.blur_radius))
+    release(temp_img)
+    # Same as Image.composite(blurred, transparent, mask), into a pooled buffer
+    gradient_masked = acquire('RGBA', (width, height), (0,0,0,0))
+    gradient_masked.paste(blurred, (0, 0), mask)
+    release(mask)
+    gradient_masked.putalpha(int(layer.opacity * 255))
+    ox, oy = origin
+    base.alpha_composite(gradient_masked, (0,0), (ox, oy, ox + base.size[0], oy + base.size[1]))
+    release(gradient_masked)
 
-def draw_color_overlay(base, layer, width, height):
-    color = hex_to_rgba(layer['color'])
-    overlay_w = percent(layer.get('width', width), width)
-    overlay_h = percent(layer.get('height', height), height)
-    x = percent(layer.get('x', 0), width)
-    y = percent(layer.get('y', 0), height)
-    anchor = layer.get('anchor', 'top-left')
-    opacity = int(255 * layer.get('opacity', 1.0))
-    blur = layer.get('blur', 0)
-    overlay = Image.new("RGBA", (overlay_w, overlay_h), (*color[:3], opacity))
-    if blur > 0:
-        overlay = overlay.filter(ImageFilter.GaussianBlur(blur))
-    offset_x, offset_y = get_anchor_pos(anchor, width, height, overlay_w, overlay_h)
-    base.alpha_composite(overlay, (int(offset_x + x), int(offset_y + y)))
+def draw_color_overlay(base, layer, width, height, origin=(0, 0)):
+    # layer is a compiled_layers.ColorOverlay; base covers the canvas from origin
+    ox, oy = origin
+    x, y = layer.position
+    if layer.blur > 0:
+        overlay = Image.new("RGBA", layer.size, layer.fill)
+        overlay = overlay.filter(ImageFilter.GaussianBlur(layer.blur))
+        base.alpha_composite(overlay, (x - ox, y - oy))
+        return
+    # A solid fill only needs its visible part
+    left, top = max(x, ox), max(y, oy)
+    right = min(x + layer.size[0], ox + base.size[0])
+    bottom = min(y + layer.size[1], oy + base.size[1])
+    if right > left and bottom > top:
+        base.alpha_composite(Image.new("RGBA", (right - left, bottom - top), layer.fill), (left - ox, top - oy))
 
-def draw_spray_noise(base, layer, width, height):
-    # "center_x", "center_y", "radius_x", "radius_y" in px or percent, "strength", "opacity"
-    center_x = percent(layer.get('center_x', '70%'), width)
-    center_y = percent(layer.get('center_y', '20%'), height)
-    rx = percent(layer.get('radius_x', '30%'), width)
-    ry = percent(layer.get('radius_y', '15%'), height)
-    color1 = hex_to_rgba(layer.get('color1', "#44defb"))
-    color2 = hex_to_rgba(layer.get('color2', "#d97bfd"))
-    opacity = float(layer.get('opacity', 0.2))
-    noise_scale = layer.get('noise_scale', 1.6)  # higher = finer dots
-    strength = layer.get('strength', 0.7)  # lower = more holes
+def draw_spray_noise(base, layer, width, height, origin=(0, 0)):
+    # layer is a compiled_layers.SprayNoise; base covers the canvas from origin.
+    # Noise is drawn for the whole canvas so the random stream does not
+    # depend on what is visible.
+    center_x, center_y = layer.center_x, layer.center_y
+    rx, ry = layer.radius_x, layer.radius_y
+    color1, color2 = layer.color1, layer.color2
+    opacity = layer.opacity
+    noise_scale = layer.noise_scale  # higher = finer dots
+    strength = layer.strength  # lower = more holes
 
     yy, xx = np.ogrid[:height, :width]
     ellipse_mask = (((xx-center_x)/rx)**2 + ((yy-center_y)/ry)**2) <= 1.0
@@ -221,12 +199,16 @@ def draw_spray_noise(base, layer, width, height):
     noise = np.random.rand(height, width)
     noise = (noise + 0.5 * np.random.rand(height, width) / noise_scale)
     mask = (noise > strength) & ellipse_mask
-    out_arr = np.zeros((height, width, 4), dtype=np.uint8)
+    ox, oy = origin
+    region_w, region_h = base.size
+    mask = mask[oy:oy + region_h, ox:ox + region_w]
+    out_arr = acquire_array((region_h, region_w, 4))
     # Blend uniformly between color1 and color2 in ellipse region
-    blend_map = np.linspace(0, 1, width)[None, :]  # H x W
+    blend_map = np.linspace(0, 1, width)[None, ox:ox + region_w]  # H x W
     for c in range(3):
         out_arr[..., c] = (color1[c] * (1-blend_map) + color2[c] * blend_map).astype(np.uint8)
     out_arr[..., 3] = np.where(mask, int(255 * opacity), 0)
 
     img = Image.fromarray(out_arr, mode="RGBA")
-    base.alpha_composite(img, (0, 0))
\ No newline at end of file
+    base.alpha_composite(img, (0, 0))
+    release(out_arr)
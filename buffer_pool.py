@@ -0,0 +1,153 @@
+# buffer_pool.py
+"""
+Per-render pool of reusable scratch buffers.
+
+A poster render creates many same-sized RGBA/L images and NumPy pixel arrays
+that only live until they are composited into their parent. Inside
+render_pool(), acquire()/acquire_array() hand out a cleared buffer of the
+requested mode and size, reusing one released earlier in the same render, and
+release() gives it back. Outside a pool they fall back to Image.new/np.zeros
+and release() is a no-op, so drawers still work when called standalone.
+"""
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Idle buffers kept for reuse; older ones are dropped past this budget
+MAX_IDLE_BYTES = 3 * 1920 * 1080 * 4
+
+
+def _buffer_key(buf) -> Tuple:
+    if isinstance(buf, np.ndarray):
+        return ("array", buf.shape, buf.dtype.str)
+    return ("image", buf.mode, buf.size)
+
+
+def _buffer_bytes(buf) -> int:
+    if isinstance(buf, np.ndarray):
+        return buf.nbytes
+    return buf.width * buf.height * len(buf.getbands())
+
+
+class BufferPool:
+    """Free lists of scratch buffers keyed by mode/shape and size"""
+
+    def __init__(self, max_idle_bytes: int = MAX_IDLE_BYTES):
+        self.max_idle_bytes = max_idle_bytes
+        self._free: Dict[Tuple, List] = {}
+        self._idle_order = deque()
+        self._idle_ids = set()
+        self._idle_bytes = 0
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.reuses = 0
+
+    def _take(self, key):
+        with self._lock:
+            free = self._free.get(key)
+            if not free:
+                return None
+            buf = free.pop()
+            self._idle_ids.discard(id(buf))
+            self._idle_bytes -= _buffer_bytes(buf)
+            return buf
+
+    def acquire(self, mode: str, size: Tuple[int, int], color=0) -> Image.Image:
+        """Return a `mode` image of `size` filled with `color`"""
+        size = (int(size[0]), int(size[1]))
+        img = self._take(("image", mode, size))
+        if img is None:
+            self.allocations += 1
+            return Image.new(mode, size, color)
+        self.reuses += 1
+        img.paste(color, (0, 0) + size)
+        return img
+
+    def acquire_array(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """Return a zeroed array of `shape` and `dtype`"""
+        shape = tuple(int(dim) for dim in shape)
+        arr = self._take(("array", shape, np.dtype(dtype).str))
+        if arr is None:
+            self.allocations += 1
+            return np.zeros(shape, dtype=dtype)
+        self.reuses += 1
+        arr.fill(0)
+        return arr
+
+    def release(self, buf):
+        """Return a buffer to the pool; the caller must not use it afterwards"""
+        if buf is None:
+            return
+        nbytes = _buffer_bytes(buf)
+        if nbytes > self.max_idle_bytes:
+            return
+        with self._lock:
+            if id(buf) in self._idle_ids:
+                return
+            self._free.setdefault(_buffer_key(buf), []).append(buf)
+            self._idle_order.append(buf)
+            self._idle_ids.add(id(buf))
+            self._idle_bytes += nbytes
+            # Drop the oldest idle buffers once over budget
+            while self._idle_bytes > self.max_idle_bytes and self._idle_order:
+                old = self._idle_order.popleft()
+                if id(old) not in self._idle_ids:
+                    continue
+                self._free[_buffer_key(old)].remove(old)
+                self._idle_ids.discard(id(old))
+                self._idle_bytes -= _buffer_bytes(old)
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+            self._idle_order.clear()
+            self._idle_ids.clear()
+            self._idle_bytes = 0
+
+    def stats(self) -> Dict:
+        return {"allocations": self.allocations, "reuses": self.reuses}
+
+
+_current_pool: ContextVar[Optional[BufferPool]] = ContextVar("buffer_pool", default=None)
+
+
+@contextmanager
+def render_pool():
+    """Scope a buffer pool to one render; nested scopes share the outer pool"""
+    pool = _current_pool.get()
+    if pool is not None:
+        yield pool
+        return
+
+    pool = BufferPool()
+    token = _current_pool.set(pool)
+    try:
+        yield pool
+    finally:
+        _current_pool.reset(token)
+        pool.clear()
+
+
+def acquire(mode: str, size: Tuple[int, int], color=0) -> Image.Image:
+    pool = _current_pool.get()
+    if pool is None:
+        return Image.new(mode, (int(size[0]), int(size[1])), color)
+    return pool.acquire(mode, size, color)
+
+
+def acquire_array(shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+    pool = _current_pool.get()
+    if pool is None:
+        return np.zeros(shape, dtype=dtype)
+    return pool.acquire_array(shape, dtype)
+
+
+def release(buf):
+    pool = _current_pool.get()
+    if pool is not None:
+        pool.release(buf)
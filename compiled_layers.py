@@ -0,0 +1,502 @@
+# compiled_layers.py
+"""
+Typed, precompiled layer representation.
+
+compile_layer() turns a layer dict into a __slots__ object with every unit,
+color, anchor and default resolved for one canvas size: pixel values instead
+of "50%" strings, RGBA tuples instead of hex strings, anchor offsets instead
+of anchor names. The drawers in background.py and assets.py only read these
+objects, so a layer is parsed once per canvas size instead of on every draw.
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils import hex_to_rgba, percent, get_anchor_pos
+
+RGBA = Tuple[int, int, int, int]
+
+# Default polygon template for instanced shapes: a triangle in the unit box
+DEFAULT_INSTANCE_POINTS = [[0.5, 0.0], [1.0, 1.0], [0.0, 1.0]]
+
+
+class CompiledLayer:
+    """Base class; width/height are the canvas size the layer was compiled for"""
+    __slots__ = ('width', 'height')
+
+
+class RadialGradient(CompiledLayer):
+    __slots__ = ('colors', 'stops', 'center_x', 'center_y', 'max_radius', 'opacity')
+
+    def __init__(self, width: int, height: int, colors: List[RGBA], stops, center_x: int,
+                 center_y: int, max_radius: float, opacity: float):
+        self.width, self.height = width, height
+        self.colors = colors
+        self.stops = stops
+        self.center_x = center_x
+        self.center_y = center_y
+        self.max_radius = max_radius
+        self.opacity = opacity
+
+
+class LinearGradient(CompiledLayer):
+    __slots__ = ('colors', 'stops', 'start', 'vector', 'opacity')
+
+    def __init__(self, width: int, height: int, colors: List[RGBA], stops,
+                 start: Tuple[float, float], vector: Tuple[float, float], opacity: float):
+        self.width, self.height = width, height
+        self.colors = colors
+        self.stops = stops
+        self.start = start
+        self.vector = vector
+        self.opacity = opacity
+
+
+class MeshGradient(CompiledLayer):
+    __slots__ = ('points', 'colors', 'opacity')
+
+    def __init__(self, width: int, height: int, points: List[Tuple[int, int]],
+                 colors: List[RGBA], opacity: float):
+        self.width, self.height = width, height
+        self.points = points
+        self.colors = colors
+        self.opacity = opacity
+
+
+class ShapeBlurGradient(CompiledLayer):
+    __slots__ = ('gradient', 'shape', 'rect', 'blur_radius', 'opacity')
+
+    def __init__(self, width: int, height: int, gradient: CompiledLayer, shape: str,
+                 rect: Tuple[int, int, int, int], blur_radius: float, opacity: float):
+        self.width, self.height = width, height
+        self.gradient = gradient
+        self.shape = shape
+        self.rect = rect
+        self.blur_radius = blur_radius
+        self.opacity = opacity
+
+
+class ColorOverlay(CompiledLayer):
+    __slots__ = ('fill', 'size', 'position', 'blur')
+
+    def __init__(self, width: int, height: int, fill: RGBA, size: Tuple[int, int],
+                 position: Tuple[int, int], blur: float):
+        self.width, self.height = width, height
+        self.fill = fill
+        self.size = size
+        self.position = position
+        self.blur = blur
+
+
+class SprayNoise(CompiledLayer):
+    __slots__ = ('center_x', 'center_y', 'radius_x', 'radius_y', 'color1', 'color2',
+                 'opacity', 'noise_scale', 'strength')
+
+    def __init__(self, width: int, height: int, center_x: int, center_y: int, radius_x: int,
+                 radius_y: int, color1: RGBA, color2: RGBA, opacity: float,
+                 noise_scale: float, strength: float):
+        self.width, self.height = width, height
+        self.center_x = center_x
+        self.center_y = center_y
+        self.radius_x = radius_x
+        self.radius_y = radius_y
+        self.color1 = color1
+        self.color2 = color2
+        self.opacity = opacity
+        self.noise_scale = noise_scale
+        self.strength = strength
+
+
+class Ellipse(CompiledLayer):
+    __slots__ = ('fill', 'size', 'position', 'blur')
+
+    def __init__(self, width: int, height: int, fill: RGBA, size: Tuple[int, int],
+                 position: Tuple[int, int], blur: float):
+        self.width, self.height = width, height
+        self.fill = fill
+        self.size = size
+        self.position = position
+        self.blur = blur
+
+
+class Polygon(CompiledLayer):
+    __slots__ = ('fill', 'points', 'size', 'position', 'blur')
+
+    def __init__(self, width: int, height: int, fill: RGBA, points: List[Tuple[int, int]],
+                 size: Tuple[int, int], position: Tuple[int, int], blur: float):
+        self.width, self.height = width, height
+        self.fill = fill
+        self.points = points
+        self.size = size
+        self.position = position
+        self.blur = blur
+
+
+class ShapeInstances(CompiledLayer):
+    __slots__ = ('shape', 'template', 'runs')
+
+    def __init__(self, width: int, height: int, shape: str, template: List,
+                 runs: List[Tuple[Tuple[int, float], List[Tuple]]]):
+        self.width, self.height = width, height
+        self.shape = shape
+        self.template = template
+        # Consecutive instances sharing (blur, opacity), in draw order:
+        # [((blur, opacity), [(left, top, width, height, rgba, rotation), ...]), ...]
+        self.runs = runs
+
+
+class ImageLayer(CompiledLayer):
+    __slots__ = ('src', 'x', 'y', 'anchor', 'target_size', 'opacity', 'angle', 'flip', 'flop', 'filters')
+
+    def __init__(self, width: int, height: int, src: str, x: int, y: int, anchor: str,
+                 target_size: Optional[Tuple[int, int]], opacity: float, angle: float,
+                 flip: bool, flop: bool, filters: List[Dict]):
+        self.width, self.height = width, height
+        self.src = src
+        self.x = x
+        self.y = y
+        self.anchor = anchor
+        self.target_size = target_size
+        self.opacity = opacity
+        self.angle = angle
+        self.flip = flip
+        self.flop = flop
+        self.filters = filters
+
+
+class TextLayer(CompiledLayer):
+    __slots__ = ('text', 'font_path', 'size', 'color', 'x', 'y', 'anchor', 'opacity',
+                 'stroke_color', 'stroke_width', 'line_height', 'letter_spacing',
+                 'transform', 'shadow', 'fitted')
+
+    def __init__(self, width: int, height: int, text: str, font_path: Optional[str], size: int,
+                 color: RGBA, x: int, y: int, anchor: str, opacity: float,
+                 stroke_color: Optional[RGBA], stroke_width: int, line_height: float,
+                 letter_spacing: int, transform: Optional[str],
+                 shadow: Optional[Tuple[int, int, RGBA]], fitted: bool):
+        self.width, self.height = width, height
+        self.text = text
+        self.font_path = font_path
+        self.size = size
+        self.color = color
+        self.x = x
+        self.y = y
+        self.anchor = anchor
+        self.opacity = opacity
+        self.stroke_color = stroke_color
+        self.stroke_width = stroke_width
+        self.line_height = line_height
+        self.letter_spacing = letter_spacing
+        self.transform = transform
+        # (offset_x, offset_y, rgba) or None
+        self.shadow = shadow
+        self.fitted = fitted
+
+
+# ---------- compilers ----------
+
+def _compile_radial_gradient(layer, width, height):
+    # Support both old format (start_color, end_color) and new format (colors array)
+    if 'colors' in layer:
+        colors = [hex_to_rgba(color) for color in layer['colors']]
+        # Optional: custom stop positions (default: evenly spaced)
+        stops = layer.get('stops', None)
+        if stops is None:
+            stops = np.linspace(0, 1, len(colors))
+    else:
+        # Backward compatibility with old format
+        colors = [hex_to_rgba(layer['start_color']), hex_to_rgba(layer['end_color'])]
+        stops = [0, 1]
+
+    center_x = percent(layer.get('x', '50%'), width)
+    center_y = percent(layer.get('y', '50%'), height)
+    grad_w = percent(layer.get('width', width), width)
+    grad_h = percent(layer.get('height', height), height)
+    offset_x, offset_y = get_anchor_pos(layer.get('anchor', 'top-left'), width, height, grad_w, grad_h)
+    return RadialGradient(
+        width, height, colors, stops,
+        center_x=offset_x + center_x, center_y=offset_y + center_y,
+        # The smaller dimension is the radius of the circular gradient
+        max_radius=min(grad_w, grad_h) / 2,
+        opacity=layer.get('opacity', 1.0)
+    )
+
+
+def _compile_linear_gradient(layer, width, height):
+    colors = [hex_to_rgba(c) for c in layer.get('colors')]
+    stops = layer.get('stops', np.linspace(0, 1, len(colors)))
+    angle_deg = float(layer.get('angle', 0))  # 0: left-to-right, 90: top-to-bottom
+    grad_w = percent(layer.get('width', width), width)
+    grad_h = percent(layer.get('height', height), height)
+
+    # Gradient axis starts at the anchor point and follows the angle
+    theta = np.deg2rad(angle_deg)
+    x0, y0 = get_anchor_pos(layer.get('anchor', 'top-left'), width, height, grad_w, grad_h)
+    x1 = x0 + grad_w * np.cos(theta)
+    y1 = y0 + grad_h * np.sin(theta)
+    return LinearGradient(
+        width, height, colors, stops,
+        start=(x0, y0), vector=(x1 - x0, y1 - y0),
+        opacity=layer.get('opacity', 1.0)
+    )
+
+
+def _compile_mesh_gradient(layer, width, height):
+    control_points = layer['mesh_points']  # List of {"x":..., "y":..., "color":...} dicts
+    return MeshGradient(
+        width, height,
+        points=[(percent(pt["x"], width), percent(pt["y"], height)) for pt in control_points],
+        colors=[hex_to_rgba(pt["color"]) for pt in control_points],
+        opacity=layer.get('opacity', 1.0)
+    )
+
+
+def _compile_shape_blur_gradient(layer, width, height):
+    # Base gradient is drawn fully opaque; blur works better before alpha adjustment
+    temp_layer = layer.copy()
+    temp_layer['opacity'] = 1.0
+    if layer.get('shape_gradient_type', 'linear') == 'radial':
+        gradient = _compile_radial_gradient(temp_layer, width, height)
+    else:
+        gradient = _compile_linear_gradient(temp_layer, width, height)
+
+    shape_x = percent(layer.get('shape_x', '0%'), width)
+    shape_y = percent(layer.get('shape_y', '0%'), height)
+    shape_w = percent(layer.get('shape_width', '100%'), width)
+    shape_h = percent(layer.get('shape_height', '100%'), height)
+    return ShapeBlurGradient(
+        width, height, gradient,
+        shape=layer.get('shape', 'ellipse'),  # "ellipse" or "rect"
+        rect=(shape_x, shape_y, shape_x + shape_w, shape_y + shape_h),
+        blur_radius=layer.get('blur_radius', 20),
+        opacity=layer.get('opacity', 1.0)
+    )
+
+
+def _compile_color_overlay(layer, width, height):
+    color = hex_to_rgba(layer['color'])
+    overlay_w = percent(layer.get('width', width), width)
+    overlay_h = percent(layer.get('height', height), height)
+    x = percent(layer.get('x', 0), width)
+    y = percent(layer.get('y', 0), height)
+    opacity = int(255 * layer.get('opacity', 1.0))
+    offset_x, offset_y = get_anchor_pos(layer.get('anchor', 'top-left'), width, height, overlay_w, overlay_h)
+    return ColorOverlay(
+        width, height, fill=(*color[:3], opacity), size=(overlay_w, overlay_h),
+        position=(int(offset_x + x), int(offset_y + y)), blur=layer.get('blur', 0)
+    )
+
+
+def _compile_spray_noise(layer, width, height):
+    # "center_x", "center_y", "radius_x", "radius_y" in px or percent, "strength", "opacity"
+    return SprayNoise(
+        width, height,
+        center_x=percent(layer.get('center_x', '70%'), width),
+        center_y=percent(layer.get('center_y', '20%'), height),
+        radius_x=percent(layer.get('radius_x', '30%'), width),
+        radius_y=percent(layer.get('radius_y', '15%'), height),
+        color1=hex_to_rgba(layer.get('color1', "#44defb")),
+        color2=hex_to_rgba(layer.get('color2', "#d97bfd")),
+        opacity=float(layer.get('opacity', 0.2)),
+        noise_scale=layer.get('noise_scale', 1.6),  # higher = finer dots
+        strength=layer.get('strength', 0.7)  # lower = more holes
+    )
+
+
+def _compile_ellipse(layer, width, height):
+    color = hex_to_rgba(layer['color'])
+    ele_w = percent(layer.get('width', 100), width)
+    ele_h = percent(layer.get('height', 100), height)
+    opacity = int(255 * layer.get('opacity', 1.0))
+    x = percent(layer.get('x', 0), width)
+    y = percent(layer.get('y', 0), height)
+    offset_x, offset_y = get_anchor_pos(layer.get('anchor', 'top-left'), width, height, ele_w, ele_h)
+    return Ellipse(
+        width, height, fill=(*color[:3], opacity), size=(ele_w, ele_h),
+        position=(int(offset_x + x), int(offset_y + y)), blur=layer.get('blur', 0)
+    )
+
+
+def _compile_polygon(layer, width, height):
+    color = hex_to_rgba(layer['color'])
+    points = layer['points']
+    # Normalize the points to their bounding box
+    pxs = [percent(x, width) for x, _ in points]
+    pys = [percent(y, height) for _, y in points]
+    min_x, max_x = min(pxs), max(pxs)
+    min_y, max_y = min(pys), max(pys)
+    opacity = int(255 * layer.get('opacity', 1.0))
+    return Polygon(
+        width, height, fill=(*color[:3], opacity),
+        points=[(x - min_x, y - min_y) for x, y in zip(pxs, pys)],
+        size=(max_x - min_x, max_y - min_y), position=(int(min_x), int(min_y)),
+        blur=layer.get('blur', 0)
+    )
+
+
+def _per_instance(values, count, default):
+    """Expand a scalar or short list into one value per instance (lists are cycled)"""
+    if values is None:
+        return [default] * count
+    if not isinstance(values, list):
+        return [values] * count
+    if not values:
+        return [default] * count
+    return [values[i % len(values)] for i in range(count)]
+
+
+def _compile_shape_instances(layer, width, height):
+    positions = layer.get('positions') or []
+    count = len(positions)
+    if count == 0:
+        print("No instances provided")
+        return None
+
+    sizes = _per_instance(layer.get('sizes'), count, 100)
+    colors = _per_instance(layer.get('colors'), count, '#ffffff')
+    opacities = _per_instance(layer.get('opacities'), count, layer.get('opacity', 1.0))
+    blurs = _per_instance(layer.get('blurs'), count, layer.get('blur', 0))
+    rotations = _per_instance(layer.get('rotations'), count, 0)
+    anchor = layer.get('anchor', 'center')
+
+    # Resolve instances into pixel boxes; runs of consecutive instances share (blur, opacity)
+    runs = []
+    for i in range(count):
+        position = positions[i]
+        if not isinstance(position, (list, tuple)) or len(position) != 2:
+            print(f"Skipping shape instance {i}: position must be an [x, y] pair, got {position!r}")
+            continue
+        px, py = position
+        size = sizes[i]
+        if not isinstance(size, (list, tuple)):
+            size = (size, size)
+        elif len(size) != 2:
+            print(f"Skipping shape instance {i}: size must be a value or a [width, height] pair, got {size!r}")
+            continue
+        w_val, h_val = size
+        inst_w = max(1, percent(w_val, width))
+        inst_h = max(1, percent(h_val, height))
+        left = percent(px, width)
+        top = percent(py, height)
+        if anchor == 'center':
+            left -= inst_w // 2
+            top -= inst_h // 2
+        key = (max(0, int(blurs[i])), float(opacities[i]))
+        if not runs or runs[-1][0] != key:
+            runs.append((key, []))
+        runs[-1][1].append((left, top, inst_w, inst_h, hex_to_rgba(colors[i]), float(rotations[i])))
+
+    if not runs:
+        print("No valid instances")
+        return None
+
+    return ShapeInstances(
+        width, height, shape=layer.get('shape', 'ellipse'),
+        template=layer.get('points') or DEFAULT_INSTANCE_POINTS, runs=runs
+    )
+
+
+def _compile_image(layer, width, height):
+    src = layer.get('src')
+    if not src or not os.path.exists(src):
+        print(f"Image file not found: {src}")
+        return None
+
+    resize_w = layer.get('width', None)
+    resize_h = layer.get('height', None)
+    target_size = None
+    if resize_w and resize_h:
+        target_size = (percent(resize_w, width), percent(resize_h, height))
+
+    return ImageLayer(
+        width, height, src,
+        x=percent(layer.get('x', 0), width),
+        y=percent(layer.get('y', 0), height),
+        anchor=layer.get('anchor', 'top-left'),
+        target_size=target_size,
+        opacity=float(layer.get('opacity', 1.0)),
+        angle=layer.get('angle', 0),
+        flip=bool(layer.get('flip', False)),
+        flop=bool(layer.get('flop', False)),
+        filters=layer.get('filters', [])
+    )
+
+
+def _compile_text(layer, width, height):
+    text = layer.get('text', '')
+    if not text:
+        print("No text provided")
+        return None
+
+    shadow = layer.get('shadow', None)
+    if shadow:
+        scolor = hex_to_rgba(shadow.get('color', '#000000'))
+        shadow = (shadow.get('offset_x', 2), shadow.get('offset_y', 2),
+                  (*scolor[:3], int(255 * shadow.get('opacity', 0.5))))
+    else:
+        shadow = None
+
+    return TextLayer(
+        width, height, text,
+        font_path=layer.get('font'),
+        size=int(layer.get('size', 32)),
+        color=hex_to_rgba(layer.get('color', '#ffffff')),
+        x=percent(layer.get('x', 0), width),
+        y=percent(layer.get('y', 0), height),
+        anchor=layer.get('anchor', 'top-left'),
+        opacity=float(layer.get('opacity', 1.0)),
+        stroke_color=hex_to_rgba(layer.get('stroke_color', '#000000')) if 'stroke_color' in layer else None,
+        stroke_width=int(layer.get('stroke_width', 0)),
+        line_height=float(layer.get('line_height', 1.0)),
+        letter_spacing=int(layer.get('letter_spacing', 0)),
+        transform=layer.get('transform', None),
+        shadow=shadow,
+        # A fit is only valid for the box it was made for: the canvas config
+        # size, or the scaled-down size recorded in fitted_box
+        fitted=bool(layer.get('fitted', False)) and list(layer.get('fitted_box', (width, height))) == [width, height]
+    )
+
+
+_GRADIENT_COMPILERS = {
+    'radial': _compile_radial_gradient,
+    'linear': _compile_linear_gradient,
+    'mesh': _compile_mesh_gradient,
+    'shape_blur': _compile_shape_blur_gradient,
+}
+
+_SHAPE_COMPILERS = {
+    'ellipse': _compile_ellipse,
+    'polygon': _compile_polygon,
+}
+
+_LAYER_COMPILERS = {
+    'color_overlay': _compile_color_overlay,
+    'shape_instances': _compile_shape_instances,
+    'spray_noise': _compile_spray_noise,
+    'image': _compile_image,
+    'text': _compile_text,
+}
+
+
+def compile_layer(layer: Dict, width: int, height: int) -> Optional[CompiledLayer]:
+    """
+    Compile a layer dict for a width x height canvas.
+    Returns None for layers that draw nothing (unknown types, no text, missing image).
+    """
+    t = layer['type']
+    if t == 'gradient':
+        compiler = _GRADIENT_COMPILERS.get(layer.get('gradient_type'))
+    elif t == 'shape':
+        compiler = _SHAPE_COMPILERS.get(layer.get('shape', None))
+    else:
+        compiler = _LAYER_COMPILERS.get(t)
+    if compiler is None:
+        return None
+    return compiler(layer, width, height)
+
+
+def compile_layers(layers: List[Dict], width: int, height: int) -> List[CompiledLayer]:
+    """Compile a canvas's layers in draw order, dropping layers that draw nothing"""
+    compiled = (compile_layer(layer, width, height) for layer in layers)
+    return [layer for layer in compiled if layer is not None]
@@ -0,0 +1,162 @@
+# context_encoding.py
+"""
+Compact encodings of the poster state embedded in phase prompts.
+
+build_context used to paste indented JSON into every prompt. These encoders
+emit the same information in a minimal, stable form:
+
+- encode_layout() writes the layout JSON back as layout DSL, with each
+  placeholder named after its canvas: container(1080x1350)[column[canvas_1(60%),
+  canvas_2(40%)]]. Replacing the canvas names with 'placeholder' parses back to
+  the same layout JSON. Layouts the DSL cannot express fall back to compact JSON.
+- encode_canvases() writes analyze_canvas_structure() output as a CSV table with
+  only the columns the phase needs.
+
+Usage:
+    python context_encoding.py report [--db poster_generator.db]
+prints the prompt bytes and estimated tokens per phase, indented vs compact,
+for every stored project.
+"""
+import io
+import csv
+import json
+import asyncio
+import argparse
+import contextlib
+from typing import Any, Dict, List, Optional
+
+from layout_dsl import LAYOUT_TYPES
+
+# Canvas metadata columns each phase needs; has_layers only matters once backgrounds exist
+CANVAS_FIELDS = {
+    "background": ("index", "width", "height", "background"),
+    "assets": ("index", "width", "height", "background", "has_layers")
+}
+DEFAULT_CANVAS_FIELDS = ("index", "width", "height", "background", "has_layers")
+
+
+class _NotEncodable(Exception):
+    pass
+
+
+def compact_json(obj: Any) -> str:
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def _size_key(parent_type: Optional[str]) -> str:
+    # Mirrors the parser: generic sizes are heights in columns and widths elsewhere
+    return "height" if parent_type == "column" else "width"
+
+
+def _encode_element(node: Any, parent_type: Optional[str]) -> str:
+    if not isinstance(node, dict):
+        raise _NotEncodable
+    names = [key for key in node if key.startswith("canvas_") or key in LAYOUT_TYPES]
+    if len(names) != 1:
+        raise _NotEncodable
+    name = names[0]
+    extra = set(node) - {name}
+    size_key = _size_key(parent_type)
+
+    if name.startswith("canvas_"):
+        if node[name] != "PLACEHOLDER":
+            raise _NotEncodable
+        if extra == {"width", "height"} and all(type(node[key]) is int for key in extra):
+            spec = f"{node['width']}x{node['height']}"
+        elif extra == {size_key} and isinstance(node[size_key], str) and node[size_key] \
+                and not any(char in node[size_key] for char in "x()[],"):
+            spec = node[size_key]
+        elif not extra:
+            spec = ""
+        else:
+            raise _NotEncodable
+        return f"{name}({spec})"
+
+    value = node[name]
+    if not isinstance(value, dict) or set(value) != {"children"} or not isinstance(value["children"], list):
+        raise _NotEncodable
+    spec = ""
+    if extra:
+        size = node.get(size_key)
+        if extra != {size_key} or not isinstance(size, str) or not size.endswith('%'):
+            raise _NotEncodable
+        spec = f"({size})"
+    children = ",".join(_encode_element(child, name) for child in value["children"])
+    return f"{name}{spec}[{children}]"
+
+
+def encode_layout(layout_json: Any) -> str:
+    """Layout DSL with named placeholders, or compact JSON when the DSL cannot express it"""
+    try:
+        container = layout_json["container"]
+        if set(layout_json) != {"container"} or type(container.get("width")) is not int \
+                or type(container.get("height")) is not int:
+            raise _NotEncodable
+        # The root element's keys live in the container dict next to its size
+        child = {key: value for key, value in container.items() if key not in ("width", "height")}
+        return f"container({container['width']}x{container['height']})[{_encode_element(child, None)}]"
+    except (_NotEncodable, KeyError, TypeError, AttributeError):
+        return compact_json(layout_json)
+
+
+def encode_canvases(canvas_info: Any, phase: Optional[str] = None) -> str:
+    """analyze_canvas_structure() entries as CSV with a header row"""
+    if not isinstance(canvas_info, list):
+        return str(canvas_info)
+    fields = CANVAS_FIELDS.get((phase or "").lower(), DEFAULT_CANVAS_FIELDS)
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(fields)
+    for info in canvas_info:
+        if isinstance(info, dict):
+            writer.writerow([int(info[field]) if isinstance(info.get(field), bool) else info.get(field, "")
+                             for field in fields])
+    return out.getvalue().rstrip("\n")
+
+
+async def context_sizes(db_path: str) -> Dict[str, Dict[str, List[int]]]:
+    """Prompt byte counts per phase, {phase: {"indented": [...], "compact": [...]}}"""
+    from main import Posteragent
+    from database import DatabaseManager, PhaseType
+    from llm_backend import MockBackend
+
+    db = DatabaseManager(db_path)
+    agents = {
+        "indented": Posteragent(backend=MockBackend(), use_cache=False, compact_context=False),
+        "compact": Posteragent(backend=MockBackend(), use_cache=False, compact_context=True)
+    }
+    sizes: Dict[str, Dict[str, List[int]]] = {}
+    for project in db.list_projects():
+        for phase in (PhaseType.CANVAS, PhaseType.BACKGROUND, PhaseType.ASSETS):
+            previous_json = db.get_current_json_for_next_phase(project["id"], phase)
+            if not previous_json:
+                continue
+            for encoding, agent in agents.items():
+                agent.current_json = previous_json
+                # build_context logs every call
+                with contextlib.redirect_stdout(io.StringIO()):
+                    context = await agent.build_context(project["user_prompt"], phase.value)
+                sizes.setdefault(phase.value, {}).setdefault(encoding, []).append(len(context.encode('utf-8')))
+    return sizes
+
+
+def print_report(sizes: Dict[str, Dict[str, List[int]]]):
+    from llm_scheduler import CHARS_PER_TOKEN
+
+    print(f"{'phase':<12}{'prompts':>8}{'indented B':>12}{'compact B':>11}{'est. tokens':>18}{'saved':>8}")
+    for phase, by_encoding in sizes.items():
+        indented, compact = sum(by_encoding["indented"]), sum(by_encoding["compact"])
+        tokens = f"{indented // CHARS_PER_TOKEN}->{compact // CHARS_PER_TOKEN}"
+        saved = 1 - compact / indented if indented else 0.0
+        print(f"{phase:<12}{len(by_encoding['compact']):>8}{indented:>12}{compact:>11}{tokens:>18}{saved:>8.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Phase prompt context encoding tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Compare indented and compact prompt sizes on stored projects")
+    report_parser.add_argument("--db", default="poster_generator.db")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        print_report(asyncio.run(context_sizes(args.db)))
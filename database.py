@@ -51,6 +51,20 @@ class DatabaseManager:
                 )
             """)
             
+            # Render-ready translations of phase_results, keyed by a hash of the source JSON
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS phase_translations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    project_id TEXT NOT NULL,
+                    phase TEXT NOT NULL,
+                    source_hash TEXT NOT NULL,
+                    json_data TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (project_id) REFERENCES projects (id),
+                    UNIQUE(project_id, phase)
+                )
+            """)
+            
             conn.commit()
     
     def create_project(self, user_prompt: str) -> str:
@@ -115,6 +129,11 @@ class DatabaseManager:
                     VALUES (?, ?, ?, ?)
                 """, (project_id, phase, json_string, status))
             
+            # The cached translation belongs to the previous JSON
+            conn.execute("""
+                DELETE FROM phase_translations WHERE project_id = ? AND phase = ?
+            """, (project_id, phase))
+            
             conn.commit()
     
     def get_phase_result(self, project_id: str, phase: PhaseType) -> Optional[Dict]:
@@ -133,6 +152,28 @@ class DatabaseManager:
                 }
         return None
     
+    def get_phase_translation(self, project_id: str, phase: PhaseType, source_hash: str) -> Optional[Dict]:
+        """Get the cached render-ready translation if it was made from the same source JSON"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.execute("""
+                SELECT json_data FROM phase_translations
+                WHERE project_id = ? AND phase = ? AND source_hash = ?
+            """, (project_id, phase, source_hash))
+            
+            row = cursor.fetchone()
+            if row:
+                return json.loads(row[0])
+        return None
+    
+    def save_phase_translation(self, project_id: str, phase: PhaseType, source_hash: str, json_data: Dict):
+        """Save or replace the cached translation of a phase result"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO phase_translations (project_id, phase, source_hash, json_data)
+                VALUES (?, ?, ?, ?)
+            """, (project_id, phase, source_hash, json.dumps(json_data)))
+            conn.commit()
+    
     def get_all_phase_results(self, project_id: str) -> Dict[str, Dict]:
         """Get all phase results for a project"""
         with sqlite3.connect(self.db_path) as conn:
@@ -184,7 +225,8 @@ class DatabaseManager:
             previous_phase = phase_order[current_index - 1]
             result = self.get_phase_result(project_id, previous_phase)
             
-            if result and result['status'] == 'completed':
+            # A partial result still has every canvas; its failed canvases kept their previous layers
+            if result and result['status'] in ('completed', 'partial'):
                 return result['json_data']
             
         except ValueError:
@@ -212,6 +254,7 @@ class DatabaseManager:
     def delete_project(self, project_id: str):
         """Delete a project and all its phase results"""
         with sqlite3.connect(self.db_path) as conn:
+            conn.execute("DELETE FROM phase_translations WHERE project_id = ?", (project_id,))
             conn.execute("DELETE FROM phase_results WHERE project_id = ?", (project_id,))
             conn.execute("DELETE FROM projects WHERE id = ?", (project_id,))
             conn.commit()
@@ -0,0 +1,389 @@
+# layout_dsl.py
+"""
+Tokenizer and recursive-descent parser for the layout DSL accepted by
+Tools.generate_layout:
+
+    layout   := 'container' '(' W 'x' H ')' '[' element ']'
+    element  := 'placeholder' '(' spec ')'
+              | ('column' | 'row' | 'stack') ['(' spec ')'] '[' children ']'
+    children := [element] (',' [element])*
+
+Whitespace is ignored everywhere, as before. The string is tokenized with a
+single regex scan and parsed in one pass, so parse time is linear in the
+input length. Syntax errors report the position in the original string.
+
+compile_layout() caches the parsed layout per normalized string together
+with the absolute slot geometry of every canvas_N in the container.
+compute_slot_geometry() derives the same boxes from a stored layout JSON.
+
+Usage:
+    python layout_dsl.py bench [--baseline path/to/tools.py]
+times parse_layout_string on deep and wide layouts. With --baseline, the
+generate_layout of another tools.py (e.g. one from an older revision) is
+timed on the same inputs and its output compared.
+"""
+import re
+import sys
+import time
+import pickle
+import argparse
+import importlib.util
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+LAYOUT_TYPES = ('column', 'row', 'stack')
+TEMPLATE_CACHE_SIZE = 256
+
+_WHITESPACE = re.compile(r'\s+')
+_TOKEN = re.compile(r'(?P<name>[^\s()\[\],]+)|\((?P<spec>[^()\[\]]*)\)|(?P<punct>[\[\],])|(?P<bad>.)')
+_CONTAINER_SIZE = re.compile(r'(\d+)x(\d+)')
+
+
+class LayoutSyntaxError(ValueError):
+    """Layout DSL error; position is the character offset in the original string"""
+
+    def __init__(self, message: str, position: int):
+        super().__init__(f"{message} at position {position}")
+        self.position = position
+
+
+class _LayoutParser:
+    def __init__(self, layout_str: str):
+        self.source = layout_str
+        self.text = _WHITESPACE.sub('', layout_str)
+        self.tokens: List[Tuple[str, str, int]] = [
+            (match.lastgroup, match.group(match.lastgroup), match.start())
+            for match in _TOKEN.finditer(self.text)
+        ]
+        self.index = 0
+        self.canvas_counter = 1
+
+    # ---------- token helpers ----------
+
+    def _source_position(self, text_position: int) -> int:
+        """Map an offset in the whitespace-free text back to the original string"""
+        seen = 0
+        for i, char in enumerate(self.source):
+            if char.isspace():
+                continue
+            if seen == text_position:
+                return i
+            seen += 1
+        return len(self.source)
+
+    def _error(self, message: str, token: Optional[Tuple[str, str, int]] = None):
+        position = token[2] if token else len(self.text)
+        raise LayoutSyntaxError(message, self._source_position(position))
+
+    def _peek(self) -> Optional[Tuple[str, str, int]]:
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def _next(self, expected: str) -> Tuple[str, str, int]:
+        token = self._peek()
+        if token is None:
+            self._error(f"Expected {expected}, got end of input")
+        self.index += 1
+        return token
+
+    def _expect_punct(self, char: str):
+        token = self._next(f"'{char}'")
+        if token[0] != 'punct' or token[1] != char:
+            self._error(f"Expected '{char}', got {self._describe(token)}", token)
+
+    @staticmethod
+    def _describe(token: Tuple[str, str, int]) -> str:
+        kind, value, _ = token
+        if kind == 'spec':
+            return f"'({value})'"
+        if kind == 'bad' and value == '(':
+            return "unterminated or invalid '('"
+        return f"'{value}'"
+
+    # ---------- grammar ----------
+
+    def parse(self) -> Dict[str, Any]:
+        token = self._next("'container'")
+        if token[0] != 'name' or token[1] != 'container':
+            self._error(f"Expected 'container', got {self._describe(token)}", token)
+
+        spec_token = self._next("'(widthxheight)'")
+        size_match = _CONTAINER_SIZE.fullmatch(spec_token[1]) if spec_token[0] == 'spec' else None
+        if not size_match:
+            self._error(f"Expected '(widthxheight)', got {self._describe(spec_token)}", spec_token)
+
+        self._expect_punct('[')
+        child = self._element(None)
+        self._expect_punct(']')
+
+        trailing = self._peek()
+        if trailing is not None:
+            self._error(f"Unexpected {self._describe(trailing)} after layout", trailing)
+
+        container = {"width": int(size_match.group(1)), "height": int(size_match.group(2))}
+        container.update(child)
+        return {"container": container}
+
+    def _size_key(self, parent_type: Optional[str]) -> str:
+        """Generic sizes become heights in columns and widths everywhere else"""
+        return "height" if parent_type == "column" else "width"
+
+    def _element(self, parent_type: Optional[str]) -> Dict[str, Any]:
+        token = self._next("a layout element")
+        kind, name, _ = token
+        if kind != 'name':
+            self._error(f"Expected a layout element, got {self._describe(token)}", token)
+
+        if name == 'placeholder':
+            spec_token = self._next("'(size)'")
+            if spec_token[0] != 'spec':
+                self._error(f"Expected '(size)', got {self._describe(spec_token)}", spec_token)
+            return self._placeholder(spec_token, parent_type)
+
+        if name not in LAYOUT_TYPES:
+            self._error(f"Unknown layout element '{name}'", token)
+
+        size_spec = None
+        if self._peek() is not None and self._peek()[0] == 'spec':
+            size_spec = self._next("'(size)'")[1]
+
+        self._expect_punct('[')
+        children = self._children(name)
+        self._expect_punct(']')
+
+        result = {name: {"children": children}}
+        if size_spec and size_spec.endswith('%'):
+            result[self._size_key(parent_type)] = size_spec
+        return result
+
+    def _placeholder(self, spec_token: Tuple[str, str, int], parent_type: Optional[str]) -> Dict[str, Any]:
+        size_spec = spec_token[1]
+        result = {f"canvas_{self.canvas_counter}": "PLACEHOLDER"}
+        self.canvas_counter += 1
+
+        if size_spec:
+            if 'x' in size_spec:
+                # Dimension format
+                parts = size_spec.split('x')
+                try:
+                    if len(parts) != 2:
+                        raise ValueError
+                    width, height = int(parts[0]), int(parts[1])
+                except ValueError:
+                    self._error(f"Invalid placeholder size '{size_spec}'", spec_token)
+                result["width"] = width
+                result["height"] = height
+            else:
+                # Percentage, flex value or other size
+                result[self._size_key(parent_type)] = size_spec
+
+        return result
+
+    def _children(self, parent_type: str) -> List[Dict[str, Any]]:
+        children = []
+        while True:
+            token = self._peek()
+            if token is None:
+                self._error("Expected ']', got end of input")
+            if token[0] == 'punct' and token[1] == ']':
+                return children
+            if token[0] == 'punct' and token[1] == ',':
+                # Empty entries between commas are skipped
+                self.index += 1
+                continue
+
+            children.append(self._element(parent_type))
+
+            token = self._peek()
+            if token is not None and not (token[0] == 'punct' and token[1] in ',]'):
+                self._error(f"Expected ',' or ']', got {self._describe(token)}", token)
+
+
+def parse_layout_string(layout_str: str) -> Dict[str, Any]:
+    """Parse a layout DSL string into the layout JSON used by the layout phase"""
+    return _LayoutParser(layout_str).parse()
+
+
+def normalize_layout_string(layout_str: str) -> str:
+    """Canonical form of a layout string; whitespace carries no meaning"""
+    return _WHITESPACE.sub('', layout_str)
+
+
+def main_axis_share(sizes: List[Any], count: int) -> Optional[float]:
+    """
+    Row/column rule shared with the translator. sizes are the children's
+    width (row) or height (column) values; they are kept when all are
+    percentages summing to 95-105%. Otherwise each of the count children
+    gets the even percentage returned here.
+    """
+    total = 0.0
+    for size in sizes:
+        if not (isinstance(size, str) and size.endswith('%')):
+            return round(100 / count, 2)
+        try:
+            total += float(size[:-1])
+        except ValueError:
+            return round(100 / count, 2)
+    if not 95 <= total <= 105:
+        return round(100 / count, 2)
+    return None
+
+
+def _distribute(children: List[Dict], axis: str, extent: int) -> List[int]:
+    """Main-axis sizes of row/column children, as the translator sets them"""
+    share = main_axis_share([child.get(axis) for child in children], len(children))
+    if share is None:
+        percentages = [float(child[axis][:-1]) for child in children]
+    else:
+        percentages = [share] * len(children)
+    return [int(extent * (percentage / 100.0)) for percentage in percentages]
+
+
+def stack_is_column(children: List[Any], placeholders: bool = True,
+                    becomes_canvas: Optional[Callable[[Dict, Any], bool]] = None) -> bool:
+    """
+    Stack -> column rule shared with the translator: a stack with 2+
+    children holding a canvas_N with a sized canvas config is laid out as a
+    column. A PLACEHOLDER counts when placeholders is set (the phases that
+    turn it into a canvas); becomes_canvas(child, value) can count other
+    canvas_N values the caller fills in.
+    """
+    canvases = 0
+    for child in children:
+        if not isinstance(child, dict):
+            continue
+        for key, value in child.items():
+            if not key.startswith('canvas_'):
+                continue
+            if value == "PLACEHOLDER":
+                sized = placeholders
+            else:
+                sized = isinstance(value, dict) and isinstance(value.get("canvas"), dict) and "height" in value["canvas"]
+            if sized or (becomes_canvas is not None and becomes_canvas(child, value)):
+                canvases += 1
+                break
+    return canvases >= 2
+
+
+def _place(node: Dict, x: int, y: int, width: int, height: int, slots: Dict[str, Dict]):
+    for key, value in node.items():
+        if key.startswith('canvas_'):
+            slots[key] = {"x": x, "y": y, "width": width, "height": height}
+        elif key in LAYOUT_TYPES and isinstance(value, dict):
+            children = [child for child in value.get("children", []) if isinstance(child, dict)]
+            if not children:
+                continue
+
+            layout_type = key
+            if key == "stack" and stack_is_column(children):
+                layout_type = "column"
+
+            if layout_type == "stack":
+                for child in children:
+                    _place(child, x, y, width, height, slots)
+            elif layout_type == "row":
+                offset = x
+                for child, child_width in zip(children, _distribute(children, "width", width)):
+                    _place(child, offset, y, child_width, height, slots)
+                    offset += child_width
+            else:
+                offset = y
+                for child, child_height in zip(children, _distribute(children, "height", height)):
+                    _place(child, x, offset, width, child_height, slots)
+                    offset += child_height
+
+
+def compute_slot_geometry(layout_json: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """
+    Absolute box of every canvas_N in the container, in container pixels:
+    {"canvas_1": {"x", "y", "width", "height"}, ...}. Rows and columns split
+    their extent the same way the translator does before rendering.
+    """
+    container = layout_json.get("container") if isinstance(layout_json, dict) else None
+    if not isinstance(container, dict):
+        return {}
+    width, height = container.get("width"), container.get("height")
+    if not isinstance(width, int) or not isinstance(height, int):
+        return {}
+
+    slots = {}
+    _place(container, 0, 0, width, height, slots)
+    return slots
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _compile_normalized(normalized: str) -> bytes:
+    # Stored pickled: unpickling is a much cheaper private copy than deepcopy
+    layout = _LayoutParser(normalized).parse()
+    return pickle.dumps({"layout": layout, "slots": compute_slot_geometry(layout)},
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def compile_layout(layout_str: str) -> Dict[str, Any]:
+    """
+    Parse a layout string through the template cache.
+    Returns {"layout": layout JSON, "slots": compute_slot_geometry(layout)};
+    both are copies the caller may modify.
+    """
+    try:
+        compiled = _compile_normalized(normalize_layout_string(layout_str))
+    except LayoutSyntaxError:
+        # Parse the original string so the error position refers to it
+        _LayoutParser(layout_str).parse()
+        raise
+    return pickle.loads(compiled)
+
+
+def _bench_layouts():
+    """(name, layout string) pairs: nested columns and one wide row"""
+    def deep(n):
+        return "container(1920x1080)[" + "column[placeholder(10%)," * n + "placeholder()" + "]" * n + "]"
+
+    def wide(n):
+        columns = ",".join(f"column[placeholder({i % 90 + 1}%),placeholder(10x10)]" for i in range(n))
+        return f"container(1920x1080)[row[{columns}]]"
+
+    for n in (50, 200, 800):
+        yield f"deep, {n} levels", deep(n)
+    for n in (100, 1000, 10000):
+        yield f"wide, {n} columns", wide(n)
+
+
+def _time_ms(parse, layout_str: str) -> float:
+    reps = 3 if len(layout_str) > 50000 else 20
+    start = time.perf_counter()
+    for _ in range(reps):
+        parse(layout_str)
+    return (time.perf_counter() - start) / reps * 1000
+
+
+def run_benchmark(baseline_path: Optional[str] = None):
+    """Print ms per parse for each benchmark layout, next to the baseline's when given"""
+    baseline = None
+    if baseline_path:
+        spec = importlib.util.spec_from_file_location("baseline_tools", baseline_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        baseline = module.Tools.generate_layout
+    # The deepest layouts need more frames than the default limit in recursive parsers
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+    for name, layout_str in _bench_layouts():
+        size = f"{len(layout_str) / 1000:.1f} kB"
+        new_ms = _time_ms(parse_layout_string, layout_str)
+        if baseline is None:
+            print(f"{name:<20}{size:>10}{new_ms:>10.2f} ms")
+            continue
+        old_ms = _time_ms(baseline, layout_str)
+        same = baseline(layout_str) == parse_layout_string(layout_str)
+        print(f"{name:<20}{size:>10}{old_ms:>10.2f} ->{new_ms:>8.2f} ms{'' if same else '  OUTPUT DIFFERS'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Layout DSL tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="Time layout parsing on deep and wide layouts")
+    bench_parser.add_argument("--baseline", help="tools.py whose Tools.generate_layout to compare against")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        run_benchmark(args.baseline)
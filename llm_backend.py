@@ -0,0 +1,403 @@
+# llm_backend.py
+"""
+LLM backends for Posteragent.
+
+A backend turns one phase prompt plus its tool declarations into an
+LLMResponse: a list of text and function-call parts. Posteragent only talks
+to this interface, so the pipeline can run against:
+
+- GeminiBackend: the live Gemini API (the client is created on first use)
+- ReplayBackend: recorded responses served in order per phase, with an
+  optional simulated latency, for offline load tests and benchmarks
+- MockBackend: a ReplayBackend over a small built-in two-canvas poster
+
+Posteragent awaits agenerate(), which does not hold a thread while the model
+is working: Gemini uses the client's async surface and replay latency is an
+asyncio sleep. call_backend() adds the per-call timeout; cancelling the
+awaiting task cancels the request itself. astream() yields the parts as the
+model emits them, and stream_backend() hands each one to a callback on arrival.
+
+RecordingBackend wraps another backend and appends every response to a JSONL
+file that ReplayBackend can read back.
+
+create_backend() picks one from the environment:
+    LLM_BACKEND         gemini (default), replay or mock
+    LLM_REPLAY_PATH     JSONL file or directory of JSON files for replay
+    LLM_LATENCY         seconds to wait per replayed call (default 0)
+    LLM_LATENCY_JITTER  extra random seconds per call, seeded (default 0)
+    LLM_RECORD_PATH     append every response to this JSONL file
+    LLM_TIMEOUT         seconds before one call is abandoned (default 120)
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+GEMINI_MODEL = 'gemini-2.5-flash'
+DEFAULT_TIMEOUT = 120.0
+
+
+class FunctionCall:
+    """A tool call: name and a plain dict of arguments"""
+    __slots__ = ('name', 'args')
+
+    def __init__(self, name: str, args: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.args = args or {}
+
+
+class ResponsePart:
+    """One response part; either text or function_call is set"""
+    __slots__ = ('text', 'function_call')
+
+    def __init__(self, text: Optional[str] = None, function_call: Optional[FunctionCall] = None):
+        self.text = text
+        self.function_call = function_call
+
+    def to_dict(self) -> Dict:
+        if self.function_call is not None:
+            return {"function_call": {"name": self.function_call.name, "args": self.function_call.args}}
+        return {"text": self.text}
+
+    @staticmethod
+    def from_dict(data: Dict) -> 'ResponsePart':
+        call = data.get("function_call")
+        if call:
+            return ResponsePart(function_call=FunctionCall(call["name"], call.get("args")))
+        return ResponsePart(text=data.get("text"))
+
+
+class LLMResponse:
+    """Parts of one model response; parts is None when the model returned nothing"""
+    __slots__ = ('parts',)
+
+    def __init__(self, parts: Optional[List[ResponsePart]]):
+        self.parts = parts
+
+    def to_dict(self) -> Dict:
+        return {"parts": [part.to_dict() for part in self.parts] if self.parts is not None else None}
+
+    @staticmethod
+    def from_dict(data: Dict) -> 'LLMResponse':
+        parts = data.get("parts")
+        return LLMResponse([ResponsePart.from_dict(part) for part in parts] if parts is not None else None)
+
+
+class LLMBackend(ABC):
+    """Interface: generate one response for a phase prompt and its tools"""
+    name = "base"
+    # Model identifier; with name it tells cached responses of different backends apart
+    model = ""
+
+    @abstractmethod
+    def generate(self, phase: str, contents: str, tools: List[Dict]) -> LLMResponse:
+        pass
+
+    async def agenerate(self, phase: str, contents: str, tools: List[Dict]) -> LLMResponse:
+        """Async generate; backends without an async client fall back to a worker thread"""
+        return await asyncio.to_thread(self.generate, phase, contents, tools)
+
+    async def astream(self, phase: str, contents: str, tools: List[Dict]) -> AsyncIterator[ResponsePart]:
+        """Parts as they are emitted; backends without streaming yield them all at the end"""
+        response = await self.agenerate(phase, contents, tools)
+        for part in response.parts or []:
+            yield part
+
+
+class GeminiBackend(LLMBackend):
+    """Live Gemini API; the client is created on first call, not at import"""
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = None, model: str = GEMINI_MODEL):
+        self.api_key = api_key
+        self.model = model
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                from google import genai
+                api_key = self.api_key or os.getenv("GEMINI_API_KEY")
+                print(f"API Key found: {'Yes' if api_key else 'No'}")
+                self._client = genai.Client(api_key=api_key)
+            return self._client
+
+    def generate(self, phase: str, contents: str, tools: List[Dict]) -> LLMResponse:
+        response = self._get_client().models.generate_content(
+            model=self.model,
+            contents=contents,
+            config={'tools': [{'function_declarations': tools}]}
+        )
+        return self._convert(response)
+
+    async def agenerate(self, phase: str, contents: str, tools: List[Dict]) -> LLMResponse:
+        response = await self._get_client().aio.models.generate_content(
+            model=self.model,
+            contents=contents,
+            config={'tools': [{'function_declarations': tools}]}
+        )
+        return self._convert(response)
+
+    async def astream(self, phase: str, contents: str, tools: List[Dict]) -> AsyncIterator[ResponsePart]:
+        stream = await self._get_client().aio.models.generate_content_stream(
+            model=self.model,
+            contents=contents,
+            config={'tools': [{'function_declarations': tools}]}
+        )
+        async for chunk in stream:
+            # Function calls arrive whole, one or more per chunk
+            if chunk.candidates and chunk.candidates[0].content:
+                for part in self._convert_parts(chunk.candidates[0].content.parts or []):
+                    yield part
+
+    @staticmethod
+    def _convert(response) -> LLMResponse:
+        parts = response.candidates[0].content.parts
+        if parts is None:
+            return LLMResponse(None)
+        return LLMResponse(GeminiBackend._convert_parts(parts))
+
+    @staticmethod
+    def _convert_parts(parts) -> List[ResponsePart]:
+        converted = []
+        for part in parts:
+            if getattr(part, "function_call", None) is not None:
+                call = part.function_call
+                converted.append(ResponsePart(function_call=FunctionCall(call.name, dict(call.args or {}))))
+            elif getattr(part, "text", None) is not None:
+                converted.append(ResponsePart(text=part.text))
+        return converted
+
+
+def load_recordings(path: str) -> Dict[str, List[LLMResponse]]:
+    """
+    Read recorded responses grouped by phase, in file order.
+    path is a JSONL file, or a directory whose *.json / *.jsonl files are read
+    in name order. Each record is {"phase": "layout", "parts": [...]}.
+    """
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                 if name.endswith(('.json', '.jsonl'))]
+    else:
+        files = [path]
+
+    records = []
+    for file_path in files:
+        with open(file_path, 'r') as f:
+            if file_path.endswith('.jsonl'):
+                records.extend(json.loads(line) for line in f if line.strip())
+            else:
+                data = json.load(f)
+                records.extend(data if isinstance(data, list) else [data])
+
+    recordings: Dict[str, List[LLMResponse]] = {}
+    for record in records:
+        if not isinstance(record, dict) or "phase" not in record:
+            continue
+        recordings.setdefault(record["phase"].lower(), []).append(LLMResponse.from_dict(record))
+    return recordings
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Serves recorded responses for each phase in order, starting over when a
+    phase runs out. latency (plus seeded jitter) is slept per call to stand in
+    for the network round trip.
+    """
+    name = "replay"
+    model = "recorded"
+
+    def __init__(self, recordings: Dict[str, List[LLMResponse]], latency: float = 0.0,
+                 jitter: float = 0.0, seed: int = 0):
+        self.recordings = {phase.lower(): list(responses) for phase, responses in recordings.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._next: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_path(cls, path: str, **kwargs) -> 'ReplayBackend':
+        return cls(load_recordings(path), **kwargs)
+
+    def _next_response(self, phase: str):
+        """The next recorded response for phase and how long to wait before returning it"""
+        phase = phase.lower()
+        responses = self.recordings.get(phase)
+        if not responses:
+            raise LookupError(f"No recorded responses for phase '{phase}'")
+        with self._lock:
+            index = self._next.get(phase, 0)
+            self._next[phase] = index + 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        return responses[index % len(responses)], delay
+
+    def generate(self, phase: str, contents: str, tools: List[Dict]) -> LLMResponse:
+        response, delay = self._next_response(phase)
+        if delay > 0:
+            time.sleep(delay)
+        return response
+
+    async def agenerate(self, phase: str, contents: str, tools: List[Dict]) -> LLMResponse:
+        response, delay = self._next_response(phase)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return response
+
+    async def astream(self, phase: str, contents: str, tools: List[Dict]) -> AsyncIterator[ResponsePart]:
+        # The latency is spread evenly over the parts, as if they were generated one by one
+        response, delay = self._next_response(phase)
+        parts = response.parts or []
+        if not parts and delay > 0:
+            await asyncio.sleep(delay)
+        for part in parts:
+            if delay > 0:
+                await asyncio.sleep(delay / len(parts))
+            yield part
+
+
+# A two-canvas poster: one valid response per phase
+MOCK_RECORDINGS = [
+    {"phase": "layout", "parts": [
+        {"function_call": {"name": "generate_layout", "args": {
+            "layout_string": "container(1080x1350)[column[placeholder(60%), placeholder(40%)]]"}}}
+    ]},
+    {"phase": "canvas", "parts": [
+        {"function_call": {"name": "generate_canvas", "args": {"width": 1080, "height": 810, "background": "#101828"}}},
+        {"function_call": {"name": "generate_canvas", "args": {"width": 1080, "height": 540, "background": "#f2f4f7"}}}
+    ]},
+    {"phase": "background", "parts": [
+        {"function_call": {"name": "generate_radial_gradient", "args": {
+            "colors": ["#7f56d9", "#101828"], "x": "50%", "y": "40%", "opacity": 0.9}}},
+        {"function_call": {"name": "generate_linear_gradient", "args": {
+            "colors": ["#f2f4f7", "#d0d5dd"], "angle": 90}}}
+    ]},
+    {"phase": "assets", "parts": [
+        {"function_call": {"name": "generate_text_layer", "args": {
+            "text": "SUMMER LAUNCH", "x": 0, "y": 0, "anchor": "center",
+            "size": 96, "color": "#ffffff", "align": "center", "weight": "bold"}}},
+        {"function_call": {"name": "generate_text_layer", "args": {
+            "text": "June 21 - Main Hall", "x": 0, "y": 0, "anchor": "center",
+            "size": 48, "color": "#101828", "align": "center"}}}
+    ]}
+]
+
+
+# Fused phase calls the mock answers too, built from the per-phase recordings
+MOCK_FUSED_PHASES = [("canvas", "background"), ("canvas", "background", "assets")]
+# Phases whose per-canvas (fan-out) calls, e.g. background/canvas_0, get their canvas's part alone
+MOCK_FAN_OUT_PHASES = ("background", "assets")
+
+
+class MockBackend(ReplayBackend):
+    """ReplayBackend over MOCK_RECORDINGS; needs no files or network"""
+    name = "mock"
+
+    def __init__(self, **kwargs):
+        recordings: Dict[str, List[LLMResponse]] = {}
+        for record in MOCK_RECORDINGS:
+            recordings.setdefault(record["phase"], []).append(LLMResponse.from_dict(record))
+        for phases in MOCK_FUSED_PHASES:
+            # Each mock phase has one part per canvas; a fused response goes canvas by canvas
+            per_phase = [recordings[phase][0].parts for phase in phases]
+            parts = [part for canvas_parts in zip(*per_phase) for part in canvas_parts]
+            recordings["+".join(phases)] = [LLMResponse(parts)]
+        for phase in MOCK_FAN_OUT_PHASES:
+            for index, part in enumerate(recordings[phase][0].parts):
+                recordings[f"{phase}/canvas_{index}"] = [LLMResponse([part])]
+        super().__init__(recordings, **kwargs)
+
+
+class RecordingBackend(LLMBackend):
+    """Passes calls to another backend and appends each response to a JSONL file"""
+
+    def __init__(self, backend: LLMBackend, path: str):
+        self.backend = backend
+        self.name = backend.name
+        self.model = backend.model
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, phase: str, response: LLMResponse):
+        record = dict(response.to_dict(), phase=phase.lower())
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+    def generate(self, phase: str, contents: str, tools: List[Dict]) -> LLMResponse:
+        response = self.backend.generate(phase, contents, tools)
+        self._record(phase, response)
+        return response
+
+    async def agenerate(self, phase: str, contents: str, tools: List[Dict]) -> LLMResponse:
+        response = await self.backend.agenerate(phase, contents, tools)
+        self._record(phase, response)
+        return response
+
+    async def astream(self, phase: str, contents: str, tools: List[Dict]) -> AsyncIterator[ResponsePart]:
+        parts = []
+        async for part in self.backend.astream(phase, contents, tools):
+            parts.append(part)
+            yield part
+        self._record(phase, LLMResponse(parts or None))
+
+
+def default_timeout() -> float:
+    return float(os.getenv("LLM_TIMEOUT", DEFAULT_TIMEOUT))
+
+
+async def call_backend(backend: LLMBackend, phase: str, contents: str, tools: List[Dict],
+                       timeout: Optional[float] = None) -> LLMResponse:
+    """backend.agenerate with a timeout; the request is cancelled when it runs out"""
+    try:
+        return await asyncio.wait_for(backend.agenerate(phase, contents, tools), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"{backend.name} call for {phase} phase timed out after {timeout}s") from None
+
+
+async def stream_backend(backend: LLMBackend, phase: str, contents: str, tools: List[Dict],
+                         on_part: Callable[[ResponsePart], None], timeout: Optional[float] = None) -> LLMResponse:
+    """backend.astream with a timeout; on_part sees each part as it arrives. Returns the whole response."""
+    async def consume():
+        parts = []
+        async for part in backend.astream(phase, contents, tools):
+            parts.append(part)
+            on_part(part)
+        return LLMResponse(parts or None)
+
+    try:
+        return await asyncio.wait_for(consume(), timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"{backend.name} call for {phase} phase timed out after {timeout}s") from None
+
+
+def create_backend(kind: Optional[str] = None) -> LLMBackend:
+    """Build the backend named by kind or LLM_BACKEND"""
+    load_dotenv()
+    kind = (kind or os.getenv("LLM_BACKEND") or "gemini").lower()
+    latency = float(os.getenv("LLM_LATENCY", 0))
+    jitter = float(os.getenv("LLM_LATENCY_JITTER", 0))
+
+    if kind == "gemini":
+        backend = GeminiBackend()
+    elif kind == "replay":
+        path = os.getenv("LLM_REPLAY_PATH")
+        if not path:
+            raise ValueError("LLM_BACKEND=replay needs LLM_REPLAY_PATH")
+        backend = ReplayBackend.from_path(path, latency=latency, jitter=jitter)
+    elif kind == "mock":
+        backend = MockBackend(latency=latency, jitter=jitter)
+    else:
+        raise ValueError(f"Unknown LLM backend '{kind}'")
+
+    record_path = os.getenv("LLM_RECORD_PATH")
+    if record_path:
+        backend = RecordingBackend(backend, record_path)
+    return backend
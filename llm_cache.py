@@ -0,0 +1,198 @@
+# llm_cache.py
+"""
+Content-addressed cache of LLM phase responses.
+
+A response is stored under a hash of (model, phase, built context, tool
+declarations), so the same prompt for the same phase state is answered from
+SQLite instead of a new round trip. Entries expire after a TTL, and the
+least recently used ones are evicted once the cache passes its entry or byte
+cap. Concurrent identical requests in one process share a single backend
+call.
+
+create_cache() reads its settings from the environment:
+    LLM_CACHE            set to 0/off/false to disable caching
+    LLM_CACHE_PATH       SQLite file (default llm_cache.db)
+    LLM_CACHE_TTL        seconds an entry stays valid (default 7 days)
+    LLM_CACHE_MAX_ITEMS  entry cap (default 5000)
+    LLM_CACHE_MAX_BYTES  stored response bytes cap (default 64 MB)
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import contextlib
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Bump when the stored response format changes
+CACHE_VERSION = 1
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_ITEMS = 5000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class LLMResponseCache:
+    def __init__(self, db_path: str = "llm_cache.db", ttl: float = DEFAULT_TTL,
+                 max_items: int = DEFAULT_MAX_ITEMS, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        # Backend calls in flight, by key; only touched from the event loop
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.init_database()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """A connection that commits on success and is closed on exit, not left to GC"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def init_database(self):
+        """Initialize the cache table"""
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    phase TEXT NOT NULL,
+                    response_json TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_last_used ON llm_responses (last_used)")
+            conn.commit()
+
+    @staticmethod
+    def key(model: str, phase: str, contents: str, tools: List[Dict]) -> str:
+        """Canonical hash of everything that determines the response"""
+        canonical_tools = json.dumps(tools, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        payload = json.dumps([CACHE_VERSION, model, phase.lower(), contents, canonical_tools], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Stored response for key, or None when missing or expired"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT response_json, created_at FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                conn.commit()
+                self.misses += 1
+                return None
+            conn.execute(
+                "UPDATE llm_responses SET hits = hits + 1, last_used = ? WHERE key = ?", (now, key)
+            )
+            conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, model: str, phase: str, response: Dict):
+        """Store a response, then drop expired and least recently used entries past the caps"""
+        data = json.dumps(response, separators=(',', ':'), ensure_ascii=False)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO llm_responses
+                (key, model, phase, response_json, size_bytes, hits, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+            """, (key, model, phase.lower(), data, len(data.encode('utf-8')), now, now))
+            conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (now - self.ttl,))
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection):
+        count, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM llm_responses"
+        ).fetchone()
+        if count <= self.max_items and total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in conn.execute("SELECT key, size_bytes FROM llm_responses ORDER BY last_used ASC"):
+            if count <= self.max_items and total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM llm_responses WHERE key = ?", evicted)
+
+    async def shared_call(self, key: str, call: Callable[[], Awaitable]):
+        """Run call() once for concurrent requests with the same key; the others await its result"""
+        while key in self._inflight:
+            pending = self._inflight[key]
+            try:
+                result = await asyncio.shield(pending)
+                self.shared += 1
+                return result
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The first caller was cancelled; make the call ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unshared failure is not logged twice
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict:
+        with self._connect() as conn:
+            count, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM llm_responses"
+            ).fetchone()
+        return {"entries": count, "bytes": total, "hits": self.hits, "misses": self.misses, "shared": self.shared}
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM llm_responses")
+            conn.commit()
+
+
+_default_cache: Optional[LLMResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def create_cache() -> Optional[LLMResponseCache]:
+    """The process-wide cache configured by the environment, or None when disabled"""
+    global _default_cache
+    if os.getenv("LLM_CACHE", "1").lower() in ("0", "off", "false", "no"):
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMResponseCache(
+                db_path=os.getenv("LLM_CACHE_PATH", "llm_cache.db"),
+                ttl=float(os.getenv("LLM_CACHE_TTL", DEFAULT_TTL)),
+                max_items=int(os.getenv("LLM_CACHE_MAX_ITEMS", DEFAULT_MAX_ITEMS)),
+                max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+            )
+        return _default_cache
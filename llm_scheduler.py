@@ -0,0 +1,234 @@
+# llm_scheduler.py
+"""
+Admission control for model calls.
+
+Every LLM request goes through one process-wide LLMScheduler before it
+reaches the backend. A request is admitted once all of these allow it:
+
+- fewer than max_concurrent requests are in flight
+- the requests-per-minute bucket has a token left
+- the tokens-per-minute bucket holds the request's estimated tokens
+
+Waiting requests are queued per job and admitted round-robin across jobs,
+so one large poster cannot starve the others. Queue depth, in-flight count
+and recent wait times are kept for stats().
+
+create_scheduler() reads its limits from the environment:
+    LLM_MAX_CONCURRENT  requests in flight at once (default 16)
+    LLM_RPM             requests per minute, 0 for no limit (default 1000)
+    LLM_TPM             tokens per minute, 0 for no limit (default 1000000)
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+DEFAULT_MAX_CONCURRENT = 16
+DEFAULT_RPM = 1000
+DEFAULT_TPM = 1_000_000
+# Rough prompt size estimate, and an allowance for the tool calls that come back
+CHARS_PER_TOKEN = 4
+OUTPUT_TOKEN_ESTIMATE = 1024
+# Wait times kept for the percentiles in stats()
+WAIT_SAMPLES = 1000
+
+
+def estimate_tokens(contents: str, tools: List[Dict]) -> int:
+    """Tokens one call is charged against the TPM budget before it is sent"""
+    prompt_chars = len(contents) + len(json.dumps(tools, separators=(',', ':')))
+    return prompt_chars // CHARS_PER_TOKEN + OUTPUT_TOKEN_ESTIMATE
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second up to per_minute; per_minute <= 0 never limits"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken"""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity > 0:
+            self.level -= amount
+
+
+class _Waiter:
+    __slots__ = ('job', 'tokens', 'future', 'queued_at')
+
+    def __init__(self, job: str, tokens: int, future: asyncio.Future):
+        self.job = job
+        self.tokens = tokens
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT, rpm: float = DEFAULT_RPM,
+                 tpm: float = DEFAULT_TPM):
+        self.max_concurrent = max_concurrent
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.in_flight = 0
+        self.admitted = 0
+        self.max_queue_depth = 0
+        # Waiting requests per job, and the jobs with waiting requests in turn order
+        self._queues: Dict[str, Deque[_Waiter]] = {}
+        self._turns: Deque[str] = deque()
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def run(self, job: str, tokens: int, call: Callable[[], Awaitable]):
+        """Wait for admission, then await call() while holding a slot"""
+        await self.acquire(job, tokens)
+        try:
+            return await call()
+        finally:
+            self.release()
+
+    async def acquire(self, job: str, tokens: int):
+        # A request bigger than the whole TPM budget would never be admitted otherwise
+        if self.tokens.capacity > 0:
+            tokens = min(tokens, int(self.tokens.capacity))
+        waiter = _Waiter(job, tokens, asyncio.get_running_loop().create_future())
+        if job not in self._queues:
+            self._queues[job] = deque()
+            self._turns.append(job)
+        self._queues[job].append(waiter)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted just before the cancellation; hand the slot back
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.job)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.job]
+            self._turns.remove(waiter.job)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admit waiting requests in job order while the limits allow"""
+        while self._turns and self.in_flight < self.max_concurrent:
+            job = self._turns[0]
+            queue = self._queues[job]
+            waiter = queue[0]
+            if waiter.future.done():
+                # Cancelled while queued, before its task could remove it
+                self._pop(job, queue)
+                continue
+            now = time.monotonic()
+            delay = max(self.requests.wait_time(1, now), self.tokens.wait_time(waiter.tokens, now))
+            if delay > 0:
+                self._wake_after(delay)
+                return
+
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            self.in_flight += 1
+            self.admitted += 1
+            self._waits.append(now - waiter.queued_at)
+
+            self._pop(job, queue)
+            waiter.future.set_result(None)
+
+    def _pop(self, job: str, queue: Deque[_Waiter]):
+        """Drop the job's first request; the job then goes to the back of the line"""
+        queue.popleft()
+        if queue:
+            self._turns.rotate(-1)
+        else:
+            del self._queues[job]
+            self._turns.popleft()
+
+    def _wake_after(self, delay: float):
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        if self._timer is not None and self._timer_loop is loop and not self._timer.cancelled():
+            if self._timer.when() <= when:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_at(when, self._on_timer)
+        self._timer_loop = loop
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def stats(self) -> Dict:
+        waits = sorted(self._waits)
+
+        def percentile(fraction: float) -> float:
+            return round(waits[min(len(waits) - 1, int(fraction * len(waits)))] * 1000, 1) if waits else 0.0
+
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "queued_by_job": {job: len(queue) for job, queue in self._queues.items()},
+            "admitted": self.admitted,
+            "wait_ms": {
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": percentile(1.0),
+                "mean": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                "samples": len(waits)
+            },
+            "rpm_limit": self.requests.capacity,
+            "tpm_limit": self.tokens.capacity
+        }
+
+
+_default_scheduler: Optional[LLMScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def create_scheduler() -> LLMScheduler:
+    """The process-wide scheduler configured by the environment"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = LLMScheduler(
+                max_concurrent=int(os.getenv("LLM_MAX_CONCURRENT", DEFAULT_MAX_CONCURRENT)),
+                rpm=float(os.getenv("LLM_RPM", DEFAULT_RPM)),
+                tpm=float(os.getenv("LLM_TPM", DEFAULT_TPM))
+            )
+        return _default_scheduler
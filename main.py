@@ -1,19 +1,77 @@
 import os
-from google import genai
 import asyncio
 import json
-from typing import Dict, List, Optional
+import sqlite3
+from typing import Callable, Dict, List, Optional
 from pydantic import BaseModel
 from tools import Tools
 from tool_config import Tool_config
+from assets import measure_text
+from layout_dsl import compile_layout, compute_slot_geometry
+from schema import validate_phase_json, validate_tree
+from translator import translate_canvas_numbering, translate_phase_cached
+from render import WidgetTreeParser, fit_content_size
 from enum import Enum
 from database import DatabaseManager, PhaseType, ProjectStatus
+from llm_backend import LLMBackend, LLMResponse, call_backend, stream_backend, create_backend, default_timeout
+from llm_cache import LLMResponseCache, create_cache
+from llm_scheduler import LLMScheduler, create_scheduler, estimate_tokens
+from context_encoding import compact_json, encode_canvases, encode_layout
 import copy
-from dotenv import load_dotenv
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-print(f"API Key found: {'Yes' if api_key else 'No'}")
-client = genai.Client(api_key=api_key)
+from concurrent.futures import ThreadPoolExecutor
+
+PHASE_ORDER = (PhaseType.LAYOUT, PhaseType.CANVAS, PhaseType.BACKGROUND, PhaseType.ASSETS)
+
+# Phases that can send one request per canvas instead of one for the poster
+FAN_OUT_PHASES = (PhaseType.BACKGROUND, PhaseType.ASSETS)
+
+# Consecutive phases that can be generated by one model call (LLM_FUSE)
+FUSED_PHASES = {
+    "canvas+background": (PhaseType.CANVAS, PhaseType.BACKGROUND),
+    "all": (PhaseType.CANVAS, PhaseType.BACKGROUND, PhaseType.ASSETS)
+}
+
+
+def fused_phase_name(phases) -> str:
+    """Phase name a fused call is cached and recorded under, e.g. canvas+background"""
+    return "+".join(phase.value for phase in phases)
+
+
+def canvas_phase_name(phase: PhaseType, index: int) -> str:
+    """Phase name a per-canvas (fan-out) call is cached and recorded under, e.g. background/canvas_0"""
+    return f"{phase.value}/canvas_{index}"
+
+
+# Threads that draw canvases while the model is still generating
+PRERENDER_WORKERS = 2
+_prerender_executor = None
+
+
+def prerender_executor() -> ThreadPoolExecutor:
+    global _prerender_executor
+    if _prerender_executor is None:
+        _prerender_executor = ThreadPoolExecutor(max_workers=PRERENDER_WORKERS, thread_name_prefix="prerender")
+    return _prerender_executor
+
+
+def prerender_structure(phase: str, poster: dict, slot: Optional[dict] = None):
+    """
+    Repair, translate and draw one canvas structure the way the server will
+    render it in its slot (a compute_slot_geometry box; the canvas config
+    size when there is none)
+    """
+    try:
+        repaired, _ = validate_phase_json({"canvas_1": poster})
+        tree, _ = validate_tree(translate_canvas_numbering(repaired, phase=phase))
+        canvas = WidgetTreeParser.parse(tree)
+        if slot:
+            canvas.prerender(slot["width"], slot["height"])
+        else:
+            canvas.prerender()
+    except Exception as e:
+        # Only an optimization; the tree render draws the canvas itself
+        print(f"Prerender skipped: {e}")
+
 class CurrentPhase(str,Enum):
     LAYOUT = "Layout"
     CANVAS = "Canvas"
@@ -28,53 +86,199 @@ class PosterRenderManager:
             "layers": []
         }
 
-    def add_layers_to_poster(self, poster_structure, layers_to_add, phase_type):
+    def add_layers_to_poster(self, poster_structure, layers_to_add, phase_type, slot=None):
         # Append layers to poster's "layers" array
         if not isinstance(poster_structure.get("layers"), list):
             poster_structure["layers"] = []
+        self.fit_text_layers(poster_structure.get("canvas"), layers_to_add, slot)
         poster_structure["layers"].extend(layers_to_add)
         # No reordering, as order = render order
         return poster_structure
 
+    def fit_text_layers(self, canvas, layers, slot=None):
+        # Resolve text font sizes once here so the renderer doesn't re-fit on every draw.
+        # Text is fitted to the box the canvas is drawn at in its layout slot
+        try:
+            config = (int(canvas["width"]), int(canvas["height"]))
+        except (TypeError, KeyError, ValueError):
+            return
+        box = fit_content_size(*config, slot["width"], slot["height"]) if slot else config
+        # The factor Canvas.render_plan scales layers by
+        scale = min(box[0] / config[0], box[1] / config[1]) if box != config else 1
+        for layer in layers:
+            if not isinstance(layer, dict) or layer.get("type") != "text" or layer.get("fitted"):
+                continue
+            metrics = measure_text(
+                str(layer.get("text", "")),
+                layer.get("font"),
+                round(int(layer.get("size", 32)) * scale),
+                box,
+                float(layer.get("line_height", 1.0)),
+                round(int(layer.get("letter_spacing", 0)) * scale),
+                layer.get("transform")
+            )
+            if metrics["fits"]:
+                # Blocks that don't fit at any size keep the renderer's fallback.
+                # A scaled-down canvas keeps sizes in config pixels; this one
+                # scales back to exactly the fitted size
+                layer["size"] = metrics["size"] if scale == 1 else round(metrics["size"] / scale)
+                layer["fitted"] = True
+                if box != config:
+                    layer["fitted_box"] = list(box)
+
 class Posteragent:
-    def __init__(self):
+    def __init__(self, backend: Optional[LLMBackend] = None, cache: Optional[LLMResponseCache] = None,
+                 use_cache: bool = True, timeout: Optional[float] = None,
+                 scheduler: Optional[LLMScheduler] = None, fan_out: Optional[bool] = None,
+                 prerender: bool = False, on_phase_saved: Optional[Callable[[PhaseType, dict], None]] = None,
+                 fuse: Optional[str] = None, compact_context: Optional[bool] = None):
+        # LLM backend; defaults to the one named by LLM_BACKEND (Gemini)
+        self.backend = backend or create_backend()
+        # Seconds one LLM call may take before the phase fails
+        self.timeout = timeout if timeout is not None else default_timeout()
+        # Admission control (concurrency, RPM, TPM) shared by every agent in the process
+        self.scheduler = scheduler or create_scheduler()
+        # Response cache shared by all agents in the process, unless disabled
+        self.cache = (cache or create_cache()) if use_cache else None
+        # Background/assets: one concurrent request per canvas (LLM_FAN_OUT=1)
+        if fan_out is None:
+            fan_out = os.getenv("LLM_FAN_OUT", "0").lower() in ("1", "on", "true", "yes")
+        self.fan_out = fan_out
+        # Layout and canvas metadata in prompts as DSL/CSV instead of indented JSON (LLM_COMPACT_CONTEXT=0 to disable)
+        if compact_context is None:
+            compact_context = os.getenv("LLM_COMPACT_CONTEXT", "1").lower() not in ("0", "off", "false", "no")
+        self.compact_context = compact_context
+        # Phases generated by a single call (a FUSED_PHASES key, LLM_FUSE); None for one call per phase
+        if fuse is None:
+            fuse = os.getenv("LLM_FUSE", "").lower()
+        if fuse in ("", "0", "off", "false", "no"):
+            self.fused_phases = None
+        elif fuse in FUSED_PHASES:
+            self.fused_phases = FUSED_PHASES[fuse]
+        else:
+            raise ValueError(f"Unknown fused phase mode '{fuse}', expected one of: {', '.join(FUSED_PHASES)}")
+        # Fan-out results by canvas index; None when results map to canvases by position
+        self.canvas_results = None
+        # Canvas indices whose per-canvas request failed in the current phase
+        self.failed_canvases = []
+        # Draw each canvas as soon as its layers for the phase are known (for callers that render)
+        self.prerender = prerender
+        self.prerenders = []
+        # Called with each phase JSON once it is saved, so the caller can render it
+        # while the next phase is being generated
+        self.on_phase_saved = on_phase_saved
+        self.hand_overs = []
         self.result_parts = []
         self.current_phase = CurrentPhase.LAYOUT
         self.db = DatabaseManager()
         self.current_project_id = None
         self.current_json = None
+        # Slot geometry of the layout this agent generated (compile_layout); see slot_geometry()
+        self.layout_slots = None
         self.function_call_results = []
     
-    async def create_poster(self, user_prompt: str,project_id: Optional[str] = None) -> str:
-        """Create a complete poster through all phases autonomously"""
+    async def create_poster(self, user_prompt: str,project_id: Optional[str] = None, resume: bool = False) -> str:
+        """
+        Create a complete poster through all phases autonomously.
+        With resume, the project's completed phases are kept and generation
+        continues from the first missing one.
+        """
         try:
+            self.layout_slots = None
             # Create new project
             if project_id:
                 self.current_project_id = project_id
             else:
                 self.current_project_id = self.db.create_project(user_prompt)
             
-            # Run all phases in sequence
-            phases = [PhaseType.LAYOUT, PhaseType.CANVAS, PhaseType.BACKGROUND, PhaseType.ASSETS]
+            completed = self.completed_phases(self.current_project_id) if resume else []
+            if resume:
+                print(f"Resuming after completed phases: {', '.join(phase.value for phase in completed) or 'none'}")
+                remaining = [phase for phase in PHASE_ORDER if phase not in completed]
+                if remaining:
+                    self.db.update_project_status(self.current_project_id, ProjectStatus.ACTIVE, remaining[0])
             
-            for phase in phases:
-                print(f"Starting {phase} phase...")
-                result = await self.run_phase(user_prompt, phase)
+            # Run all phases in sequence, one model call per phase group
+            for phases in self.phase_groups(skip=completed):
+                if len(phases) == 1:
+                    phase = phases[0]
+                    print(f"Starting {phase} phase...")
+                    result = await self.run_phase(user_prompt, phase)
+                else:
+                    phase = fused_phase_name(phases)
+                    print(f"Starting fused {phase} phases...")
+                    result = await self.run_fused_phases(user_prompt, phases)
                 if "Error" in result:
+                    # Phases saved before the failure are still handed to on_phase_saved
+                    await self.wait_for_prerenders()
                     self.db.update_project_status(self.current_project_id, ProjectStatus.PARTIAL)
                     return f"Failed at {phase} phase: {result}"
             
-            # Mark project as completed
-            self.db.update_project_status(self.current_project_id, ProjectStatus.COMPLETED)
+            # Canvases drawn during generation, and the phases handed to on_phase_saved,
+            # are ready before the caller renders
+            await self.wait_for_prerenders()
+            
+            # Mark project as completed, or partial if a phase lost canvases (resume reruns it)
+            if len(self.completed_phases(self.current_project_id)) < len(PHASE_ORDER):
+                print("⚠️ Some phases are partial; resume the project to regenerate them")
+                self.db.update_project_status(self.current_project_id, ProjectStatus.PARTIAL)
+            else:
+                self.db.update_project_status(self.current_project_id, ProjectStatus.COMPLETED)
             
             # Return final JSON
             final_result = self.db.get_phase_result(self.current_project_id, PhaseType.ASSETS)
             return json.dumps(final_result['json_data'], indent=2)
+        except asyncio.CancelledError:
+            # The in-flight LLM request was cancelled with us; don't leave the project active
+            if self.current_project_id:
+                self.db.update_project_status(self.current_project_id, ProjectStatus.FAILED)
+            raise
         except Exception as e:
+            await self.wait_for_prerenders()
             if self.current_project_id:
                 self.db.update_project_status(self.current_project_id, ProjectStatus.FAILED)
             return f"Error creating poster: {str(e)}"
 
+    async def resume_poster(self, project_id: str) -> str:
+        """Continue a stored project from its first missing phase"""
+        project = self.db.get_project(project_id)
+        if not project:
+            return f"Error resuming poster: project {project_id} not found"
+        return await self.create_poster(project['user_prompt'], project_id=project_id, resume=True)
+
+    def slot_geometry(self) -> dict:
+        """
+        Box of every canvas_N in the current layout, in container pixels: the
+        compiled template's slots when this agent generated the layout, else
+        computed from the stored layout (e.g. on resume)
+        """
+        if self.layout_slots is not None:
+            return self.layout_slots
+        return compute_slot_geometry(self.current_json or {})
+
+    def completed_phases(self, project_id: str) -> list:
+        """Leading phases with a completed result; later results, including partial ones, are regenerated"""
+        results = self.db.get_all_phase_results(project_id)
+        completed = []
+        for phase in PHASE_ORDER:
+            if results.get(phase.value, {}).get('status') != 'completed':
+                break
+            completed.append(phase)
+        return completed
+
+    def phase_groups(self, skip=()) -> list:
+        """Phases still to run, in order, with the fused phases (if any) as one group"""
+        phases = [phase for phase in PHASE_ORDER if phase not in skip]
+        # A fused call starts from the layout, so it only applies when none of its phases is kept
+        fused = self.fused_phases if self.fused_phases and not set(self.fused_phases) & set(skip) else ()
+        groups = []
+        for phase in phases:
+            if phase not in fused:
+                groups.append((phase,))
+            elif phase == fused[0]:
+                groups.append(fused)
+        return groups
+
     # NEW METHOD: Run individual phase
     async def run_phase(self, user_prompt: str, phase: PhaseType) -> str:
         """Run a single phase of poster generation"""
@@ -87,82 +291,363 @@ class Posteragent:
             previous_json = self.db.get_current_json_for_next_phase(self.current_project_id, phase)
             self.current_json = previous_json
             
-            # Build context for this phase
-            context = await self.build_context(user_prompt, phase.value)
-            
             # Build tools for this phase
             tool_list = await self.build_tools(phase)
             
-            print(f"\nContext for {phase}:")
-            #print(context)
-            print(f"\nTools for {phase}:")
-            #print(json.dumps(tool_list, indent=2))
-
-            # Generate response
-            print(f"\nGenerating response for {phase}...")
-            #print("\nSending to Gemini with tools:", json.dumps(tool_list, indent=2))
-            # Configure generation parameters
+            self.canvas_results = None
+            self.failed_canvases = []
+            canvases = self.analyze_canvas_structure(self.current_json) if self.fan_out and phase in FAN_OUT_PHASES else None
+            if isinstance(canvases, list) and canvases:
+                # One smaller request per canvas, merged in canvas order
+                generated = await self.generate_canvas_responses(user_prompt, phase, tool_list, canvases)
+            else:
+                # Build context for this phase
+                context = await self.build_context(user_prompt, phase.value)
+                
+                print(f"\nContext for {phase}:")
+                #print(context)
+                print(f"\nTools for {phase}:")
+                #print(json.dumps(tool_list, indent=2))
+
+                # Generate response
+                print(f"\nGenerating response for {phase}...")
+                #print("\nSending to Gemini with tools:", json.dumps(tool_list, indent=2))
+                # Configure generation parameters
+                
+                # Tool calls are processed as they stream in, and a canvas whose
+                # layers are final starts drawing while the rest is generated
+                stream_canvases = self.poster_slots(self.current_json) if self.prerender and phase in FAN_OUT_PHASES else []
+                
+                def on_part(part):
+                    before = len(self.function_call_results)
+                    self.process_response_parts(LLMResponse([part]))
+                    position = len(self.function_call_results) - 1
+                    if len(self.function_call_results) > before and position < len(stream_canvases):
+                        result = self.function_call_results[position]
+                        structure, slot = stream_canvases[position]
+                        self.prerender_canvas(phase, structure, result if isinstance(result, list) else [result], slot)
+                
+                response, cache_key, cached = await self.generate_response(phase, context, tool_list, on_part)
+                
+                print(f"\nAPI Response ({'cache' if cached else self.backend.name}):")
+                print(response.to_dict())
+
+                if response.parts is None:
+                    print(f"\n⚠️ No function calls generated for {phase} phase")
+                    print("This phase will be skipped (no assets needed)")
+                
+                # Use previous JSON as-is since no changes needed
+                    if self.current_json:
+                        await self.save_phase(phase, self.current_json)
+                    self.cache_response(cache_key, phase, response, cached)
+                    return "Phase completed (no changes needed)"
+                
+                generated = [(cache_key, response, cached)]
+            
+            # Update JSON and save to database; failed canvases make the phase partial
+            await self.store_phase_result(phase, "partial" if self.failed_canvases else "completed")
+            # Only responses that produced a saved phase are worth replaying
+            for cache_key, response, cached in generated:
+                self.cache_response(cache_key, phase, response, cached)
             
-            response = await asyncio.to_thread(
-                client.models.generate_content,
-                model='gemini-2.5-flash',  # Use the correct model name
-                contents=context,
-                config={'tools': [{'function_declarations': tool_list}]}  # Pass tools in the correct format
-            )
+            return "Phase completed successfully"
             
-            print("\nAPI Response:")
-            print(response.candidates[0].content)
+        except Exception as e:
+            return f"Error in {phase} phase: {str(e)}"
+
+    def process_response_parts(self, response: LLMResponse):
+        for part in response.parts or []:
+            if hasattr(part, "text") and part.text is not None:
+                #print(f"Found text: {part.text}")
+                self.result_parts.append(part.text)
+            if hasattr(part, "function_call") and part.function_call is not None:
+                #print(f"Found function call: {part.function_call.name}")
+                #print(f"With arguments: {part.function_call.args}")
+                self.process_function_call(part.function_call)
+
+    async def generate_canvas_responses(self, user_prompt: str, phase: PhaseType, tool_list: list, canvases: list) -> list:
+        """
+        Fan-out mode: one concurrent request per canvas with only that canvas's
+        metadata. Results are processed in canvas order into self.canvas_results;
+        a canvas whose request or tool calls fail keeps its previous layers and
+        its index is listed in self.failed_canvases.
+        Returns (cache key, response, cached) for every canvas that succeeded.
+        """
+        contexts = [await self.build_context(user_prompt, phase.value, canvas_index=canvas["index"])
+                    for canvas in canvases]
+        structures = self.poster_slots(self.current_json) if self.prerender else []
+        print(f"\nGenerating {len(contexts)} per-canvas responses for {phase}...")
+        
+        async def run_canvas(index, context):
+            try:
+                return index, await self.generate_response(canvas_phase_name(phase, index), context, tool_list)
+            except Exception as e:
+                return index, e
+        
+        tasks = [asyncio.ensure_future(run_canvas(canvas["index"], context))
+                 for canvas, context in zip(canvases, contexts)]
+        self.canvas_results = {}
+        outcomes = {}
+        failed = []
+        try:
+            # Each canvas is processed (and drawn) as soon as its response is in
+            for finished in asyncio.as_completed(tasks):
+                index, outcome = await finished
+                if isinstance(outcome, BaseException):
+                    failed.append((index, repr(outcome)))
+                    continue
+                response, cache_key, cached = outcome
+                try:
+                    results = self.run_response_tools(response)
+                except Exception as e:
+                    failed.append((index, repr(e)))
+                    continue
+                self.canvas_results[index] = results
+                outcomes[index] = outcome
+                if index < len(structures):
+                    layers = [layer for result in results for layer in (result if isinstance(result, list) else [result])]
+                    structure, slot = structures[index]
+                    self.prerender_canvas(phase, structure, layers, slot)
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        # Merge in canvas order, whatever order the responses arrived in
+        self.function_call_results = [result for index in sorted(self.canvas_results)
+                                      for result in self.canvas_results[index]]
+        failed.sort()
+        self.failed_canvases = [index for index, _ in failed]
+        for index, error in failed:
+            print(f"⚠️ Per-canvas request failed, keeping previous layers: canvas {index}: {error}")
+        if failed and not outcomes:
+            raise RuntimeError("every per-canvas request failed: " +
+                               "; ".join(f"canvas {index}: {error}" for index, error in failed))
+        return [(cache_key, response, cached) for index, (response, cache_key, cached) in sorted(outcomes.items())]
+
+    def run_response_tools(self, response: LLMResponse) -> list:
+        """Run a response's tool calls and return their results, without mapping them to canvases"""
+        results = []
+        for part in response.parts or []:
+            if part.text is not None:
+                self.result_parts.append(part.text)
+            if part.function_call is not None:
+                result = self.run_tool_call(part.function_call)
+                if result:
+                    results.append(result)
+                    self.result_parts.append(json.dumps(result, indent=2))
+        return results
+
+    def poster_structures(self, json_obj) -> list:
+        """Canvas structures in the order update_json_with_results fills them by position"""
+        return [structure for structure, _ in self.poster_slots(json_obj)]
+
+    def poster_slots(self, json_obj) -> list:
+        """(structure, slot box or None) for every poster_structures() entry, by its canvas_N key"""
+        slots = self.slot_geometry()
+        found = []
+        
+        def collect(obj, key):
+            if isinstance(obj, dict):
+                if "canvas" in obj and "layers" in obj:
+                    found.append((obj, slots.get(key)))
+                for child_key, value in obj.items():
+                    if isinstance(value, (dict, list)):
+                        collect(value, child_key)
+            elif isinstance(obj, list):
+                for item in obj:
+                    collect(item, None)
+        
+        collect(json_obj, None)
+        return found
+
+    def prerender_canvas(self, phase: PhaseType, structure: dict, new_layers: list, slot: Optional[dict] = None):
+        """
+        Draw a canvas with this phase's layers on a worker thread, ahead of the
+        tree render, at the size its layout slot gives it
+        """
+        poster = copy.deepcopy(structure)
+        PosterRenderManager().add_layers_to_poster(poster, copy.deepcopy(new_layers), phase, slot)
+        self.prerenders.append(
+            asyncio.get_running_loop().run_in_executor(prerender_executor(), prerender_structure, phase.value, poster, slot)
+        )
 
-            if response.candidates[0].content.parts is None:
-                print(f"\n⚠️ No function calls generated for {phase} phase")
-                print("This phase will be skipped (no assets needed)")
+    async def save_phase(self, phase: PhaseType, phase_json: dict, status: str = "completed"):
+        """Store a phase result and hand it to on_phase_saved"""
+        self.db.save_phase_result(self.current_project_id, phase, phase_json, status)
+        if self.on_phase_saved is not None:
+            # Handed over once this phase's canvases are drawn, so its render reuses
+            # them; the next phase does not wait for either
+            drawing, self.prerenders = self.prerenders, []
             
-            # Use previous JSON as-is since no changes needed
-                if self.current_json:
-                    self.db.save_phase_result(self.current_project_id, phase, self.current_json)
-                return "Phase completed (no changes needed)"
+            async def hand_over():
+                if drawing:
+                    await asyncio.gather(*drawing, return_exceptions=True)
+                self.on_phase_saved(phase, phase_json)
             
-            # Process response
-            print("\nProcessing response parts...")
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, "text") and part.text is not None:
-                    #print(f"Found text: {part.text}")
-                    self.result_parts.append(part.text)
-                if hasattr(part, "function_call") and part.function_call is not None:
-                    #print(f"Found function call: {part.function_call.name}")
-                    #print(f"With arguments: {part.function_call.args}")
-                    self.process_function_call(part.function_call)
+            self.hand_overs.append(asyncio.ensure_future(hand_over()))
+
+    async def store_phase_result(self, phase: PhaseType, status: str = "completed") -> dict:
+        """
+        Apply this phase's tool results to current_json, then validate and save it.
+        Raises SchemaError, saving nothing, when the translated tree cannot be rendered.
+        A 'partial' result still feeds the next phase but is regenerated on resume.
+        """
+        updated_json = await self.update_json_with_results(phase)
+        
+        # Reject or repair malformed canvases and layers before they are stored
+        updated_json, schema_warnings = validate_phase_json(updated_json)
+        for warning in schema_warnings:
+            print(f"Schema: {warning}")
+        # A tree the renderer cannot draw is not saved: SchemaError fails the phase.
+        # The validated translation is cached, so the phase render reuses it
+        translate_phase_cached(self.db, self.current_project_id, phase.value, updated_json)
+        print("Saving phase result, phase:", phase)
+        print("Project ID:", self.current_project_id, type(self.current_project_id))
+        print("Phase:", phase, type(phase))
+        print("Updated JSON:", type(updated_json))
+
+        await self.save_phase(phase, updated_json, status)
+        
+        # Debug: Print current phase result
+        print(f"\n=== {phase} Phase Result ===")
+        print(json.dumps(updated_json, indent=2))
+        print("====================\n")
+        
+        # Update project current phase
+        next_phases = {
+            PhaseType.LAYOUT: PhaseType.CANVAS,
+            PhaseType.CANVAS: PhaseType.BACKGROUND, 
+            PhaseType.BACKGROUND: PhaseType.ASSETS,
+            PhaseType.ASSETS: None
+        }
+        
+        next_phase = next_phases.get(phase)
+        if next_phase:
+            self.db.update_project_status(self.current_project_id, ProjectStatus.ACTIVE, next_phase)
+        
+        return updated_json
+
+    async def run_fused_phases(self, user_prompt: str, phases: tuple) -> str:
+        """
+        Generate consecutive phases with one model call, then split the tool calls
+        back into one stored result per phase, as if each phase had run alone.
+        
+        Tool calls are assigned to a phase by tool name. Background and assets
+        calls belong to the canvas of the generate_canvas call before them.
+        """
+        label = fused_phase_name(phases)
+        try:
+            self.result_parts = []
+            self.function_call_results = []
+            self.canvas_results = None
+            self.current_json = self.db.get_current_json_for_next_phase(self.current_project_id, phases[0])
             
-            # Update JSON and save to database
-            updated_json = await self.update_json_with_results(phase)
-            print("Saving phase result, phase:", phase)
-            print("Project ID:", self.current_project_id, type(self.current_project_id))
-            print("Phase:", phase, type(phase))
-            print("Updated JSON:", type(updated_json))
-
-            self.db.save_phase_result(self.current_project_id, phase, updated_json)
+            # Combined tool set, and which phase each tool belongs to
+            tool_list = []
+            phase_of_tool = {}
+            for phase in phases:
+                for tool in await self.build_tools(phase):
+                    if tool["name"] not in phase_of_tool:
+                        phase_of_tool[tool["name"]] = phase
+                        tool_list.append(tool)
             
-            # Debug: Print current phase result
-            print(f"\n=== {phase} Phase Result ===")
-            print(json.dumps(updated_json, indent=2))
-            print("====================\n")
+            context = await self.build_fused_context(user_prompt, phases)
+            print(f"\nGenerating fused response for {label}...")
+            response, cache_key, cached = await self.generate_response(label, context, tool_list)
+            print(f"\nAPI Response ({'cache' if cached else self.backend.name}):")
+            print(response.to_dict())
             
-            # Update project current phase
-            next_phases = {
-                PhaseType.LAYOUT: PhaseType.CANVAS,
-                PhaseType.CANVAS: PhaseType.BACKGROUND, 
-                PhaseType.BACKGROUND: PhaseType.ASSETS,
-                PhaseType.ASSETS: None
-            }
+            # Phase -> canvas index -> tool results
+            split = {phase: {} for phase in phases}
+            canvas_index = 0
+            canvases_seen = 0
+            for part in response.parts or []:
+                if part.text is not None:
+                    self.result_parts.append(part.text)
+                if part.function_call is None:
+                    continue
+                result = self.run_tool_call(part.function_call)
+                if not result:
+                    continue
+                phase = phase_of_tool.get(part.function_call.name)
+                if phase is None:
+                    print(f"⚠️ {part.function_call.name} is not a {label} tool, ignoring it")
+                    continue
+                if phase == PhaseType.CANVAS:
+                    canvas_index = canvases_seen
+                    canvases_seen += 1
+                split[phase].setdefault(canvas_index, []).append(result)
             
-            next_phase = next_phases.get(phase)
-            if next_phase:
-                self.db.update_project_status(self.current_project_id, ProjectStatus.ACTIVE, next_phase)
+            for phase in phases:
+                self.function_call_results = [result for index in sorted(split[phase]) for result in split[phase][index]]
+                # Canvases fill the layout placeholders by position; layers go to their canvas
+                self.canvas_results = None if phase == PhaseType.CANVAS else split[phase]
+                self.current_json = await self.store_phase_result(phase)
             
-            return "Phase completed successfully"
+            self.cache_response(cache_key, label, response, cached)
+            return "Phases completed successfully"
             
         except Exception as e:
-            return f"Error in {phase} phase: {str(e)}"
+            return f"Error in {label} phase: {str(e)}"
+
+    async def wait_for_prerenders(self):
+        pending = self.prerenders + self.hand_overs
+        self.prerenders, self.hand_overs = [], []
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def generate_response(self, phase, context: str, tool_list: list, on_part=None):
+        """
+        Response for this phase prompt: (response, cache key, whether it came from the cache).
+        phase is a PhaseType or a fused or per-canvas phase name. With on_part, the response is
+        streamed and on_part gets every part once, in order.
+        """
+        phase_name = phase.value if isinstance(phase, PhaseType) else phase
+        streamed = 0
+        
+        def handle_part(part):
+            nonlocal streamed
+            streamed += 1
+            on_part(part)
+        
+        def call_model():
+            # Queue for a slot under the rate limits, then make the call
+            if on_part is None:
+                model_call = lambda: call_backend(self.backend, phase_name, context, tool_list, self.timeout)
+            else:
+                model_call = lambda: stream_backend(self.backend, phase_name, context, tool_list, handle_part, self.timeout)
+            return self.scheduler.run(self.current_project_id or "default", estimate_tokens(context, tool_list), model_call)
+        
+        cache_key = None
+        cached = False
+        if not self.cache:
+            response = await call_model()
+        else:
+            model = f"{self.backend.name}/{self.backend.model}"
+            cache_key = self.cache.key(model, phase_name, context, tool_list)
+            stored = await asyncio.to_thread(self.cache.get, cache_key)
+            if stored is not None:
+                print(f"LLM cache hit for {phase} phase")
+                response = LLMResponse.from_dict(stored)
+                cached = True
+            else:
+                # Identical prompts in flight at the same time share one backend call
+                response = await self.cache.shared_call(cache_key, call_model)
+        
+        if on_part is not None:
+            # Parts that were not streamed to us: cache hits and another caller's shared call
+            for part in (response.parts or [])[streamed:]:
+                on_part(part)
+        return response, cache_key, cached
+    
+    def cache_response(self, cache_key: Optional[str], phase, response: LLMResponse, cached: bool):
+        if self.cache and cache_key and not cached:
+            phase_name = phase.value if isinstance(phase, PhaseType) else phase
+            try:
+                self.cache.put(cache_key, f"{self.backend.name}/{self.backend.model}", phase_name, response.to_dict())
+            except sqlite3.Error as e:
+                # The phase is saved; a failed cache write only costs a future round trip
+                print(f"LLM cache write failed: {e}")
 
     async def update_json_with_results(self, phase: PhaseType) -> dict:
         """Updated method that creates your exact render.py JSON schema"""
@@ -212,13 +697,25 @@ class Posteragent:
             updated_json = copy.deepcopy(self.current_json)
             layer_results = self.function_call_results
             layer_index = 0
+            canvas_results = self.canvas_results
+            canvas_position = 0
+            # Text is fitted to the size each canvas is drawn at in its slot
+            slots = self.slot_geometry()
             
-            def add_layers_to_posters(obj):
-                nonlocal layer_index
+            def add_layers_to_posters(obj, key=None):
+                nonlocal layer_index, canvas_position
                 
                 if isinstance(obj, dict):
+                    if canvas_results is not None:
+                        # Fan-out: canvases are numbered as in analyze_canvas_structure
+                        if isinstance(obj.get("canvas"), dict):
+                            layers_to_add = [layer for result in canvas_results.get(canvas_position, [])
+                                             for layer in (result if isinstance(result, list) else [result])]
+                            if layers_to_add and "layers" in obj:
+                                obj = PosterRenderManager().add_layers_to_poster(obj, layers_to_add, phase, slots.get(key))
+                            canvas_position += 1
                     # Check if this is a poster structure (has canvas and layers)
-                    if "canvas" in obj and "layers" in obj:
+                    elif "canvas" in obj and "layers" in obj:
                         if layer_index < len(layer_results):
                             poster_manager = PosterRenderManager()
                             layer_data = layer_results[layer_index]
@@ -226,13 +723,13 @@ class Posteragent:
                             # Handle both single layers and arrays
                             layers_to_add = layer_data if isinstance(layer_data, list) else [layer_data]
                             
-                            obj = poster_manager.add_layers_to_poster(obj, layers_to_add, phase)
+                            obj = poster_manager.add_layers_to_poster(obj, layers_to_add, phase, slots.get(key))
                             layer_index += 1
                     
                     # Recurse into nested structures
-                    for key, value in obj.items():
+                    for child_key, value in obj.items():
                         if isinstance(value, (dict, list)):
-                            obj[key] = add_layers_to_posters(value)
+                            obj[child_key] = add_layers_to_posters(value, child_key)
                 
                 elif isinstance(obj, list):
                     for i, item in enumerate(obj):
@@ -247,6 +744,15 @@ class Posteragent:
 
     # UPDATED METHOD: Enhanced process_function_call to store results
     def process_function_call(self, function_call):
+        result = self.run_tool_call(function_call)
+        
+        # Store result for positional mapping
+        if result:
+            self.function_call_results.append(result)
+            self.result_parts.append(json.dumps(result, indent=2))
+
+    def run_tool_call(self, function_call):
+        """Run one tool call and return its result"""
         args = function_call.args
         fn = function_call.name
         
@@ -262,6 +768,8 @@ class Posteragent:
             result = Tools.generate_layout(
                 layout_string=args.get("layout_string")
             )
+            # Same template cache entry; its slots size the later phases' canvases
+            self.layout_slots = compile_layout(args.get("layout_string"))["slots"]
         elif fn == "generate_radial_gradient":
             result = Tools.generate_radial_gradient(
                 colors=args.get("colors"),
@@ -367,14 +875,24 @@ class Posteragent:
                 opacity=args.get("opacity", 1.0),
                 blur=int(args.get("blur", 0))
             )
+        elif fn == "generate_shape_instances":
+            result = Tools.generate_shape_instances(
+                shape=args.get("shape", "ellipse"),
+                positions=args.get("positions"),
+                sizes=args.get("sizes"),
+                colors=args.get("colors"),
+                opacities=args.get("opacities"),
+                blurs=args.get("blurs"),
+                rotations=args.get("rotations"),
+                points=args.get("points"),
+                anchor=args.get("anchor", "center")
+            )
         
-        # Store result for positional mapping
-        if result:
-            self.function_call_results.append(result)
-            self.result_parts.append(json.dumps(result, indent=2))
+        return result
 
     # NEW METHOD: Build context for each phase
-    async def build_context(self, input: str, phase: str) -> str:
+    async def build_context(self, input: str, phase: str, canvas_index: Optional[int] = None) -> str:
+        """Prompt for a phase; background/assets can be scoped to one canvas for fan-out"""
         print(f"Building context for phase {phase} with input: {input}")  # Debug print
 
         # Convert PhaseType enum to string if needed
@@ -404,12 +922,15 @@ class Posteragent:
 
         elif phase.lower() == "canvas":
             canvas_count = self.count_placeholders(self.current_json)
+            slot_sizes = {name: f"{slot['width']}x{slot['height']}"
+                          for name, slot in self.slot_geometry().items()}
             return (
                 "You are an autonomous canvas configuration agent for enterprise poster design.\n"
                 f"- There are {canvas_count} canvases to define based strictly on the current layout.\n"
+                f"- SLOT SIZES in px, in canvas order: {self.encode_json(slot_sizes)}\n"
                 "- For EACH placeholder, output one generate_canvas TOOL CALL only—never chat or explain.\n"
-                "- Always specify width, height, and background. Use JSON input for correct dimensions.\n"
-                f"- LAYOUT CONTEXT (read-only):\n{json.dumps(self.current_json, indent=2)}\n"
+                "- Always specify width, height, and background. Use the slot sizes and layout below for correct dimensions.\n"
+                f"- LAYOUT CONTEXT (read-only):\n{self.encode_layout(self.current_json)}\n"
                 "Output NOTHING but valid generate_canvas calls in response."
                 "POSTER REQUEST:\n"
                 f"{input}\n"
@@ -417,11 +938,22 @@ class Posteragent:
 
         elif phase.lower() == "background":
             canvas_info = self.analyze_canvas_structure(self.current_json)
+            if canvas_index is not None:
+                return (
+                    "You are the autonomous background phase agent for poster design.\n"
+                    "- Output strictly JSON-compatible TOOL CALLS for the background of the ONE canvas below.\n"
+                    "- Allowed tools: generate_radial_gradient, generate_linear_gradient, generate_mesh_gradient, generate_shape_blur_gradient, generate_color_overlay.\n"
+                    f"- CANVAS METADATA (read-only):\n{self.encode_canvases(self.canvas_info_at(canvas_info, canvas_index), phase)}\n"
+                    "- Do NOT output ANY natural language, markdown, or explanations.\n"
+                    "Output valid background tool calls for this canvas. Only that."
+                    "POSTER REQUEST:\n"
+                    f"{input}\n"
+                )
             return (
                 "You are the autonomous background phase agent for poster design.\n"
                 "- Output strictly JSON-compatible TOOL CALLS for background generation (one per canvas).\n"
                 "- Allowed tools: generate_radial_gradient, generate_linear_gradient, generate_mesh_gradient, generate_shape_blur_gradient, generate_color_overlay.\n"
-                f"- CANVAS METADATA (read-only):\n{json.dumps(canvas_info, indent=2)}\n"
+                f"- CANVAS METADATA (read-only):\n{self.encode_canvases(canvas_info, phase)}\n"
                 "- Do NOT output ANY natural language, markdown, or explanations.\n"
                 "Output valid background tool calls. Only that."
                 "POSTER REQUEST:\n"
@@ -430,13 +962,27 @@ class Posteragent:
 
         elif phase.lower() == "assets":
             canvas_info = self.analyze_canvas_structure(self.current_json)
+            if canvas_index is not None:
+                return (
+                    "You are the final rendering agent for poster design content layers (assets).\n"
+                    "- Output ONLY valid JSON tool calls for the content of the ONE canvas below, using the content asset tools:\n"
+                    "  - generate_text_layer, generate_image_layer, generate_ellipse, generate_polygon, generate_shape_instances\n"
+                    "- For many similar shapes (confetti, dots, bokeh) use ONE generate_shape_instances call instead of repeated generate_ellipse/generate_polygon calls.\n"
+                    "- Each tool call describes ONE content layer; output in draw order (back to front).\n"
+                    "- Do not chat, explain, or use markdown. Only emit valid tool calls—no text.\n"
+                    f"- CANVAS CONTEXT:\n{self.encode_canvases(self.canvas_info_at(canvas_info, canvas_index), phase)}\n"
+                    "Place each tool call directly in your output, nothing else."
+                    "POSTER REQUEST:\n"
+                    f"{input}\n"
+                )
             return (
                 "You are the final rendering agent for poster design content layers (assets).\n"
                 "- For each canvas, output ONLY valid JSON tool calls for the content asset tools:\n"
-                "  - generate_text_layer, generate_image_layer, generate_ellipse, generate_polygon\n"
+                "  - generate_text_layer, generate_image_layer, generate_ellipse, generate_polygon, generate_shape_instances\n"
+                "- For many similar shapes (confetti, dots, bokeh) use ONE generate_shape_instances call instead of repeated generate_ellipse/generate_polygon calls.\n"
                 "- Each tool call describes ONE content layer; output in draw order (back to front).\n"
                 "- Do not chat, explain, or use markdown. Only emit valid tool calls—no text.\n"
-                f"- CANVAS CONTEXT:\n{json.dumps(canvas_info, indent=2)}\n"
+                f"- CANVAS CONTEXT:\n{self.encode_canvases(canvas_info, phase)}\n"
                 "Place each tool call directly in your output, nothing else."
                 "POSTER REQUEST:\n"
                 f"{input}\n"
@@ -444,6 +990,45 @@ class Posteragent:
 
         return ""
 
+    async def build_fused_context(self, input: str, phases: tuple) -> str:
+        """Prompt for generating several phases in one call, starting from the layout"""
+        canvas_count = self.count_placeholders(self.current_json)
+        slot_sizes = {name: f"{slot['width']}x{slot['height']}"
+                      for name, slot in self.slot_geometry().items()}
+        steps = ["one generate_canvas call (width, height, background)"]
+        if PhaseType.BACKGROUND in phases:
+            steps.append("its background tool calls (generate_radial_gradient, generate_linear_gradient, "
+                         "generate_mesh_gradient, generate_shape_blur_gradient, generate_color_overlay)")
+        if PhaseType.ASSETS in phases:
+            steps.append("its content layer calls in draw order, back to front (generate_text_layer, generate_image_layer, "
+                         "generate_ellipse, generate_polygon, generate_shape_instances; one generate_shape_instances "
+                         "call for many similar shapes)")
+        return (
+            "You are an autonomous poster design agent completing several design phases in one response.\n"
+            f"- There are {canvas_count} canvases to define based strictly on the current layout.\n"
+            f"- SLOT SIZES in px, in canvas order: {self.encode_json(slot_sizes)}\n"
+            "- For EACH canvas, in canvas order, output " + ", then ".join(steps) + ".\n"
+            "- Every call after a generate_canvas belongs to that canvas, until the next generate_canvas.\n"
+            f"- LAYOUT CONTEXT (read-only):\n{self.encode_layout(self.current_json)}\n"
+            "- Do NOT output ANY natural language, markdown, or explanations.\n"
+            "Output NOTHING but valid tool calls."
+            "POSTER REQUEST:\n"
+            f"{input}\n"
+        )
+
+    def encode_layout(self, layout_json) -> str:
+        return encode_layout(layout_json) if self.compact_context else json.dumps(layout_json, indent=2)
+
+    def encode_canvases(self, canvas_info, phase: str) -> str:
+        return encode_canvases(canvas_info, phase) if self.compact_context else json.dumps(canvas_info, indent=2)
+
+    def encode_json(self, obj) -> str:
+        return compact_json(obj) if self.compact_context else json.dumps(obj)
+
+    def canvas_info_at(self, canvas_info, canvas_index: int):
+        """The analyze_canvas_structure entry of one canvas, as a one-item list"""
+        return [info for info in canvas_info if isinstance(info, dict) and info.get("index") == canvas_index]
+
     # NEW HELPER METHOD: Count placeholders in layout
     def count_placeholders(self, json_obj):
         """Count the number of canvas placeholders in the JSON"""
@@ -548,6 +1133,7 @@ class Posteragent:
                 clean_tool_config(Tool_config.generate_ellipse),
                 clean_tool_config(Tool_config.generate_image_layer),
                 clean_tool_config(Tool_config.generate_polygon),
+                clean_tool_config(Tool_config.generate_shape_instances),
                 clean_tool_config(Tool_config.generate_text_layer)
             ]
         else:
@@ -1,9 +1,14 @@
 import json
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from PIL import Image
 from abc import ABC, abstractmethod
 from typing import Dict, List, Any, Tuple, Optional, Union
 
 from utils import hex_to_rgba
+from buffer_pool import acquire, release, render_pool
 from background import (
     draw_radial_gradient,
     draw_linear_gradient,
@@ -16,33 +21,161 @@ from assets import (
     draw_ellipse,
     draw_polygon,
     draw_image_layer,
-    draw_text_layer
+    draw_text_layer,
+    draw_shape_instances
 )
+from compiled_layers import (
+    CompiledLayer,
+    RadialGradient,
+    LinearGradient,
+    MeshGradient,
+    ShapeBlurGradient,
+    ColorOverlay,
+    SprayNoise,
+    Ellipse,
+    Polygon,
+    ShapeInstances,
+    ImageLayer,
+    TextLayer,
+    compile_layer,
+    compile_layers
+)
+from render_plan import RenderPlan, optimize_layers
+
+
+# Layer fields in canvas pixels, grouped by the axis they scale along
+_X_FIELDS = ('x', 'width', 'shape_x', 'shape_width', 'center_x', 'radius_x')
+_Y_FIELDS = ('y', 'height', 'shape_y', 'shape_height', 'center_y', 'radius_y')
+_UNIFORM_FIELDS = ('blur', 'blur_radius', 'size', 'stroke_width', 'letter_spacing')
+
+
+def _scale_px(value, factor):
+    """Scale a pixel value; percentages are relative to the canvas and stay as-is"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        if value.endswith('%'):
+            return value
+        try:
+            value = float(value)
+        except ValueError:
+            return value
+    if isinstance(value, (int, float)):
+        return int(round(value * factor))
+    return value
+
+
+def _scale_point(point, sx, sy):
+    if isinstance(point, (list, tuple)) and len(point) == 2:
+        return [_scale_px(point[0], sx), _scale_px(point[1], sy)]
+    return point
+
+
+def scale_layer(layer: Dict, sx: float, sy: float) -> Dict:
+    """
+    Copy of a layer with its pixel values rescaled from the canvas config
+    size to the size the canvas is rendered at. Lengths that are not tied to
+    an axis (blur, font size, stroke) use the smaller factor.
+    """
+    s = min(sx, sy)
+    t = layer.get('type')
+    scaled = dict(layer)
+
+    # Pixel defaults the drawers would otherwise apply unscaled
+    if t == 'shape' and layer.get('shape') == 'ellipse':
+        scaled.setdefault('width', 100)
+        scaled.setdefault('height', 100)
+    elif t == 'text':
+        scaled.setdefault('size', 32)
+        if 'fitted_box' not in scaled:
+            # Sizes were fitted to the config box; let the renderer re-fit to the drawn box
+            scaled.pop('fitted', None)
+    elif t == 'gradient' and layer.get('gradient_type') == 'shape_blur':
+        scaled.setdefault('blur_radius', 20)
+
+    for key in _X_FIELDS:
+        if key in scaled:
+            scaled[key] = _scale_px(scaled[key], sx)
+    for key in _Y_FIELDS:
+        if key in scaled:
+            scaled[key] = _scale_px(scaled[key], sy)
+    for key in _UNIFORM_FIELDS:
+        if key in scaled:
+            scaled[key] = _scale_px(scaled[key], s)
 
+    if isinstance(layer.get('mesh_points'), list):
+        scaled['mesh_points'] = [
+            dict(pt, x=_scale_px(pt.get('x'), sx), y=_scale_px(pt.get('y'), sy)) if isinstance(pt, dict) else pt
+            for pt in layer['mesh_points']
+        ]
+    if t == 'shape' and isinstance(layer.get('points'), list):
+        scaled['points'] = [_scale_point(pt, sx, sy) for pt in layer['points']]
+    if isinstance(layer.get('shadow'), dict):
+        shadow = layer['shadow']
+        scaled['shadow'] = dict(shadow, offset_x=_scale_px(shadow.get('offset_x', 2), sx),
+                                offset_y=_scale_px(shadow.get('offset_y', 2), sy))
+    if isinstance(layer.get('filters'), list):
+        scaled['filters'] = [
+            dict(f, radius=_scale_px(f.get('radius', 5), s)) if isinstance(f, dict) and f.get('type') == 'gaussian_blur' else f
+            for f in layer['filters']
+        ]
 
-def draw_layer(base, layer, width, height):
-    t = layer['type']
-    if t == 'gradient' and layer.get('gradient_type') == 'radial':
-        draw_radial_gradient(base, layer, width, height)
-    elif t == "gradient" and layer.get('gradient_type') == 'linear':
-        draw_linear_gradient(base,layer,width,height)
-    elif t == "gradient" and layer.get('gradient_type') == 'mesh':
-        draw_mesh_gradient(base,layer,width,height)
-    elif t == "gradient" and layer.get('gradient_type') == 'shape_blur':
-        draw_shape_blur_gradient(base,layer,width,height)
-    elif t == 'color_overlay':
-        draw_color_overlay(base, layer, width, height)
-    elif t == 'shape' and layer.get('shape', None) == 'ellipse':
-        draw_ellipse(base, layer, width, height)
-    elif t == 'shape' and layer.get('shape', None) == 'polygon':
-        draw_polygon(base, layer, width, height)
-    elif t == "spray_noise":
-        draw_spray_noise(base, layer, width, height)
-    elif t == "image":
-        draw_image_layer(base,layer,width,height)
-    elif t == "text":
-        draw_text_layer(base,layer,width,height)
-    # Add more types as needed
+    if t == 'shape_instances':
+        if isinstance(layer.get('positions'), list):
+            scaled['positions'] = [_scale_point(pt, sx, sy) for pt in layer['positions']]
+        sizes = layer.get('sizes', 100)
+        sizes = sizes if isinstance(sizes, list) else [sizes]
+        scaled['sizes'] = [
+            _scale_point(size if isinstance(size, (list, tuple)) else [size, size], sx, sy)
+            for size in sizes
+        ] or [_scale_point([100, 100], sx, sy)]
+        if isinstance(layer.get('blurs'), list):
+            scaled['blurs'] = [_scale_px(blur, s) for blur in layer['blurs']]
+
+    return scaled
+
+
+_DRAWERS = {
+    RadialGradient: draw_radial_gradient,
+    LinearGradient: draw_linear_gradient,
+    MeshGradient: draw_mesh_gradient,
+    ShapeBlurGradient: draw_shape_blur_gradient,
+    ColorOverlay: draw_color_overlay,
+    Ellipse: draw_ellipse,
+    Polygon: draw_polygon,
+    ShapeInstances: draw_shape_instances,
+    SprayNoise: draw_spray_noise,
+    ImageLayer: draw_image_layer,
+    TextLayer: draw_text_layer,
+}
+
+
+def fit_content_size(canvas_width: int, canvas_height: int, width: int, height: int) -> Tuple[int, int]:
+    """
+    Size a canvas_width x canvas_height canvas is drawn at in a width x height
+    box: its own size, scaled down with its aspect ratio kept when it does
+    not fit. Never larger, so layers are not upscaled.
+    """
+    if canvas_width <= 0 or canvas_height <= 0:
+        return max(1, width), max(1, height)
+    scale = min(width / canvas_width, height / canvas_height)
+    if scale >= 1:
+        return canvas_width, canvas_height
+    return (max(1, min(width, round(canvas_width * scale))),
+            max(1, min(height, round(canvas_height * scale))))
+
+
+def draw_layer(base, layer, width, height, origin=(0, 0)):
+    """
+    Draw a compiled layer on a width x height canvas; layer dicts are
+    compiled for (width, height) first. base may cover only part of the
+    canvas, starting at canvas pixel origin.
+    """
+    if not isinstance(layer, CompiledLayer):
+        layer = compile_layer(layer, width, height)
+        if layer is None:
+            return
+    _DRAWERS[type(layer)](base, layer, width, height, origin)
 
 
 def parse_size_value(value: Union[str, int], available_space: int) -> int:
@@ -58,6 +191,7 @@ def parse_size_value(value: Union[str, int], available_space: int) -> int:
 
 class BoxConstraints:
     """Box constraints for layout"""
+    __slots__ = ('min_width', 'max_width', 'min_height', 'max_height')
     
     def __init__(self, min_width: int = 0, max_width: int = float('inf'), 
                  min_height: int = 0, max_height: int = float('inf')):
@@ -106,32 +240,130 @@ class BoxConstraints:
         return self.max_height < 999999
 
 
+# Clip rectangles are (left, top, right, bottom) in a widget's own pixels
+Rect = Tuple[int, int, int, int]
+
+
+def _child_clip(clip: Rect, child_x: int, child_y: int, child_width: int, child_height: int) -> Optional[Rect]:
+    """Part of a child placed at (child_x, child_y) that lies in clip, in the child's pixels"""
+    left = max(0, clip[0] - child_x)
+    top = max(0, clip[1] - child_y)
+    right = min(child_width, clip[2] - child_x)
+    bottom = min(child_height, clip[3] - child_y)
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
+
+
+class Layout:
+    """
+    Result of laying out one widget: its size and the layouts of its
+    children, in child order. Layouts live outside the widget tree, so one
+    tree can be laid out at any number of sizes at the same time.
+    """
+    __slots__ = ('size', 'children')
+    
+    def __init__(self, size: Tuple[int, int], children: Tuple['Layout', ...] = ()):
+        self.size = size
+        self.children = children
+
+
+def _run(task):
+    """
+    Drive a layout/paint generator without Python recursion. A generator
+    yields a sub-generator to run a child step and is sent its result back,
+    so tree depth is bounded by memory rather than the recursion limit.
+    """
+    stack = [task]
+    result = None
+    while stack:
+        try:
+            step = stack[-1].send(result)
+        except StopIteration as done:
+            stack.pop()
+            result = done.value
+            continue
+        stack.append(step)
+        result = None
+    return result
+
+
+class _RenderContext:
+    """Per-render state; layouts are memoized per (widget, constraints)"""
+    __slots__ = ('layouts',)
+    
+    def __init__(self):
+        self.layouts: Dict[Tuple, Layout] = {}
+    
+    def layout(self, widget: 'Widget', constraints: BoxConstraints):
+        key = (id(widget), constraints.min_width, constraints.max_width,
+               constraints.min_height, constraints.max_height)
+        result = self.layouts.get(key)
+        if result is None:
+            result = yield widget._layout(constraints, self)
+            self.layouts[key] = result
+        return result
+    
+    def paint(self, widget: 'Widget', layout: Layout, clip: Rect):
+        return widget._paint(layout, clip, self)
+
+
 class Widget(ABC):
-    """Base widget class"""
+    """Base widget class; widgets are immutable once constructed"""
+    __slots__ = ('padding', 'bg_color', 'width', 'height', 'flex', 'x', 'y', 'overflow')
     
     def __init__(self, padding: int = 0, bg_color: Tuple[int, int, int, int] = (0, 0, 0, 0),
                  width: Union[int, str, None] = None, height: Union[int, str, None] = None,
                  flex: int = 0, x: Union[int, str, None] = None, y: Union[int, str, None] = None,
                  overflow: str = "visible"):
-        self.computed_size: Optional[Tuple[int, int]] = None
-        self.position: Tuple[int, int] = (0, 0)
-        self.padding = padding
-        self.bg_color = bg_color
-        self.width = width
-        self.height = height
-        self.flex = flex
-        self.x = x
-        self.y = y
-        self.overflow = overflow  # "visible" or "clip"
+        self._init(
+            padding=padding,
+            bg_color=tuple(bg_color) if isinstance(bg_color, list) else bg_color,
+            width=width,
+            height=height,
+            flex=flex,
+            x=x,
+            y=y,
+            overflow=overflow  # "visible" or "clip"
+        )
+    
+    def _init(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+    
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+    
+    def layout(self, constraints: BoxConstraints) -> Layout:
+        """Lay out this widget and its subtree for the given constraints"""
+        return _run(_RenderContext().layout(self, constraints))
     
-    @abstractmethod
     def calculate_size(self, constraints: BoxConstraints) -> Tuple[int, int]:
         """Calculate and return the size of this widget given constraints"""
+        return self.layout(constraints).size
+    
+    def render(self, x: int, y: int, constraints: BoxConstraints,
+               layout: Optional[Layout] = None) -> Image.Image:
+        """Lay out (unless a layout is given) and render this widget to a PIL Image"""
+        context = _RenderContext()
+        if layout is None:
+            layout = _run(context.layout(self, constraints))
+        return _run(context.paint(self, layout, (0, 0) + tuple(layout.size)))
+    
+    @abstractmethod
+    def _layout(self, constraints: BoxConstraints, context: _RenderContext):
+        """Generator returning this widget's Layout; yields child layout steps"""
         pass
     
     @abstractmethod
-    def render(self, x: int, y: int, constraints: BoxConstraints) -> Image.Image:
-        """Render this widget at the given position and return PIL Image"""
+    def _paint(self, layout: Layout, clip: Rect, context: _RenderContext):
+        """
+        Generator returning the clip part of this widget's image; yields child
+        layout/paint steps. Only pixels inside clip are drawn.
+        """
         pass
     
     def _resolve_size(self, constraints: BoxConstraints) -> Tuple[int, int]:
@@ -159,115 +391,234 @@ class Widget(ABC):
             resolved_height = None
         
         return resolved_width, resolved_height
+    
+    def _paint_child(self, image: Image.Image, clip: Rect, child: 'Widget', child_layout: Layout,
+                     child_x: int, child_y: int, context: _RenderContext, visible: Optional[Tuple[int, int]] = None):
+        """Paint the visible part of a child placed at (child_x, child_y) and paste it into image"""
+        child_clip = _child_clip(clip, child_x, child_y, *(visible or child_layout.size))
+        if child_clip is None:
+            return
+        child_image = yield context.paint(child, child_layout, child_clip)
+        position = (child_x + child_clip[0] - clip[0], child_y + child_clip[1] - clip[1])
+        if child_image.mode == 'RGBA':
+            image.paste(child_image, position, child_image)
+        else:
+            image.paste(child_image, position)
+        release(child_image)
+    
+    def _inner_constraints(self, size: Tuple[int, int]) -> BoxConstraints:
+        """Loose constraints for children inside this widget's padding"""
+        return BoxConstraints(0, size[0] - 2 * self.padding, 0, size[1] - 2 * self.padding)
+
+
+# Render plans kept per canvas, keyed by render size
+COMPILED_SIZES_PER_CANVAS = 4
+_compiled_lock = threading.Lock()
+
+# Full canvas contents drawn ahead of the tree render (Canvas.prerender),
+# keyed by Canvas.content_key; least recently used ones go past the budget
+PRERENDERED_BYTES = 128 * 1024 * 1024
+_prerendered: "OrderedDict[str, Image.Image]" = OrderedDict()
+_prerendered_bytes = 0
+_prerendered_lock = threading.Lock()
+
+
+def _store_prerendered(key: str, image: Image.Image):
+    global _prerendered_bytes
+    size = image.width * image.height * 4
+    if size > PRERENDERED_BYTES:
+        return
+    with _prerendered_lock:
+        old = _prerendered.pop(key, None)
+        if old is not None:
+            _prerendered_bytes -= old.width * old.height * 4
+        _prerendered[key] = image
+        _prerendered_bytes += size
+        while _prerendered_bytes > PRERENDERED_BYTES:
+            _, dropped = _prerendered.popitem(last=False)
+            _prerendered_bytes -= dropped.width * dropped.height * 4
+
+
+def _get_prerendered(key: str) -> Optional[Image.Image]:
+    with _prerendered_lock:
+        image = _prerendered.get(key)
+        if image is not None:
+            _prerendered.move_to_end(key)
+        return image
 
 
 class Canvas(Widget):
     """Canvas widget that renders layers"""
+    __slots__ = ('canvas_width', 'canvas_height', 'background', 'layers', '_compiled')
     
     def __init__(self, canvas_config: Dict, layers: List[Dict], **kwargs):
         super().__init__(**kwargs)
-        self.canvas_width = canvas_config['width']
-        self.canvas_height = canvas_config['height']
-        self.background = canvas_config.get('background', '#000000')
-        self.layers = layers
+        self._init(
+            canvas_width=canvas_config['width'],
+            canvas_height=canvas_config['height'],
+            background=canvas_config.get('background', '#000000'),
+            layers=tuple(layers),
+            _compiled={}
+        )
     
-    def calculate_size(self, constraints: BoxConstraints) -> Tuple[int, int]:
-        # Canvas has fixed content size plus padding
-        total_width = self.canvas_width + 2 * self.padding
-        total_height = self.canvas_height + 2 * self.padding
-        
-        self.computed_size = constraints.constrain(total_width, total_height)
-        return self.computed_size
+    def render_plan(self, width: int, height: int) -> RenderPlan:
+        """Optimized layers for a width x height canvas, reused for the sizes rendered most recently"""
+        with _compiled_lock:
+            plan = self._compiled.get((width, height))
+        if plan is not None:
+            return plan
+        
+        layers = self.layers
+        if (width, height) != (self.canvas_width, self.canvas_height) and self.canvas_width > 0 and self.canvas_height > 0:
+            print(f"Canvas {self.canvas_width}x{self.canvas_height} scaled down to {width}x{height}")
+            # One factor for both axes: content_size keeps the config's aspect ratio
+            scale = min(width / self.canvas_width, height / self.canvas_height)
+            layers = [scale_layer(layer, scale, scale) for layer in self.layers]
+        plan = optimize_layers(compile_layers(layers, width, height), width, height, hex_to_rgba(self.background))
+        if plan.removed:
+            print(f"Render plan: skipped {len(plan.removed)} layer(s): {plan.report()}")
+        
+        with _compiled_lock:
+            if len(self._compiled) >= COMPILED_SIZES_PER_CANVAS:
+                del self._compiled[next(iter(self._compiled))]
+            self._compiled[(width, height)] = plan
+        return plan
     
-    def render(self, x: int, y: int, constraints: BoxConstraints) -> Image.Image:
-
-        """Render canvas with padding and background"""
-        print(f"Canvas render called with computed_size: {self.computed_size}")
+    def content_size(self, width: int, height: int) -> Tuple[int, int]:
+        """Size the content is drawn at in a width x height box (fit_content_size)"""
+        return fit_content_size(self.canvas_width, self.canvas_height, width, height)
     
-        if self.computed_size is None:
-            print(f"ERROR: Canvas computed_size is None!")
-            print(f"Canvas dimensions: {self.width}x{self.height}")
-            print(f"Constraints: {constraints}")
-        total_width, total_height = self.computed_size
-        
-        # Create full image with padding
-        full_image = Image.new("RGBA", (total_width, total_height), self.bg_color)
+    def content_key(self, width: int, height: int) -> str:
+        """Hash of everything the drawn content of a width x height render depends on"""
+        canonical = json.dumps([self.canvas_width, self.canvas_height, self.background, self.layers, width, height],
+                               sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def prerender(self, slot_width: Optional[int] = None, slot_height: Optional[int] = None):
+        """
+        Draw the whole content ahead of time at the size a slot_width x
+        slot_height layout slot gives it (the canvas's own size without a
+        slot). A later tree render that places this canvas in such a slot
+        crops the stored image instead of drawing the layers again.
+        """
+        if not isinstance(self.canvas_width, int) or not isinstance(self.canvas_height, int) or \
+                self.canvas_width <= 0 or self.canvas_height <= 0:
+            return
+        if slot_width is None or slot_height is None:
+            width, height = self.canvas_width, self.canvas_height
+        else:
+            width, height = self.content_size(slot_width - 2 * self.padding, slot_height - 2 * self.padding)
+        plan = self.render_plan(width, height)
+        content = Image.new("RGBA", (width, height), plan.background)
+        with render_pool():
+            for layer in plan.layers:
+                draw_layer(content, layer, width, height)
+        _store_prerendered(self.content_key(width, height), content)
+    
+    def _layout(self, constraints: BoxConstraints, context: _RenderContext):
+        # A width/height on the canvas node is its layout slot, otherwise the
+        # constraints are; content that does not fit is scaled down, not cropped
+        resolved_width, resolved_height = self._resolve_size(constraints)
+        slot_width = resolved_width if isinstance(resolved_width, int) else constraints.max_width
+        slot_height = resolved_height if isinstance(resolved_height, int) else constraints.max_height
+        content_width, content_height = self.content_size(slot_width - 2 * self.padding,
+                                                          slot_height - 2 * self.padding)
         
-        # Create canvas content
-        canvas_content = Image.new("RGBA", (self.canvas_width, self.canvas_height), hex_to_rgba(self.background))
+        return Layout(constraints.constrain(content_width + 2 * self.padding, content_height + 2 * self.padding))
+        yield
+    
+    def _paint(self, layout: Layout, clip: Rect, context: _RenderContext):
+        """Render canvas with padding and background"""
+        print(f"Canvas render called with size: {layout.size}, clip: {clip}")
+        total_width, total_height = layout.size
+        
+        # Create the visible part of the image with padding
+        full_image = acquire("RGBA", (clip[2] - clip[0], clip[3] - clip[1]), self.bg_color)
+        
+        # Canvas content is rendered at its final size, never larger; tight
+        # constraints may leave background around it
+        content_width, content_height = self.content_size(total_width - 2 * self.padding,
+                                                          total_height - 2 * self.padding)
+        visible = _child_clip(clip, self.padding, self.padding, content_width, content_height)
+        if visible is None:
+            return full_image
+        left, top, right, bottom = visible
+        if _prerendered:
+            prerendered = _get_prerendered(self.content_key(content_width, content_height))
+            if prerendered is not None:
+                print("Canvas content reused from prerender")
+                full_image.paste(prerendered.crop(visible), (self.padding + left - clip[0], self.padding + top - clip[1]))
+                return full_image
+        
+        plan = self.render_plan(content_width, content_height)
+        
+        # Create the visible part of the canvas content; layers draw only that region
+        canvas_content = acquire("RGBA", (right - left, bottom - top), plan.background)
         
         # Apply all layers to the canvas content
-        for layer in self.layers:
-            draw_layer(canvas_content, layer, self.canvas_width, self.canvas_height)
+        for layer in plan.layers:
+            draw_layer(canvas_content, layer, content_width, content_height, (left, top))
         
         # Paste canvas content into full image with padding offset
-        full_image.paste(canvas_content, (self.padding, self.padding))
+        full_image.paste(canvas_content, (self.padding + left - clip[0], self.padding + top - clip[1]))
+        release(canvas_content)
         
         return full_image
+        yield
 
 
 class Container(Widget):
     """Container widget with single child"""
+    __slots__ = ('child',)
     
     def __init__(self, child: Widget, **kwargs):
         super().__init__(**kwargs)
-        self.child = child
+        self._init(child=child)
     
-    def calculate_size(self, constraints: BoxConstraints) -> Tuple[int, int]:
+    def _layout(self, constraints: BoxConstraints, context: _RenderContext):
         resolved_width, resolved_height = self._resolve_size(constraints)
         
         if resolved_width is not None and resolved_height is not None:
-            # Both dimensions specified
-            self.computed_size = constraints.constrain(resolved_width, resolved_height)
+            # Both dimensions specified; the child fills the padded area
+            size = constraints.constrain(resolved_width, resolved_height)
+            child_layout = yield context.layout(self.child, self._inner_constraints(size))
         else:
             # Calculate child size with deflated constraints
             child_constraints = constraints.deflate(self.padding)
-            child_width, child_height = self.child.calculate_size(child_constraints)
+            child_layout = yield context.layout(self.child, child_constraints)
+            child_width, child_height = child_layout.size
             
             # Use specified dimensions or child size + padding
             final_width = resolved_width if resolved_width is not None else child_width + 2 * self.padding
             final_height = resolved_height if resolved_height is not None else child_height + 2 * self.padding
             
-            self.computed_size = constraints.constrain(final_width, final_height)
+            size = constraints.constrain(final_width, final_height)
         
-        return self.computed_size
+        return Layout(size, (child_layout,))
     
-    def render(self, x: int, y: int, constraints: BoxConstraints) -> Image.Image:
+    def _paint(self, layout: Layout, clip: Rect, context: _RenderContext):
         """Render container with background and child"""
-        width, height = self.computed_size
-        
         # Create container background
-        container_image = Image.new("RGBA", (width, height), self.bg_color)
-        
-        # Create constraints for child (available space minus padding)
-        child_constraints = BoxConstraints(
-            0, width - 2 * self.padding,
-            0, height - 2 * self.padding
-        )
+        container_image = acquire("RGBA", (clip[2] - clip[0], clip[3] - clip[1]), self.bg_color)
         
         # Render child with padding offset
-        child_image = self.child.render(0, 0, child_constraints)
-        
-        # Paste child into container with padding
-        if child_image.mode == 'RGBA':
-            container_image.paste(child_image, (self.padding, self.padding), child_image)
-        else:
-            container_image.paste(child_image, (self.padding, self.padding))
+        yield self._paint_child(container_image, clip, self.child, layout.children[0],
+                                self.padding, self.padding, context)
         
         return container_image
 
 
 class Row(Widget):
     """Row widget that arranges children horizontally"""
+    __slots__ = ('children',)
     
     def __init__(self, children: List[Widget], **kwargs):
         super().__init__(**kwargs)
-        self.children = children
+        self._init(children=tuple(children))
     
-    def calculate_size(self, constraints: BoxConstraints) -> Tuple[int, int]:
+    def _layout(self, constraints: BoxConstraints, context: _RenderContext):
         if not self.children:
-            self.computed_size = (2 * self.padding, 2 * self.padding)
-            return self.computed_size
+            return Layout((2 * self.padding, 2 * self.padding))
         
         resolved_width, resolved_height = self._resolve_size(constraints)
         
@@ -278,17 +629,14 @@ class Row(Widget):
         # Calculate flex distribution
         total_flex = sum(child.flex for child in self.children if child.flex > 0)
         fixed_width = 0
-        flexible_children = []
+        child_layouts = [None] * len(self.children)
         
         # First pass: calculate fixed-size children
-        for child in self.children:
+        fixed_constraints = BoxConstraints(0, available_width, 0, available_height)
+        for i, child in enumerate(self.children):
             if child.flex == 0:
-                # Fixed size child
-                child_constraints = BoxConstraints(0, available_width, 0, available_height)
-                child_width, child_height = child.calculate_size(child_constraints)
-                fixed_width += child_width
-            else:
-                flexible_children.append(child)
+                child_layouts[i] = yield context.layout(child, fixed_constraints)
+                fixed_width += child_layouts[i].size[0]
         
         # Second pass: distribute remaining space among flexible children
         remaining_width = max(0, available_width - fixed_width)
@@ -297,81 +645,52 @@ class Row(Widget):
         total_width = fixed_width
         max_height = 0
         
-        for child in flexible_children:
-            flex_width = int(flex_unit * child.flex)
-            child_constraints = BoxConstraints(flex_width, flex_width, 0, available_height)
-            child_width, child_height = child.calculate_size(child_constraints)
-            total_width += child_width
-            max_height = max(max_height, child_height)
+        for i, child in enumerate(self.children):
+            if child.flex != 0:
+                flex_width = int(flex_unit * child.flex)
+                child_constraints = BoxConstraints(flex_width, flex_width, 0, available_height)
+                child_layouts[i] = yield context.layout(child, child_constraints)
+                total_width += child_layouts[i].size[0]
+                max_height = max(max_height, child_layouts[i].size[1])
         
         # Calculate max height from all children
-        for child in self.children:
+        for i, child in enumerate(self.children):
             if child.flex == 0:
-                child_constraints = BoxConstraints(0, available_width, 0, available_height)
-                _, child_height = child.calculate_size(child_constraints)
-                max_height = max(max_height, child_height)
+                max_height = max(max_height, child_layouts[i].size[1])
         
         # Use specified dimensions or calculated size + padding
         final_width = resolved_width if resolved_width is not None else total_width + 2 * self.padding
         final_height = resolved_height if resolved_height is not None else max_height + 2 * self.padding
         
-        self.computed_size = constraints.constrain(final_width, final_height)
-        return self.computed_size
+        return Layout(constraints.constrain(final_width, final_height), tuple(child_layouts))
     
-    def render(self, x: int, y: int, constraints: BoxConstraints) -> Image.Image:
+    def _paint(self, layout: Layout, clip: Rect, context: _RenderContext):
         """Render row with background and children positioned horizontally"""
-        width, height = self.computed_size
+        width, height = layout.size
         
         # Create row background
-        row_image = Image.new("RGBA", (width, height), self.bg_color)
+        row_image = acquire("RGBA", (clip[2] - clip[0], clip[3] - clip[1]), self.bg_color)
         
         if not self.children:
             return row_image
         
-        # Available space for children (excluding padding)
-        available_width = width - 2 * self.padding
+        # Fixed-size children are laid out again within the row's final size;
+        # flexible children keep the width the row gave them
         available_height = height - 2 * self.padding
-        
-        # Calculate flex distribution (same logic as calculate_size)
-        total_flex = sum(child.flex for child in self.children if child.flex > 0)
-        fixed_width = 0
-        
-        # First pass: calculate fixed-size children widths
-        child_widths = []
-        for child in self.children:
-            if child.flex == 0:
-                child_constraints = BoxConstraints(0, available_width, 0, available_height)
-                child_width, _ = child.calculate_size(child_constraints)
-                child_widths.append(child_width)
-                fixed_width += child_width
-            else:
-                child_widths.append(None)  # Will be calculated in second pass
-        
-        # Second pass: distribute remaining space
-        remaining_width = max(0, available_width - fixed_width)
-        flex_unit = remaining_width / total_flex if total_flex > 0 else 0
-        
-        for i, child in enumerate(self.children):
-            if child.flex > 0:
-                flex_width = int(flex_unit * child.flex)
-                child_widths[i] = flex_width
+        fixed_constraints = self._inner_constraints(layout.size)
         
         # Position children horizontally within padding area
         current_x = self.padding
-        for i, child in enumerate(self.children):
-            child_width = child_widths[i]
-            child_constraints = BoxConstraints(child_width, child_width, 0, available_height)
-            child_image = child.render(0, 0, child_constraints)
-            child_actual_width, child_height = child_image.size
+        for child, child_layout in zip(self.children, layout.children):
+            if child.flex == 0:
+                child_layout = yield context.layout(child, fixed_constraints)
+            child_actual_width, child_height = child_layout.size
             
             # Vertically center child in available space
             y_offset = self.padding + (available_height - child_height) // 2
             y_offset = max(self.padding, y_offset)
             
-            if child_image.mode == 'RGBA':
-                row_image.paste(child_image, (current_x, y_offset), child_image)
-            else:
-                row_image.paste(child_image, (current_x, y_offset))
+            yield self._paint_child(row_image, clip, child, child_layout, current_x, y_offset, context)
             
             current_x += child_actual_width
         
@@ -380,15 +699,15 @@ class Row(Widget):
 
 class Column(Widget):
     """Column widget that arranges children vertically"""
+    __slots__ = ('children',)
     
     def __init__(self, children: List[Widget], **kwargs):
         super().__init__(**kwargs)
-        self.children = children
+        self._init(children=tuple(children))
     
-    def calculate_size(self, constraints: BoxConstraints) -> Tuple[int, int]:
+    def _layout(self, constraints: BoxConstraints, context: _RenderContext):
         if not self.children:
-            self.computed_size = (2 * self.padding, 2 * self.padding)
-            return self.computed_size
+            return Layout((2 * self.padding, 2 * self.padding))
         
         resolved_width, resolved_height = self._resolve_size(constraints)
         
@@ -399,17 +718,14 @@ class Column(Widget):
         # Calculate flex distribution
         total_flex = sum(child.flex for child in self.children if child.flex > 0)
         fixed_height = 0
-        flexible_children = []
+        child_layouts = [None] * len(self.children)
         
         # First pass: calculate fixed-size children
-        for child in self.children:
+        fixed_constraints = BoxConstraints(0, available_width, 0, available_height)
+        for i, child in enumerate(self.children):
             if child.flex == 0:
-                # Fixed size child
-                child_constraints = BoxConstraints(0, available_width, 0, available_height)
-                child_width, child_height = child.calculate_size(child_constraints)
-                fixed_height += child_height
-            else:
-                flexible_children.append(child)
+                child_layouts[i] = yield context.layout(child, fixed_constraints)
+                fixed_height += child_layouts[i].size[1]
         
         # Second pass: distribute remaining space among flexible children
         remaining_height = max(0, available_height - fixed_height)
@@ -418,81 +734,52 @@ class Column(Widget):
         total_height = fixed_height
         max_width = 0
         
-        for child in flexible_children:
-            flex_height = int(flex_unit * child.flex)
-            child_constraints = BoxConstraints(0, available_width, flex_height, flex_height)
-            child_width, child_height = child.calculate_size(child_constraints)
-            total_height += child_height
-            max_width = max(max_width, child_width)
+        for i, child in enumerate(self.children):
+            if child.flex != 0:
+                flex_height = int(flex_unit * child.flex)
+                child_constraints = BoxConstraints(0, available_width, flex_height, flex_height)
+                child_layouts[i] = yield context.layout(child, child_constraints)
+                total_height += child_layouts[i].size[1]
+                max_width = max(max_width, child_layouts[i].size[0])
         
         # Calculate max width from all children
-        for child in self.children:
+        for i, child in enumerate(self.children):
             if child.flex == 0:
-                child_constraints = BoxConstraints(0, available_width, 0, available_height)
-                child_width, _ = child.calculate_size(child_constraints)
-                max_width = max(max_width, child_width)
+                max_width = max(max_width, child_layouts[i].size[0])
         
         # Use specified dimensions or calculated size + padding
         final_width = resolved_width if resolved_width is not None else max_width + 2 * self.padding
         final_height = resolved_height if resolved_height is not None else total_height + 2 * self.padding
         
-        self.computed_size = constraints.constrain(final_width, final_height)
-        return self.computed_size
+        return Layout(constraints.constrain(final_width, final_height), tuple(child_layouts))
     
-    def render(self, x: int, y: int, constraints: BoxConstraints) -> Image.Image:
+    def _paint(self, layout: Layout, clip: Rect, context: _RenderContext):
         """Render column with background and children positioned vertically"""
-        width, height = self.computed_size
+        width, height = layout.size
         
         # Create column background
-        column_image = Image.new("RGBA", (width, height), self.bg_color)
+        column_image = acquire("RGBA", (clip[2] - clip[0], clip[3] - clip[1]), self.bg_color)
         
         if not self.children:
             return column_image
         
-        # Available space for children (excluding padding)
+        # Fixed-size children are laid out again within the column's final
+        # size; flexible children keep the height the column gave them
         available_width = width - 2 * self.padding
-        available_height = height - 2 * self.padding
-        
-        # Calculate flex distribution (same logic as calculate_size)
-        total_flex = sum(child.flex for child in self.children if child.flex > 0)
-        fixed_height = 0
-        
-        # First pass: calculate fixed-size children heights
-        child_heights = []
-        for child in self.children:
-            if child.flex == 0:
-                child_constraints = BoxConstraints(0, available_width, 0, available_height)
-                _, child_height = child.calculate_size(child_constraints)
-                child_heights.append(child_height)
-                fixed_height += child_height
-            else:
-                child_heights.append(None)  # Will be calculated in second pass
-        
-        # Second pass: distribute remaining space
-        remaining_height = max(0, available_height - fixed_height)
-        flex_unit = remaining_height / total_flex if total_flex > 0 else 0
-        
-        for i, child in enumerate(self.children):
-            if child.flex > 0:
-                flex_height = int(flex_unit * child.flex)
-                child_heights[i] = flex_height
+        fixed_constraints = self._inner_constraints(layout.size)
         
         # Position children vertically within padding area
         current_y = self.padding
-        for i, child in enumerate(self.children):
-            child_height = child_heights[i]
-            child_constraints = BoxConstraints(0, available_width, child_height, child_height)
-            child_image = child.render(0, 0, child_constraints)
-            child_width, child_actual_height = child_image.size
+        for child, child_layout in zip(self.children, layout.children):
+            if child.flex == 0:
+                child_layout = yield context.layout(child, fixed_constraints)
+            child_width, child_actual_height = child_layout.size
             
             # Horizontally center child in available space
             x_offset = self.padding + (available_width - child_width) // 2
             x_offset = max(self.padding, x_offset)
             
-            if child_image.mode == 'RGBA':
-                column_image.paste(child_image, (x_offset, current_y), child_image)
-            else:
-                column_image.paste(child_image, (x_offset, current_y))
+            yield self._paint_child(column_image, clip, child, child_layout, x_offset, current_y, context)
             
             current_y += child_actual_height
         
@@ -501,93 +788,88 @@ class Column(Widget):
 
 class Stack(Widget):
     """Stack widget that overlays children with positioning"""
+    __slots__ = ('children',)
     
     def __init__(self, children: List[Widget], **kwargs):
         super().__init__(**kwargs)
-        self.children = children
+        self._init(children=tuple(children))
     
-    def calculate_size(self, constraints: BoxConstraints) -> Tuple[int, int]:
+    def _child_offset(self, child: Widget, available_width: int, available_height: int) -> Tuple[int, int]:
+        """Position of a child inside the padded area"""
+        child_x = 0
+        child_y = 0
+        
+        if child.x is not None:
+            if isinstance(child.x, str) and child.x.endswith('%'):
+                child_x = parse_size_value(child.x, available_width)
+            else:
+                child_x = child.x
+        
+        if child.y is not None:
+            if isinstance(child.y, str) and child.y.endswith('%'):
+                child_y = parse_size_value(child.y, available_height)
+            else:
+                child_y = child.y
+        
+        return child_x, child_y
+    
+    def _layout(self, constraints: BoxConstraints, context: _RenderContext):
         resolved_width, resolved_height = self._resolve_size(constraints)
         
         if resolved_width is not None and resolved_height is not None:
-            # Both dimensions specified
-            self.computed_size = constraints.constrain(resolved_width, resolved_height)
-        else:
-            # Calculate the maximum bounds needed by all positioned children
-            available_width = constraints.max_width - 2 * self.padding
-            available_height = constraints.max_height - 2 * self.padding
-            
-            max_width = 0
-            max_height = 0
-            
+            # Both dimensions specified; children are laid out in the padded area
+            size = constraints.constrain(resolved_width, resolved_height)
+            child_constraints = self._inner_constraints(size)
+            child_layouts = []
             for child in self.children:
-                child_constraints = BoxConstraints(0, available_width, 0, available_height)
-                child_width, child_height = child.calculate_size(child_constraints)
-                
-                # Calculate child position
-                child_x = 0
-                child_y = 0
-                
-                if child.x is not None:
-                    if isinstance(child.x, str) and child.x.endswith('%'):
-                        child_x = parse_size_value(child.x, available_width)
-                    else:
-                        child_x = child.x
-                
-                if child.y is not None:
-                    if isinstance(child.y, str) and child.y.endswith('%'):
-                        child_y = parse_size_value(child.y, available_height)
-                    else:
-                        child_y = child.y
-                
-                # Calculate the space needed for this child
-                needed_width = child_x + child_width
-                needed_height = child_y + child_height
-                
-                max_width = max(max_width, needed_width)
-                max_height = max(max_height, needed_height)
-            
-            # Use specified dimensions or calculated size + padding
-            final_width = resolved_width if resolved_width is not None else max_width + 2 * self.padding
-            final_height = resolved_height if resolved_height is not None else max_height + 2 * self.padding
+                child_layout = yield context.layout(child, child_constraints)
+                child_layouts.append(child_layout)
+            return Layout(size, tuple(child_layouts))
+        
+        # Calculate the maximum bounds needed by all positioned children
+        available_width = constraints.max_width - 2 * self.padding
+        available_height = constraints.max_height - 2 * self.padding
+        child_constraints = BoxConstraints(0, available_width, 0, available_height)
+        
+        max_width = 0
+        max_height = 0
+        child_layouts = []
+        
+        for child in self.children:
+            child_layout = yield context.layout(child, child_constraints)
+            child_layouts.append(child_layout)
+            child_width, child_height = child_layout.size
+            child_x, child_y = self._child_offset(child, available_width, available_height)
             
-            self.computed_size = constraints.constrain(final_width, final_height)
+            # Calculate the space needed for this child
+            max_width = max(max_width, child_x + child_width)
+            max_height = max(max_height, child_y + child_height)
         
-        return self.computed_size
+        # Use specified dimensions or calculated size + padding
+        final_width = resolved_width if resolved_width is not None else max_width + 2 * self.padding
+        final_height = resolved_height if resolved_height is not None else max_height + 2 * self.padding
+        
+        return Layout(constraints.constrain(final_width, final_height), tuple(child_layouts))
     
-    def render(self, x: int, y: int, constraints: BoxConstraints) -> Image.Image:
+    def _paint(self, layout: Layout, clip: Rect, context: _RenderContext):
         """Render stack with background and positioned children"""
-        width, height = self.computed_size
+        width, height = layout.size
         
         # Create stack background
-        stack_image = Image.new("RGBA", (width, height), self.bg_color)
+        stack_image = acquire("RGBA", (clip[2] - clip[0], clip[3] - clip[1]), self.bg_color)
         
         # Available space for children (excluding padding)
         available_width = width - 2 * self.padding
         available_height = height - 2 * self.padding
         
-        # Render each child with full available constraints
-        child_constraints = BoxConstraints(0, available_width, 0, available_height)
-        
-        for child in self.children:
-            child_image = child.render(0, 0, child_constraints)
-            child_width, child_height = child_image.size
+        for child, child_layout in zip(self.children, layout.children):
+            child_width, child_height = child_layout.size
+            visible_width, visible_height = child_width, child_height
             
             # Calculate child position
-            child_x = self.padding  # Default to padding offset
-            child_y = self.padding
-            
-            if child.x is not None:
-                if isinstance(child.x, str) and child.x.endswith('%'):
-                    child_x = self.padding + parse_size_value(child.x, available_width)
-                else:
-                    child_x = self.padding + child.x
-            
-            if child.y is not None:
-                if isinstance(child.y, str) and child.y.endswith('%'):
-                    child_y = self.padding + parse_size_value(child.y, available_height)
-                else:
-                    child_y = self.padding + child.y
+            offset_x, offset_y = self._child_offset(child, available_width, available_height)
+            child_x = self.padding + offset_x
+            child_y = self.padding + offset_y
             
             # Handle clipping if overflow is set to "clip"
             if self.overflow == "clip":
@@ -595,31 +877,39 @@ class Stack(Widget):
                 child_x = max(self.padding, min(child_x, width - self.padding))
                 child_y = max(self.padding, min(child_y, height - self.padding))
                 
-                # Crop child image if it extends beyond bounds
+                # Space left for the child inside the stack
                 max_child_width = width - child_x
                 max_child_height = height - child_y
                 
+                # Only the part of the child inside the stack bounds is rendered
                 if child_width > max_child_width or child_height > max_child_height:
-                    crop_width = min(child_width, max_child_width)
-                    crop_height = min(child_height, max_child_height)
-                    child_image = child_image.crop((0, 0, crop_width, crop_height))
+                    visible_width = round(min(child_width, max_child_width))
+                    visible_height = round(min(child_height, max_child_height))
             
-            # Paste child into stack
-            if child_image.mode == 'RGBA':
-                stack_image.paste(child_image, (int(child_x), int(child_y)), child_image)
-            else:
-                stack_image.paste(child_image, (int(child_x), int(child_y)))
+            # Paint the visible part of the child into the stack
+            yield self._paint_child(stack_image, clip, child, child_layout, int(child_x), int(child_y),
+                                    context, (visible_width, visible_height))
         
         return stack_image
 
 
+# Parsed trees are immutable, so identical JSON can share one tree
+PARSE_CACHE_SIZE = 64
+
+
 class WidgetTreeParser:
     """Parser to convert JSON to widget tree"""
     
     @staticmethod
     def parse(data: Dict) -> Widget:
         """Parse JSON structure into widget tree"""
-        return WidgetTreeParser._parse_node(data)
+        return _run(WidgetTreeParser._parse_node(data))
+    
+    @staticmethod
+    def parse_cached(data: Dict) -> Widget:
+        """Parse through a cache keyed by the canonical JSON; the tree may be shared"""
+        canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return _parse_canonical(canonical)
     
     @staticmethod
     def _parse_widget_properties(node: Dict) -> Dict:
@@ -644,8 +934,32 @@ class WidgetTreeParser:
         return props
     
     @staticmethod
-    def _parse_node(node: Dict) -> Widget:
-        """Recursively parse a node in the JSON structure"""
+    def _parse_children(layout_type: str, layout_data: Dict):
+        """Parse the children of a row, column or stack"""
+        children = []
+        print(f"Creating {layout_type.capitalize()} with data keys: {list(layout_data.keys())}")
+        
+        # Check if the layout has an explicit children array
+        if 'children' in layout_data:
+            print(f"Found children array in {layout_type}")
+            for i, child_data in enumerate(layout_data['children']):
+                print(f"Parsing {layout_type} child {i}: {list(child_data.keys())}")
+                child_widget = yield WidgetTreeParser._parse_node(child_data)
+                children.append(child_widget)
+        else:
+            # Parse all children of the layout (old format)
+            for key, value in layout_data.items():
+                if key not in ['children', 'padding', 'bg_color', 'width', 'height', 'flex', 'x', 'y', 'overflow']:
+                    print(f"Parsing {layout_type} child: {key}")
+                    child_widget = yield WidgetTreeParser._parse_node({key: value})
+                    children.append(child_widget)
+        
+        print(f"{layout_type.capitalize()} created with {len(children)} children")
+        return children
+    
+    @staticmethod
+    def _parse_node(node: Dict):
+        """Parse a node in the JSON structure; a generator driven by _run"""
         
         print(f"Parsing node: {list(node.keys())}")  # Debug print
         
@@ -667,90 +981,38 @@ class WidgetTreeParser:
             for key, value in props.items():
                 if key not in child_node:
                     child_node[key] = value
-            return WidgetTreeParser._parse_node(child_node)
+            return (yield WidgetTreeParser._parse_node(child_node))
         
         # Handle container
         if 'container' in node:
             container_data = node['container']
             print(f"Creating Container")
-            child = WidgetTreeParser._parse_node(container_data)
+            child = yield WidgetTreeParser._parse_node(container_data)
             return Container(child, **props)
         
         # Handle row
         if 'row' in node:
-            row_data = node['row']
-            children = []
-            print(f"Creating Row with data keys: {list(row_data.keys())}")
-            
-            # Check if row has explicit children array
-            if 'children' in row_data:
-                print("Found children array in row")
-                for i, child_data in enumerate(row_data['children']):
-                    print(f"Parsing row child {i}: {list(child_data.keys())}")
-                    child_widget = WidgetTreeParser._parse_node(child_data)
-                    children.append(child_widget)
-            else:
-                # Parse all children of the row (old format)
-                for key, value in row_data.items():
-                    if key not in ['children', 'padding', 'bg_color', 'width', 'height', 'flex', 'x', 'y', 'overflow']:
-                        print(f"Parsing row child: {key}")
-                        child_widget = WidgetTreeParser._parse_node({key: value})
-                        children.append(child_widget)
-            
-            print(f"Row created with {len(children)} children")
+            children = yield WidgetTreeParser._parse_children('row', node['row'])
             return Row(children, **props)
         
         # Handle column
         if 'column' in node:
-            column_data = node['column']
-            children = []
-            print(f"Creating Column with data keys: {list(column_data.keys())}")
-            
-            # Check if column has explicit children array
-            if 'children' in column_data:
-                print("Found children array in column")
-                for i, child_data in enumerate(column_data['children']):
-                    print(f"Parsing column child {i}: {list(child_data.keys())}")
-                    child_widget = WidgetTreeParser._parse_node(child_data)
-                    children.append(child_widget)
-            else:
-                # Parse all children of the column (old format)
-                for key, value in column_data.items():
-                    if key not in ['children', 'padding', 'bg_color', 'width', 'height', 'flex', 'x', 'y', 'overflow']:
-                        print(f"Parsing column child: {key}")
-                        child_widget = WidgetTreeParser._parse_node({key: value})
-                        children.append(child_widget)
-            
-            print(f"Column created with {len(children)} children")
+            children = yield WidgetTreeParser._parse_children('column', node['column'])
             return Column(children, **props)
         
         # Handle stack
         if 'stack' in node:
-            stack_data = node['stack']
-            children = []
-            print(f"Creating Stack with data keys: {list(stack_data.keys())}")
-            
-            # Check if stack has explicit children array
-            if 'children' in stack_data:
-                print("Found children array in stack")
-                for i, child_data in enumerate(stack_data['children']):
-                    print(f"Parsing stack child {i}: {list(child_data.keys())}")
-                    child_widget = WidgetTreeParser._parse_node(child_data)
-                    children.append(child_widget)
-            else:
-                # Parse all children of the stack (old format)
-                for key, value in stack_data.items():
-                    if key not in ['children', 'padding', 'bg_color', 'width', 'height', 'flex', 'x', 'y', 'overflow']:
-                        print(f"Parsing stack child: {key}")
-                        child_widget = WidgetTreeParser._parse_node({key: value})
-                        children.append(child_widget)
-            
-            print(f"Stack created with {len(children)} children")
+            children = yield WidgetTreeParser._parse_children('stack', node['stack'])
             return Stack(children, **props)
         
         raise ValueError(f"Unknown node structure: {node}")
 
 
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_canonical(canonical: str) -> Widget:
+    return WidgetTreeParser.parse(json.loads(canonical))
+
+
 class WidgetTreeRenderer:
     """Main renderer for widget trees"""
     
@@ -769,11 +1031,10 @@ class WidgetTreeRenderer:
             self.root_height, self.root_height
         )
         
-        # Calculate sizes (bottom-up with constraints)
-        root_widget.calculate_size(root_constraints)
-        
-        # Render the tree (top-down with constraints)
-        final_image = root_widget.render(0, 0, root_constraints)
+        # Lay out (bottom-up with constraints) and render (top-down), reusing scratch buffers
+        with render_pool() as pool:
+            final_image = root_widget.render(0, 0, root_constraints)
+        print(f"Buffer pool: {pool.allocations} allocations, {pool.reuses} reuses")
         
         # Convert to RGB and save
         if final_image.mode == 'RGBA':
@@ -787,4 +1048,3 @@ class WidgetTreeRenderer:
         
         return final_image
 
-
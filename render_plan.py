@@ -0,0 +1,189 @@
+# render_plan.py
+"""
+Render plan optimizer for one canvas.
+
+optimize_layers() runs on a canvas's compiled layers, after compilation and
+before drawing, and only applies rewrites that leave the rendered pixels
+unchanged:
+
+- dead layers: everything drawn before the last opaque layer that covers
+  the whole canvas is hidden by it and dropped
+- invisible layers: zero opacity, or nothing of the layer lands on the canvas
+- solid fills: an opaque unblurred color_overlay followed by another one
+  over the same rectangle is merged into one, and full-canvas fills at the
+  bottom of the stack are folded into the canvas background color
+
+The plan lists every removed layer with the reason, for logging.
+"""
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+from compiled_layers import (
+    CompiledLayer,
+    RadialGradient,
+    LinearGradient,
+    MeshGradient,
+    ShapeBlurGradient,
+    ColorOverlay,
+    SprayNoise,
+    Ellipse,
+    Polygon,
+    ShapeInstances,
+    ImageLayer,
+    TextLayer
+)
+
+RGBA = Tuple[int, int, int, int]
+
+
+class RenderPlan:
+    """Background color and layers to draw for one canvas size"""
+    __slots__ = ('background', 'layers', 'removed')
+
+    def __init__(self, background: RGBA, layers: List[CompiledLayer], removed: List[Tuple[int, str, str]]):
+        self.background = background
+        self.layers = layers
+        # (index in the compiled layers, layer class name, reason)
+        self.removed = removed
+
+    def report(self) -> str:
+        return ", ".join(f"#{index} {name} ({reason})" for index, name, reason in self.removed)
+
+
+def _alpha(opacity: float) -> int:
+    """The 0-255 alpha the gradient drawers derive from an opacity"""
+    return int(opacity * 255)
+
+
+def _over(src: RGBA, dst: RGBA) -> RGBA:
+    """src composited over dst, with PIL's own arithmetic"""
+    base = Image.new("RGBA", (1, 1), tuple(dst))
+    base.alpha_composite(Image.new("RGBA", (1, 1), tuple(src)))
+    return base.getpixel((0, 0))
+
+
+def _off_canvas(box: Tuple[int, int, int, int], width: int, height: int) -> bool:
+    left, top, right, bottom = box
+    return right <= 0 or bottom <= 0 or left >= width or top >= height
+
+
+def _image_box(layer: ImageLayer, width: int, height: int) -> Optional[Tuple[int, int, int, int]]:
+    """Pixel box of an image layer, when it is known without loading the image"""
+    if not layer.target_size or layer.angle:
+        return None
+    img_w, img_h = layer.target_size
+    # Same anchor offsets as draw_image_layer
+    offset_x, offset_y = {
+        'center': ((width - img_w) // 2, (height - img_h) // 2),
+        'top-center': ((width - img_w) // 2, 0),
+        'center-left': (0, (height - img_h) // 2),
+        'center-right': (width - img_w, (height - img_h) // 2),
+        'bottom-left': (0, height - img_h),
+        'bottom-center': ((width - img_w) // 2, height - img_h),
+        'bottom-right': (width - img_w, height - img_h),
+    }.get(layer.anchor, (0, 0))
+    left = int(offset_x + layer.x)
+    top = int(offset_y + layer.y)
+    return left, top, left + img_w, top + img_h
+
+
+def _radial_off_canvas(layer: RadialGradient, width: int, height: int) -> bool:
+    # Distance from the center to the nearest canvas pixel
+    dx = max(0, -layer.center_x, layer.center_x - (width - 1))
+    dy = max(0, -layer.center_y, layer.center_y - (height - 1))
+    return (dx * dx + dy * dy) ** 0.5 > layer.max_radius
+
+
+def invisible_reason(layer: CompiledLayer, width: int, height: int) -> Optional[str]:
+    """Why a layer draws nothing on a width x height canvas, or None if it may"""
+    if isinstance(layer, (ColorOverlay, Ellipse, Polygon)):
+        if layer.fill[3] == 0:
+            return "zero opacity"
+        left, top = layer.position
+        if _off_canvas((left, top, left + layer.size[0], top + layer.size[1]), width, height):
+            return "off canvas"
+    elif isinstance(layer, RadialGradient):
+        if 0 <= layer.opacity * 255 < 1:
+            return "zero opacity"
+        if _radial_off_canvas(layer, width, height):
+            return "off canvas"
+    elif isinstance(layer, (LinearGradient, MeshGradient, ShapeBlurGradient, SprayNoise)):
+        # shape_blur sets its alpha over the whole canvas, so only opacity counts
+        if layer.opacity >= 0 and _alpha(layer.opacity) == 0:
+            return "zero opacity"
+    elif isinstance(layer, (ImageLayer, TextLayer)):
+        if layer.opacity <= 0:
+            return "zero opacity"
+        if isinstance(layer, ImageLayer):
+            box = _image_box(layer, width, height)
+            if box is not None and _off_canvas(box, width, height):
+                return "off canvas"
+    elif isinstance(layer, ShapeInstances):
+        if all(opacity <= 0 for (_, opacity), _ in layer.runs):
+            return "zero opacity"
+    return None
+
+
+def _solid_fill(layer: CompiledLayer) -> bool:
+    """An unblurred color_overlay: a uniform rectangle"""
+    return isinstance(layer, ColorOverlay) and not layer.blur
+
+
+def _covers_canvas(layer: ColorOverlay, width: int, height: int) -> bool:
+    left, top = layer.position
+    return left <= 0 and top <= 0 and left + layer.size[0] >= width and top + layer.size[1] >= height
+
+
+def is_opaque_cover(layer: CompiledLayer, width: int, height: int) -> bool:
+    """True when a layer paints every canvas pixel fully opaque"""
+    if isinstance(layer, (LinearGradient, MeshGradient)):
+        return _alpha(layer.opacity) == 255
+    return _solid_fill(layer) and layer.fill[3] == 255 and _covers_canvas(layer, width, height)
+
+
+def optimize_layers(layers: List[CompiledLayer], width: int, height: int, background: RGBA) -> RenderPlan:
+    """Build the render plan for compiled layers drawn over a background color"""
+    removed = []
+    indexed = list(enumerate(layers))
+
+    # Dead layers: only the last full-canvas opaque layer and what follows can show
+    for position in range(len(indexed) - 1, -1, -1):
+        if is_opaque_cover(indexed[position][1], width, height):
+            for index, layer in indexed[:position]:
+                removed.append((index, type(layer).__name__, f"hidden by #{indexed[position][0]}"))
+            indexed = indexed[position:]
+            break
+
+    # Invisible and off-canvas layers
+    visible = []
+    for index, layer in indexed:
+        reason = invisible_reason(layer, width, height)
+        if reason:
+            removed.append((index, type(layer).__name__, reason))
+        else:
+            visible.append((index, layer))
+
+    # Consecutive fills of one rectangle: the result over an opaque fill is uniform
+    merged = []
+    for index, layer in visible:
+        if merged and _solid_fill(layer):
+            previous_index, previous = merged[-1]
+            if (_solid_fill(previous) and previous.fill[3] == 255
+                    and previous.position == layer.position and previous.size == layer.size):
+                merged[-1] = (previous_index, ColorOverlay(
+                    width, height, fill=_over(layer.fill, previous.fill),
+                    size=layer.size, position=layer.position, blur=0
+                ))
+                removed.append((index, type(layer).__name__, f"merged into #{previous_index}"))
+                continue
+        merged.append((index, layer))
+
+    # Full-canvas fills at the bottom become the background
+    while merged and _solid_fill(merged[0][1]) and _covers_canvas(merged[0][1], width, height):
+        index, layer = merged.pop(0)
+        background = _over(layer.fill, background)
+        removed.append((index, type(layer).__name__, "folded into background"))
+
+    removed.sort()
+    return RenderPlan(background, [layer for _, layer in merged], removed)
@@ -0,0 +1,576 @@
+# schema.py
+"""
+Fast validation and repair of phase JSON before any render or DB write.
+
+Layer validators are generated once at import from the tool declarations in
+Tool_config (field types, required fields, anyOf alternatives) plus the
+layer kinds and fields only described in json_structure.json (spray_noise,
+text "fitted", text shadow). Each field compiles to a small checker that
+accepts exactly what the drawers accept and repairs what it safely can:
+numeric strings become numbers, named/rgb() colors become hex, opacities
+are clamped, JSON lists used as colors become tuples.
+
+Repair policy: an invalid optional field is dropped so the drawer default
+applies; a layer missing a required field, or of a kind no drawer handles,
+is dropped; a canvas without a usable size or a tree node the widget parser
+does not understand is rejected with SchemaError.
+"""
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import ImageColor
+
+from render import _run
+from tool_config import Tool_config
+from utils import hex_to_rgba
+
+_STRUCTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_structure.json")
+
+# Layer kind -> Tool_config declaration, keyed like json_structure.json
+LAYER_TOOLS = {
+    "radial_gradient": Tool_config.radial_gradient_tool,
+    "linear_gradient": Tool_config.linear_gradient_tool,
+    "mesh_gradient": Tool_config.mesh_gradient_tool,
+    "shape_blur_gradient": Tool_config.shape_blur_gradient_tool,
+    "color_overlay": Tool_config.color_overlay_tool,
+    "ellipse_shape": Tool_config.generate_ellipse,
+    "polygon_shape": Tool_config.generate_polygon,
+    "shape_instances": Tool_config.generate_shape_instances,
+    "image": Tool_config.generate_image_layer,
+    "text": Tool_config.generate_text_layer,
+    "spray_noise": None,
+}
+
+# (type, gradient_type / shape) -> layer kind, mirroring render.draw_layer
+LAYER_KINDS = {
+    ("gradient", "radial"): "radial_gradient",
+    ("gradient", "linear"): "linear_gradient",
+    ("gradient", "mesh"): "mesh_gradient",
+    ("gradient", "shape_blur"): "shape_blur_gradient",
+    ("color_overlay", None): "color_overlay",
+    ("shape", "ellipse"): "ellipse_shape",
+    ("shape", "polygon"): "polygon_shape",
+    ("shape_instances", None): "shape_instances",
+    ("spray_noise", None): "spray_noise",
+    ("image", None): "image",
+    ("text", None): "text",
+}
+
+# Fields whose declared type is narrower than what the drawers accept
+_FIELD_OVERRIDES = {
+    # A single size or a [width, height] pair per instance
+    ("shape_instances", "sizes"): {"type": "array", "items": {"type": "size"}},
+}
+
+WIDGET_KEYS = ('children', 'padding', 'bg_color', 'width', 'height', 'flex', 'x', 'y', 'overflow')
+
+
+class SchemaError(ValueError):
+    """Phase JSON that cannot be rendered; errors lists every problem found"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+class _Invalid(Exception):
+    pass
+
+
+# ---------- value checkers ----------
+# A checker returns the (possibly repaired) value or raises _Invalid
+
+def _number(value, integer=False):
+    if isinstance(value, bool):
+        raise _Invalid("expected a number")
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            number = float(value.strip())
+        except ValueError:
+            raise _Invalid("expected a number")
+        return int(number) if integer else number
+    raise _Invalid("expected a number")
+
+
+def _dimension(value):
+    """Pixels (number) or a percentage string, as utils.percent() accepts them"""
+    if isinstance(value, bool):
+        raise _Invalid("expected pixels or a percentage")
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        text = value.strip()
+        if text.endswith('px'):
+            text = text[:-2].strip()
+        if text.endswith('%'):
+            try:
+                float(text[:-1])
+            except ValueError:
+                raise _Invalid("expected pixels or a percentage")
+            return value
+        try:
+            return int(text)
+        except ValueError:
+            try:
+                return int(float(text))
+            except ValueError:
+                raise _Invalid("expected pixels or a percentage")
+    raise _Invalid("expected pixels or a percentage")
+
+
+def _color(value):
+    """Anything utils.hex_to_rgba parses; other CSS colors are converted to hex"""
+    if not isinstance(value, str):
+        raise _Invalid("expected a color string")
+    try:
+        hex_to_rgba(value)
+        return value
+    except (ValueError, IndexError):
+        pass
+    try:
+        rgb = ImageColor.getrgb(value)
+    except ValueError:
+        raise _Invalid(f"unknown color {value!r}")
+    return '#' + ''.join(f"{channel:02x}" for channel in rgb)
+
+
+def _string(value):
+    if not isinstance(value, str):
+        raise _Invalid("expected a string")
+    return value
+
+
+def _boolean(value):
+    if not isinstance(value, bool):
+        raise _Invalid("expected true or false")
+    return value
+
+
+def _size(value):
+    """A single dimension or a [width, height] pair"""
+    if isinstance(value, list):
+        return _pair(_dimension)(value)
+    return _dimension(value)
+
+
+def _pair(item_check):
+    def check(value):
+        if not isinstance(value, (list, tuple)) or len(value) != 2:
+            raise _Invalid("expected an [x, y] pair")
+        first, second = item_check(value[0]), item_check(value[1])
+        if first is value[0] and second is value[1]:
+            return value
+        return [first, second]
+    return check
+
+
+def _array(item_check, non_empty):
+    def check(value):
+        if not isinstance(value, list):
+            raise _Invalid("expected an array")
+        if non_empty and not value:
+            raise _Invalid("expected a non-empty array")
+        items = [item_check(item) for item in value]
+        if all(new is old for new, old in zip(items, value)):
+            return value
+        return items
+    return check
+
+
+def _range(check, minimum, maximum):
+    def clamped(value):
+        value = check(value)
+        if minimum is not None and value < minimum:
+            return minimum
+        if maximum is not None and value > maximum:
+            return maximum
+        return value
+    return clamped
+
+
+def _object(fields, required):
+    def check(value):
+        if not isinstance(value, dict):
+            raise _Invalid("expected an object")
+        # Nested repairs are reported as a repair of the enclosing field
+        repaired, problems = _check_fields(value, fields, required, (), [])
+        if problems:
+            raise _Invalid(problems[0])
+        return repaired
+    return check
+
+
+def _check_fields(obj: Dict, fields: Dict[str, Callable], required, any_of,
+                  warnings: List[str]) -> Tuple[Dict, List[str]]:
+    """
+    Run field checkers over obj (copy-on-write). Invalid optional fields are
+    dropped and repairs are appended to warnings; problems with required
+    fields are returned as errors.
+    """
+    repaired = None
+    errors = []
+    for key, check in fields.items():
+        if key not in obj:
+            continue
+        value = obj[key]
+        try:
+            new_value = check(value)
+        except _Invalid as e:
+            if key in required:
+                errors.append(f"'{key}': {e}")
+                continue
+            if repaired is None:
+                repaired = dict(obj)
+            del repaired[key]
+            warnings.append(f"dropped '{key}' ({e})")
+            continue
+        if new_value is not value:
+            if repaired is None:
+                repaired = dict(obj)
+            repaired[key] = new_value
+            warnings.append(f"repaired '{key}': {value!r} -> {new_value!r}")
+
+    result = obj if repaired is None else repaired
+    missing = [key for key in required if key not in result]
+    if missing:
+        errors.append(f"missing {', '.join(repr(key) for key in missing)}")
+    if any_of and not any(all(key in result for key in option) for option in any_of):
+        errors.append("needs one of " + " or ".join("+".join(option) for option in any_of))
+    return result, errors
+
+
+# ---------- checker generation ----------
+
+def _checker_from_tool(name: str, prop: Dict[str, Any], required: bool) -> Callable:
+    """Compile one Tool_config property declaration into a checker"""
+    kind = prop.get("type")
+    description = prop.get("description", "").lower()
+
+    if kind == "array":
+        items = prop.get("items", {})
+        if items.get("type") == "array":
+            inner = items.get("items", {}).get("type")
+            item_check = _pair(_number if inner in ("number", "integer") else _dimension)
+        elif items.get("type") == "size":
+            item_check = _size
+        elif items.get("type") == "object" and "properties" in items:
+            item_check = _object(
+                {key: _checker_from_tool(key, sub, key in items.get("required", []))
+                 for key, sub in items["properties"].items()},
+                tuple(items.get("required", []))
+            )
+        elif items.get("type") == "object":
+            item_check = _object({}, ())
+        else:
+            item_check = _checker_from_tool(name, items, True)
+        return _array(item_check, non_empty=required)
+    if kind == "string":
+        if "color" in name or name == "background":
+            return _color
+        if "pixels" in description or "percentage" in description:
+            return _dimension
+        return _string
+    if kind in ("number", "integer"):
+        check = (lambda value: _number(value, integer=True)) if kind == "integer" else _number
+        # Angles wrap around in the drawers, so their declared range is not enforced
+        if ("minimum" in prop or "maximum" in prop) and name != "angle":
+            check = _range(check, prop.get("minimum"), prop.get("maximum"))
+        elif name == "opacity" or name.endswith("opacity"):
+            check = _range(check, 0.0, 1.0)
+        return check
+    if kind == "boolean":
+        return _boolean
+    if kind == "object":
+        return _object({}, ())
+    return lambda value: value
+
+
+def _checker_from_description(name: str, description: str) -> Callable:
+    """Compile one json_structure.json field description into a checker"""
+    description = description.lower()
+    if description.startswith("pixel value or percentage"):
+        return _dimension
+    if description.startswith("hex color"):
+        return _color
+    if description.startswith("float"):
+        return _range(_number, 0.0, 1.0) if name.endswith("opacity") else _number
+    if description.startswith("integer"):
+        return lambda value: _number(value, integer=True)
+    if description.startswith("boolean"):
+        return _boolean
+    if description.startswith("array"):
+        return _array(lambda item: item, non_empty="required" in description)
+    if description.startswith("object"):
+        return _object({}, ())
+    if description.startswith("string"):
+        return _string
+    return lambda value: value
+
+
+def _structure_entries() -> Dict[str, Dict[str, str]]:
+    with open(_STRUCTURE_PATH) as f:
+        structure = json.load(f)
+    entries = {}
+    for entry in structure.get("layers", []):
+        entries.update(entry)
+    return entries
+
+
+class _LayerSchema:
+    __slots__ = ('kind', 'fields', 'required', 'any_of')
+
+    def __init__(self, kind, fields, required, any_of):
+        self.kind = kind
+        self.fields = fields
+        self.required = required
+        self.any_of = any_of
+
+
+def _build_layer_schemas() -> Dict[str, _LayerSchema]:
+    entries = _structure_entries()
+    shadow_fields = {key: _checker_from_description(key, text)
+                     for key, text in entries.get("text_shadow", {}).items()}
+
+    schemas = {}
+    for kind, tool in LAYER_TOOLS.items():
+        fields = {}
+        required = set()
+        any_of = ()
+        # json_structure.json first, so the tool declarations take precedence
+        for key, text in entries.get(kind, {}).items():
+            if key in ("type", "gradient_type") or (key == "shape" and kind.endswith("_shape")):
+                continue
+            fields[key] = _checker_from_description(key, text)
+            if "(required" in text:
+                required.add(key)
+        if tool is not None:
+            parameters = tool["parameters"]
+            required.update(parameters.get("required", []))
+            any_of = tuple(tuple(option["required"]) for option in parameters.get("anyOf", []))
+            for key, prop in parameters["properties"].items():
+                prop = _FIELD_OVERRIDES.get((kind, key), prop)
+                fields[key] = _checker_from_tool(key, prop, key in required)
+        if kind == "text":
+            fields["shadow"] = _object(shadow_fields, ())
+        schemas[kind] = _LayerSchema(kind, fields, tuple(sorted(required)), any_of)
+    return schemas
+
+
+LAYER_SCHEMAS = _build_layer_schemas()
+
+_CANVAS_FIELDS = {
+    "width": _range(lambda value: _number(value, integer=True), 1, None),
+    "height": _range(lambda value: _number(value, integer=True), 1, None),
+    "background": _color,
+}
+
+
+def _widget_size(value):
+    """Widget width/height: pixels or a percentage, as render.parse_size_value accepts"""
+    value = _dimension(value)
+    return int(value) if isinstance(value, float) else value
+
+
+def _bg_color(value):
+    if isinstance(value, (list, tuple)) and len(value) in (3, 4) and \
+            all(isinstance(c, int) and not isinstance(c, bool) for c in value):
+        return value if isinstance(value, tuple) else tuple(value)
+    raise _Invalid("expected an RGB(A) tuple")
+
+
+_WIDGET_FIELDS = {
+    "width": _widget_size,
+    "height": _widget_size,
+    "x": _widget_size,
+    "y": _widget_size,
+    "padding": lambda value: _number(value, integer=True),
+    "flex": _number,
+    "bg_color": _bg_color,
+    "overflow": _string,
+}
+
+
+# ---------- public API ----------
+
+def layer_kind(layer: Dict) -> Optional[str]:
+    """json_structure.json kind of a layer dict, or None if no drawer handles it"""
+    t = layer.get('type')
+    if t == 'gradient':
+        return LAYER_KINDS.get((t, layer.get('gradient_type')))
+    if t == 'shape':
+        return LAYER_KINDS.get((t, layer.get('shape')))
+    return LAYER_KINDS.get((t, None))
+
+
+def validate_layer(layer: Any, path: str = "layer") -> Tuple[Optional[Dict], List[str]]:
+    """
+    Validate one layer dict. Returns (layer, warnings); layer is a repaired
+    copy when something was fixed, or None when the layer must be dropped.
+    """
+    if not isinstance(layer, dict):
+        return None, [f"{path}: dropped, not an object"]
+    kind = layer_kind(layer)
+    if kind is None:
+        return None, [f"{path}: dropped, no drawer for type {layer.get('type')!r}"]
+
+    schema = LAYER_SCHEMAS[kind]
+    repairs = []
+    repaired, errors = _check_fields(layer, schema.fields, schema.required, schema.any_of, repairs)
+    warnings = [f"{path} ({kind}): {warning}" for warning in repairs]
+    if errors:
+        warnings.append(f"{path} ({kind}): dropped, {'; '.join(errors)}")
+        return None, warnings
+    return repaired, warnings
+
+
+def validate_layers(layers: Any, path: str = "layers") -> Tuple[List[Dict], List[str]]:
+    """Validate a layers list; invalid layers are dropped"""
+    if not isinstance(layers, list):
+        return [], [f"{path}: replaced with [], not an array"]
+    result = []
+    warnings = []
+    changed = False
+    for i, layer in enumerate(layers):
+        repaired, layer_warnings = validate_layer(layer, f"{path}[{i}]")
+        warnings.extend(layer_warnings)
+        if repaired is not None:
+            result.append(repaired)
+        changed = changed or repaired is not layer
+    return (result if changed else layers), warnings
+
+
+def validate_canvas_config(canvas: Any, path: str = "canvas") -> Tuple[Dict, List[str]]:
+    """Validate a canvas config; raises SchemaError when it has no usable size"""
+    if not isinstance(canvas, dict):
+        raise SchemaError([f"{path}: expected an object"])
+    repairs = []
+    repaired, errors = _check_fields(canvas, _CANVAS_FIELDS, ("width", "height"), (), repairs)
+    if errors:
+        raise SchemaError([f"{path}: {error}" for error in errors])
+    return repaired, [f"{path}: {warning}" for warning in repairs]
+
+
+def validate_phase_json(data: Any) -> Tuple[Any, List[str]]:
+    """
+    Validate the canvas configs and layers anywhere in a phase JSON, before
+    or after translation. Returns (repaired JSON, warnings); the input is
+    not modified.
+    """
+    warnings = []
+
+    def visit(node, path):
+        if isinstance(node, list):
+            items = [visit(item, f"{path}[{i}]") for i, item in enumerate(node)]
+            return node if all(new is old for new, old in zip(items, node)) else items
+        if not isinstance(node, dict):
+            return node
+
+        repaired = None
+        for key, value in node.items():
+            child_path = f"{path}.{key}" if path else key
+            if key == "canvas" and isinstance(value, dict):
+                new_value, canvas_warnings = validate_canvas_config(value, child_path)
+                warnings.extend(canvas_warnings)
+            elif key == "layers":
+                new_value, layer_warnings = validate_layers(value, child_path)
+                warnings.extend(layer_warnings)
+            else:
+                new_value = visit(value, child_path)
+            if new_value is not value:
+                if repaired is None:
+                    repaired = dict(node)
+                repaired[key] = new_value
+        return node if repaired is None else repaired
+
+    return visit(data, ""), warnings
+
+
+def validate_tree(tree: Any) -> Tuple[Dict, List[str]]:
+    """
+    Validate a translated widget tree against the node shapes
+    render.WidgetTreeParser understands, plus every canvas and layer in it.
+    Returns (repaired tree, warnings); raises SchemaError listing every node
+    that cannot be rendered. Traversal is iterative, so depth is not bounded
+    by the recursion limit.
+    """
+    warnings = []
+    errors = []
+
+    def widget_props(node, path):
+        repairs = []
+        props = {key: check for key, check in _WIDGET_FIELDS.items() if key in node}
+        repaired, _ = _check_fields(node, props, (), (), repairs)
+        warnings.extend(f"{path or 'root'}: {warning}" for warning in repairs)
+        return repaired
+
+    def visit(node, path):
+        # A generator driven by render._run: yields visit() of a child and is sent the result
+        if not isinstance(node, dict):
+            errors.append(f"{path}: expected an object")
+            return node
+        node = widget_props(node, path)
+
+        if 'canvas' in node:
+            try:
+                canvas, canvas_warnings = validate_canvas_config(node['canvas'], f"{path}.canvas")
+            except SchemaError as e:
+                errors.extend(e.errors)
+                return node
+            layers, layer_warnings = validate_layers(node.get('layers', []), f"{path}.layers")
+            warnings.extend(canvas_warnings + layer_warnings)
+            if canvas is node['canvas'] and layers is node.get('layers', layers):
+                return node
+            return dict(node, canvas=canvas, layers=layers)
+
+        for key in ('child', 'container'):
+            if key in node:
+                child = yield visit(node[key], f"{path}.{key}")
+                return node if child is node[key] else dict(node, **{key: child})
+
+        for key in ('row', 'column', 'stack'):
+            if key not in node:
+                continue
+            data = node[key]
+            if not isinstance(data, dict):
+                errors.append(f"{path}.{key}: expected an object")
+                return node
+            if 'children' in data:
+                children = data['children']
+                if not isinstance(children, list):
+                    errors.append(f"{path}.{key}.children: expected an array")
+                    return node
+                kept = [child for child in children if isinstance(child, dict)]
+                if len(kept) != len(children):
+                    warnings.append(f"{path}.{key}.children: dropped {len(children) - len(kept)} non-object children")
+                new_children = []
+                for i, child in enumerate(kept):
+                    new_children.append((yield visit(child, f"{path}.{key}.children[{i}]")))
+                if len(kept) == len(children) and all(new is old for new, old in zip(new_children, children)):
+                    return node
+                return dict(node, **{key: dict(data, children=new_children)})
+            # Old format: every non-widget key is a child node; repaired children keep their place
+            items = []
+            changed = False
+            for child_key, value in data.items():
+                if child_key in WIDGET_KEYS:
+                    items.append((child_key, value))
+                    continue
+                wrapper = {child_key: value}
+                child = yield visit(wrapper, f"{path}.{key}.{child_key}")
+                if child is wrapper:
+                    items.append((child_key, value))
+                else:
+                    items.extend(child.items())
+                    changed = True
+            return dict(node, **{key: dict(items)}) if changed else node
+
+        errors.append(f"{path or 'root'}: unknown node structure with keys {sorted(node.keys())}")
+        return node
+
+    result = _run(visit(tree, ""))
+    if errors:
+        raise SchemaError(errors)
+    return result, warnings
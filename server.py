@@ -1,20 +1,26 @@
 from fastapi import FastAPI, BackgroundTasks, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
+import os
 import json
 import base64
 import io
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict
 import traceback
-from datetime import datetime
+from datetime import datetime, timezone
 
 # Import your existing modules
 from main import Posteragent
-from translator import translate_canvas_numbering
+from translator import translate_phase_cached
 from render import WidgetTreeRenderer
+from buffer_pool import render_pool
 from database import DatabaseManager, ProjectStatus, PhaseType
 from server_render import RenderDatabase
-from server_pydantic import  GenerateRequest,ResultResponse,StatusResponse,GenerateResponse
+from server_pydantic import  GenerateRequest,ResultResponse,StatusResponse,GenerateResponse,ResumeRequest
+from llm_scheduler import create_scheduler
+from llm_cache import create_cache
 
 # ==================== FastAPI App Setup ====================
 
@@ -39,8 +45,88 @@ render_db = RenderDatabase()
 
 # ==================== Background Task ====================
 
-async def process_poster_generation(job_id: str, prompt: str, width: int, height: int):
-    """Background task to generate poster with all 4 phase images"""
+PHASES_TO_RENDER = ['layout', 'canvas', 'background', 'assets']
+# Threads rendering saved phases while the agent generates the next one
+PHASE_RENDER_WORKERS = int(os.getenv("PHASE_RENDER_WORKERS", "2"))
+phase_render_executor = ThreadPoolExecutor(max_workers=PHASE_RENDER_WORKERS, thread_name_prefix="phase-render")
+# An ACTIVE job untouched for this long has lost its worker and may be resumed
+RESUME_STALE_SECONDS = float(os.getenv("RESUME_STALE_SECONDS", "900"))
+# Jobs being generated by this process
+running_jobs = set()
+
+
+def job_is_stale(project: dict) -> bool:
+    """Whether an ACTIVE job has gone without a status update for RESUME_STALE_SECONDS"""
+    if project['id'] in running_jobs:
+        return False
+    # SQLite CURRENT_TIMESTAMP is UTC
+    updated_at = datetime.fromisoformat(str(project['updated_at']))
+    age = datetime.now(timezone.utc).replace(tzinfo=None) - updated_at
+    return age.total_seconds() > RESUME_STALE_SECONDS
+
+
+def render_phase_image(job_id: str, phase: str, phase_json: dict, width: int, height: int) -> int:
+    """Translate, render and store one phase image; returns the PNG size in bytes"""
+    print(f"[{job_id}] Rendering {phase} phase...")
+    
+    # Translate and validate the JSON for this specific phase (cached per phase JSON)
+    translated_json = translate_phase_cached(db, job_id, phase, phase_json)
+    
+    print(f"[{job_id}] Translated {phase} JSON structure:")
+    print(json.dumps(translated_json, indent=2)[:500] + "...")
+    
+    # Render the image
+    renderer = WidgetTreeRenderer(width, height)
+    
+    from render import WidgetTreeParser, BoxConstraints
+    # Parsed trees are immutable and shared between renders of the same JSON
+    root_widget = WidgetTreeParser.parse_cached(translated_json)
+    root_constraints = BoxConstraints(width, width, height, height)
+    with render_pool():
+        phase_image = root_widget.render(0, 0, root_constraints)
+    
+    # Convert RGBA to RGB if needed
+    if phase_image.mode == 'RGBA':
+        from PIL import Image
+        background = Image.new('RGB', phase_image.size, (255, 255, 255))
+        background.paste(phase_image, mask=phase_image.split()[3])
+        phase_image = background
+    
+    # Convert PIL Image to bytes
+    img_byte_arr = io.BytesIO()
+    phase_image.save(img_byte_arr, format='PNG', quality=95)
+    img_bytes = img_byte_arr.getvalue()
+    
+    # Save to database with phase
+    render_db.save_image(
+        job_id=job_id,
+        image_bytes=img_bytes,
+        width=phase_image.width,
+        height=phase_image.height,
+        phase=phase,
+        image_format='png'
+    )
+    
+    print(f"[{job_id}] ✅ {phase} image saved ({len(img_bytes)} bytes)")
+    return len(img_bytes)
+
+
+async def process_poster_generation(job_id: str, prompt: str, width: int, height: int, resume: bool = False):
+    """
+    Background task to generate poster with all 4 phase images.
+    With resume, completed phases are kept and only regenerated phases are re-rendered.
+    """
+    running_jobs.add(job_id)
+    loop = asyncio.get_running_loop()
+    # Phase renders in flight, by phase
+    renders = {}
+    
+    def render_when_saved(phase: PhaseType, phase_json: dict):
+        # Rendered on the worker pool while the next phase's LLM call is in flight
+        renders[phase.value] = loop.run_in_executor(
+            phase_render_executor, render_phase_image, job_id, phase.value, phase_json, width, height
+        )
+    
     try:
         print(f"\n{'='*60}")
         print(f"Starting poster generation for job: {job_id}")
@@ -48,12 +134,23 @@ async def process_poster_generation(job_id: str, prompt: str, width: int, height
         print(f"{'='*60}\n")
         
         # Step 1: Run the agent through all phases
-        print(f"[{job_id}] Phase 1/5: Initializing PosterAgent...")
-        agent = Posteragent()
+        print(f"[{job_id}] Phase 1/3: Initializing PosterAgent...")
+        # Canvases are drawn as their layers arrive, and each phase is rendered as soon as it is saved
+        agent = Posteragent(prerender=True, on_phase_saved=render_when_saved)
         agent.current_project_id = job_id
         
-        print(f"[{job_id}] Phase 2/5: Running multi-phase generation...")
-        result_json_str = await agent.create_poster(prompt, project_id=job_id)
+        print(f"[{job_id}] Phase 2/3: Running multi-phase generation and rendering...")
+        try:
+            result_json_str = await agent.create_poster(prompt, project_id=job_id, resume=resume)
+            if resume:
+                # Kept phases keep their images unless never rendered or rendered at another size
+                rendered_sizes = render_db.get_rendered_sizes(job_id)
+                for phase, phase_data in db.get_all_phase_results(job_id).items():
+                    if phase not in renders and rendered_sizes.get(phase) != (width, height):
+                        render_when_saved(PhaseType(phase), phase_data['json_data'])
+        finally:
+            # Renders already started finish before the job's status is decided
+            outcomes = dict(zip(renders, await asyncio.gather(*renders.values(), return_exceptions=True)))
         
         # Check if there was an error
         if "Error" in result_json_str or "Failed" in result_json_str:
@@ -61,85 +158,39 @@ async def process_poster_generation(job_id: str, prompt: str, width: int, height
             db.update_project_status(job_id, ProjectStatus.FAILED)
             return
         
-        # Parse the final JSON result
-        print(f"[{job_id}] Phase 3/5: Parsing final JSON...")
-        final_json = json.loads(result_json_str)
-        
-        # Step 2: Retrieve all phase JSONs from database
-        print(f"[{job_id}] Phase 4/5: Retrieving all phase JSONs from database...")
-        all_phase_results = db.get_all_phase_results(job_id)
-        
-        if not all_phase_results:
+        kept_images = render_db.get_rendered_phases(job_id) if resume else {}
+        if not outcomes and not any(kept_images.values()):
             print(f"[{job_id}] ❌ No phase results found in database")
             db.update_project_status(job_id, ProjectStatus.FAILED)
             return
         
-        # Step 3: Render all 4 phases
-        print(f"[{job_id}] Phase 5/5: Rendering all 4 phase images...")
-        
-        phases_to_render = ['layout', 'canvas', 'background', 'assets']
+        # Step 2: Collect the phase renders
+        print(f"[{job_id}] Phase 3/3: Collecting all 4 phase images...")
         rendered_count = 0
         
-        for phase in phases_to_render:
-            try:
-                print(f"[{job_id}] Rendering {phase} phase...")
-                
-                # Get the JSON for this phase
-                phase_data = all_phase_results.get(phase)
-                if not phase_data:
+        for phase in PHASES_TO_RENDER:
+            if phase not in outcomes:
+                if kept_images.get(phase):
+                    print(f"[{job_id}] {phase} phase unchanged, keeping its image")
+                    rendered_count += 1
+                else:
                     print(f"[{job_id}] ⚠️  No data for {phase} phase, skipping...")
-                    continue
-                
-                phase_json = phase_data['json_data']
-                
-                # Translate the JSON for this specific phase
-                translated_json = translate_canvas_numbering(phase_json, phase=phase)
-                
-                print(f"[{job_id}] Translated {phase} JSON structure:")
-                print(json.dumps(translated_json, indent=2)[:500] + "...")
-                
-                # Render the image
-                renderer = WidgetTreeRenderer(width, height)
-                
-                from render import WidgetTreeParser, BoxConstraints
-                root_widget = WidgetTreeParser.parse(translated_json)
-                root_constraints = BoxConstraints(width, width, height, height)
-                root_widget.calculate_size(root_constraints)
-                phase_image = root_widget.render(0, 0, root_constraints)
-                
-                # Convert RGBA to RGB if needed
-                if phase_image.mode == 'RGBA':
-                    from PIL import Image
-                    background = Image.new('RGB', phase_image.size, (255, 255, 255))
-                    background.paste(phase_image, mask=phase_image.split()[3])
-                    phase_image = background
-                
-                # Convert PIL Image to bytes
-                img_byte_arr = io.BytesIO()
-                phase_image.save(img_byte_arr, format='PNG', quality=95)
-                img_bytes = img_byte_arr.getvalue()
-                
-                # Save to database with phase
-                render_db.save_image(
-                    job_id=job_id,
-                    image_bytes=img_bytes,
-                    width=phase_image.width,
-                    height=phase_image.height,
-                    phase=phase,
-                    image_format='png'
-                )
-                
-                rendered_count += 1
-                print(f"[{job_id}] ✅ {phase} image saved ({len(img_bytes)} bytes)")
-                
-            except Exception as phase_error:
-                print(f"[{job_id}] ❌ Error rendering {phase}: {str(phase_error)}")
-                print(f"Traceback:\n{traceback.format_exc()}")
+                continue
+            
+            outcome = outcomes[phase]
+            if isinstance(outcome, BaseException):
+                print(f"[{job_id}] ❌ Error rendering {phase}: {str(outcome)}")
+                print(f"Traceback:\n{''.join(traceback.format_exception(outcome))}")
                 # Continue with other phases even if one fails
                 continue
+            
+            rendered_count += 1
         
-        # Update project status
-        if rendered_count == 4:
+        # Update project status; a phase with failed canvases keeps the job partial so it can be resumed
+        partial_phases = db.get_project_progress(job_id)['partial_phases']
+        if partial_phases:
+            print(f"[{job_id}] ⚠️  Phases with failed canvases: {', '.join(partial_phases)}")
+        if rendered_count == 4 and not partial_phases:
             db.update_project_status(job_id, ProjectStatus.COMPLETED)
             print(f"\n{'='*60}")
             print(f"✅ All 4 phases rendered successfully for job: {job_id}")
@@ -163,6 +214,8 @@ async def process_poster_generation(job_id: str, prompt: str, width: int, height
         print(f"{'='*60}\n")
         
         db.update_project_status(job_id, ProjectStatus.FAILED)
+    finally:
+        running_jobs.discard(job_id)
 
 
 # ==================== API Endpoints ====================
@@ -206,6 +259,54 @@ async def generate_poster(request: GenerateRequest, background_tasks: Background
         raise HTTPException(status_code=500, detail=f"Failed to start generation: {str(e)}")
 
 
+@app.post("/api/resume/{job_id}", response_model=GenerateResponse)
+async def resume_poster(job_id: str, background_tasks: BackgroundTasks, request: Optional[ResumeRequest] = None):
+    """
+    Resume a failed or partial job from its first missing phase
+    
+    Completed phases are not regenerated. Regenerated phases are re-rendered, and so are kept
+    phases when the requested size differs from the one they were rendered at.
+    An ACTIVE job is resumed only once it is stale, or with force when its worker is known to be gone.
+    """
+    try:
+        project = db.get_project(job_id)
+        if not project:
+            raise HTTPException(status_code=404, detail="Job not found")
+        
+        request = request or ResumeRequest()
+        if project['status'] == ProjectStatus.ACTIVE:
+            if job_id in running_jobs:
+                raise HTTPException(status_code=409, detail="Job is still being generated")
+            if not (request.force or job_is_stale(project)):
+                raise HTTPException(status_code=409,
+                                    detail="Job is still being generated; resume with force if its worker is gone")
+        
+        # Without a size, the job keeps the size its phases were rendered at
+        kept_width, kept_height = next(iter(render_db.get_rendered_sizes(job_id).values()), (1920, 1080))
+        # Active again right away, so a second resume or a status poll sees the job running
+        db.update_project_status(job_id, ProjectStatus.ACTIVE)
+        running_jobs.add(job_id)
+        background_tasks.add_task(
+            process_poster_generation,
+            job_id=job_id,
+            prompt=project['user_prompt'],
+            width=request.width or kept_width,
+            height=request.height or kept_height,
+            resume=True
+        )
+        
+        return GenerateResponse(
+            job_id=job_id,
+            status="processing",
+            message="Poster generation resumed from the first missing phase. Use /api/status/{job_id} to check progress."
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to resume generation: {str(e)}")
+
+
 @app.get("/api/status/{job_id}", response_model=StatusResponse)
 async def get_status(job_id: str):
     """Get the current status of a poster generation job"""
@@ -442,6 +543,20 @@ async def get_phase_results(job_id: str):
         raise HTTPException(status_code=500, detail=f"Error retrieving phases: {str(e)}")
 
 
+@app.get("/api/llm/stats")
+async def get_llm_stats():
+    """
+    LLM scheduler and response cache metrics
+    
+    Queue depth, in-flight requests and admission wait times, for capacity sizing
+    """
+    cache = create_cache()
+    return {
+        "scheduler": create_scheduler().stats(),
+        "cache": cache.stats() if cache else None
+    }
+
+
 # ==================== Run Server ====================
 
 if __name__ == "__main__":
@@ -5,6 +5,11 @@ class GenerateRequest(BaseModel):
     width: Optional[int] = 1920
     height: Optional[int] = 1080
 
+class ResumeRequest(BaseModel):
+    width: Optional[int] = None  # default: the size the kept phases were rendered at
+    height: Optional[int] = None
+    force: bool = False  # resume an ACTIVE job whose worker is gone
+
 class GenerateResponse(BaseModel):
     job_id: str
     status: str
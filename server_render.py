@@ -1,7 +1,7 @@
 # server_render.py
 import sqlite3
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 
 class RenderDatabase:
     def __init__(self, db_path: str = "rendered_images.db"):
@@ -118,6 +118,15 @@ class RenderDatabase:
                 'assets': 'assets' in rendered_phases
             }
     
+    def get_rendered_sizes(self, job_id: str) -> Dict[str, Tuple[int, int]]:
+        """Get the (width, height) each rendered phase was drawn at"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.execute("""
+                SELECT phase, width, height FROM rendered_images WHERE job_id = ?
+            """, (job_id,))
+            
+            return {phase: (width, height) for phase, width, height in cursor.fetchall()}
+    
     def delete_image(self, job_id: str, phase: Optional[str] = None):
         """Delete rendered image(s) for a job"""
         with sqlite3.connect(self.db_path) as conn:
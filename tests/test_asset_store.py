@@ -0,0 +1,47 @@
+# test_asset_store.py
+"""The asset store can be re-ingested while images from it are mapped."""
+import os
+
+from PIL import Image
+
+import asset_store
+
+
+def write_source(path, color, size=(128, 96)):
+    Image.new("RGBA", size, color).save(path)
+    # Re-ingestion is driven by the source's mtime
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_reingest_replaces_mapped_files(tmp_path):
+    src_dir, store = tmp_path / "images", str(tmp_path / "store")
+    src_dir.mkdir()
+    src = str(src_dir / "tile.png")
+
+    write_source(src, (255, 0, 0, 255))
+    asset_store.ingest_directory(str(src_dir), store)
+    first = asset_store.open_asset(src, store_dir=store)
+    assert first.getpixel((0, 0)) == (255, 0, 0, 255)
+
+    write_source(src, (0, 0, 255, 255), size=(160, 96))
+    asset_store.ingest_directory(str(src_dir), store)
+    second = asset_store.open_asset(src, store_dir=store)
+    assert second.size == (160, 96)
+    assert second.getpixel((0, 0)) == (0, 0, 255, 255)
+    # The image mapped before re-ingestion still reads the old file
+    assert first.getpixel((0, 0)) == (255, 0, 0, 255)
+    assert not any(name.endswith(".tmp") for name in os.listdir(store))
+
+
+def test_truncated_pixel_file_falls_back_to_source(tmp_path):
+    src_dir, store = tmp_path / "images", str(tmp_path / "store")
+    src_dir.mkdir()
+    src = str(src_dir / "tile.png")
+    write_source(src, (0, 255, 0, 255))
+    manifest = asset_store.ingest_directory(str(src_dir), store)
+
+    level = manifest["assets"][asset_store._asset_key(src)]["levels"][0]
+    with open(os.path.join(store, level["file"]), "r+b") as f:
+        f.truncate(100)
+    assert asset_store.open_asset(src, store_dir=store) is None
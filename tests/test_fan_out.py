@@ -0,0 +1,91 @@
+# test_fan_out.py
+"""Fan-out phases merge per-canvas responses in canvas order and record failed canvases."""
+import asyncio
+import json
+
+import pytest
+
+from database import PhaseType
+from llm_backend import LLMBackend, LLMResponse
+from main import Posteragent
+
+CANVASES = 4
+LAYOUT = "container(1600x400)[row[placeholder(), placeholder(), placeholder(), placeholder()]]"
+
+
+def call(name, **args):
+    return {"function_call": {"name": name, "args": args}}
+
+
+class PerCanvasBackend(LLMBackend):
+    """Answers per-canvas calls slowest-first for low canvas indices, so they finish out of order"""
+    name = "test"
+    model = "per-canvas"
+
+    def __init__(self, fail_canvas=None):
+        self.fail_canvas = fail_canvas
+
+    def generate(self, phase, contents, tools):
+        raise NotImplementedError("the agent only uses agenerate")
+
+    async def agenerate(self, phase, contents, tools):
+        phase, _, canvas = phase.partition("/canvas_")
+        if phase == "layout":
+            parts = [call("generate_layout", layout_string=LAYOUT)]
+        elif phase == "canvas":
+            parts = [call("generate_canvas", width=400, height=400, background="#000000")] * CANVASES
+        else:
+            index = int(canvas)
+            await asyncio.sleep(0.01 * (CANVASES - index))
+            if phase == "background" and index == self.fail_canvas:
+                raise RuntimeError("503 overloaded")
+            if phase == "background":
+                parts = [call("generate_color_overlay", color=f"#0000{index:02x}", opacity=0.5)]
+            else:
+                parts = [call("generate_text_layer", text=f"Canvas {index}", size=40)]
+        return LLMResponse.from_dict({"parts": parts})
+
+
+@pytest.fixture
+def agent_factory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def make(**kwargs):
+        return Posteragent(backend=PerCanvasBackend(**kwargs), use_cache=False, fan_out=True)
+    return make
+
+
+def canvas_layers(agent, result):
+    return [structure["layers"] for structure in agent.poster_structures(json.loads(result))]
+
+
+def test_per_canvas_results_merge_in_canvas_order(agent_factory):
+    agent = agent_factory()
+    result = asyncio.run(agent.create_poster("grid"))
+    layers = canvas_layers(agent, result)
+    assert len(layers) == CANVASES
+    for index, canvas in enumerate(layers):
+        assert [layer["type"] for layer in canvas] == ["color_overlay", "text"]
+        assert canvas[0]["color"] == f"#0000{index:02x}"
+        assert canvas[1]["text"] == f"Canvas {index}"
+    phases = agent.db.get_all_phase_results(agent.current_project_id)
+    assert {phase: data["status"] for phase, data in phases.items()} == dict.fromkeys(
+        ("layout", "canvas", "background", "assets"), "completed")
+
+
+def test_failed_canvas_makes_the_phase_partial_and_resume_reruns_it(agent_factory):
+    agent = agent_factory(fail_canvas=1)
+    result = asyncio.run(agent.create_poster("grid"))
+    project_id = agent.current_project_id
+    layers = canvas_layers(agent, result)
+    # The failed canvas keeps its previous (empty) layers; the others are unaffected
+    assert [len(canvas) for canvas in layers] == [2, 1, 2, 2]
+    assert agent.failed_canvases == []  # reset by the assets phase, which succeeded
+    assert agent.db.get_phase_result(project_id, PhaseType.BACKGROUND)["status"] == "partial"
+    assert agent.db.get_project(project_id)["status"] == "partial"
+    assert agent.completed_phases(project_id) == [PhaseType.LAYOUT, PhaseType.CANVAS]
+
+    resumed = agent_factory()
+    result = asyncio.run(resumed.resume_poster(project_id))
+    assert [len(canvas) for canvas in canvas_layers(resumed, result)] == [2, 2, 2, 2]
+    assert resumed.db.get_project(project_id)["status"] == "completed"
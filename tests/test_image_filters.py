@@ -0,0 +1,72 @@
+# test_image_filters.py
+"""apply_image_filters must match the per-filter ImageEnhance chain it replaced."""
+import os
+
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageFilter
+
+from assets import apply_image_filters
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images")
+
+
+def reference_filters(img, filters, opacity=1.0):
+    """The original draw_image_layer filter loop, one PIL pass per step"""
+    for f in filters:
+        t = f.get('type')
+        if t == "gaussian_blur":
+            img = img.filter(ImageFilter.GaussianBlur(f.get('radius', 5)))
+        elif t == "grayscale":
+            gray = img.convert('L')
+            img = Image.merge('LA', (gray, img.getchannel('A')))
+            img = img.convert('RGBA')
+        elif t == "brightness_contrast":
+            img = ImageEnhance.Brightness(img).enhance(f.get('brightness', 1.0))
+            img = ImageEnhance.Contrast(img).enhance(f.get('contrast', 1.0))
+    if opacity < 1.0:
+        alpha = img.getchannel('A')
+        alpha = alpha.point(lambda p: int(p * opacity))
+        img.putalpha(alpha)
+    return img
+
+
+def photo():
+    img = Image.open(os.path.join(IMAGES_DIR, "layer_1.jpg")).convert("RGBA")
+    img.thumbnail((320, 320))
+    return img
+
+
+def saturating_gradient():
+    # Bright gradient with varying alpha: brightness pushes most of it past 255
+    x = np.linspace(120, 255, 256)
+    arr = np.empty((64, 256, 4), dtype=np.uint8)
+    arr[..., 0] = x
+    arr[..., 1] = x[::-1] * 0.5 + 127
+    arr[..., 2] = 200
+    arr[..., 3] = np.linspace(0, 255, 64)[:, None]
+    return Image.fromarray(arr, mode="RGBA")
+
+
+CHAINS = [
+    ([{"type": "brightness_contrast", "brightness": 2.0, "contrast": 0.5}], 1.0),
+    ([{"type": "brightness_contrast", "brightness": 1.3, "contrast": 1.8}], 0.7),
+    ([{"type": "brightness_contrast", "brightness": 0.4, "contrast": 2.5}], 1.0),
+    ([{"type": "grayscale"}], 0.5),
+    ([{"type": "grayscale"}, {"type": "brightness_contrast", "brightness": 1.6, "contrast": 0.6}], 1.0),
+    ([{"type": "brightness_contrast", "brightness": 1.5, "contrast": 1.2}, {"type": "grayscale"},
+      {"type": "brightness_contrast", "brightness": 0.8, "contrast": 1.4}], 0.9),
+    ([{"type": "brightness_contrast", "brightness": 1.2, "contrast": 0.9}, {"type": "gaussian_blur", "radius": 3},
+      {"type": "brightness_contrast", "brightness": 1.1, "contrast": 1.3}], 0.6),
+    ([], 0.35),
+]
+
+
+@pytest.mark.parametrize("make_image", [photo, saturating_gradient])
+@pytest.mark.parametrize("filters,opacity", CHAINS)
+def test_matches_imageenhance_chain(make_image, filters, opacity):
+    img = make_image()
+    expected = np.asarray(reference_filters(img.copy(), filters, opacity), dtype=np.int16)
+    actual = np.asarray(apply_image_filters(img.copy(), filters, opacity), dtype=np.int16)
+    assert actual.shape == expected.shape
+    assert np.abs(actual - expected).max() == 0
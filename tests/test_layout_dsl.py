@@ -0,0 +1,28 @@
+# test_layout_dsl.py
+"""Compiled layout templates carry the slot geometry the translator renders."""
+import contextlib
+import io
+
+from layout_dsl import compile_layout, compute_slot_geometry
+from translator import translate_canvas_numbering
+
+
+def test_cached_slots_match_the_stored_layout():
+    compiled = compile_layout("container(1200x800)[column[placeholder(25%), row(75%)[placeholder(40%), placeholder(60%)]]]")
+    assert compiled["slots"] == compute_slot_geometry(compiled["layout"])
+    assert compiled["slots"] == {
+        "canvas_1": {"x": 0, "y": 0, "width": 1200, "height": 200},
+        "canvas_2": {"x": 0, "y": 200, "width": 480, "height": 600},
+        "canvas_3": {"x": 480, "y": 200, "width": 720, "height": 600},
+    }
+
+
+def test_stack_rule_is_shared_with_the_translator():
+    layout = compile_layout("container(800x600)[stack[placeholder(), placeholder()]]")
+    slots = layout["slots"]
+    # Stacked placeholders are laid out as a column, in every phase
+    assert (slots["canvas_1"]["y"], slots["canvas_2"]["y"]) == (0, 300)
+    for phase in ("layout", "canvas"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            translated = translate_canvas_numbering(layout["layout"], phase=phase)
+        assert "column" in translated["container"] and "stack" not in translated["container"]
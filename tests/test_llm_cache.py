@@ -0,0 +1,101 @@
+# test_llm_cache.py
+"""LLMResponseCache expiry, eviction and shared in-flight calls."""
+import asyncio
+
+import pytest
+
+import llm_cache
+from llm_cache import LLMResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_cache.time, "time", clock)
+    return clock
+
+
+def response(text):
+    return {"parts": [{"text": text}]}
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = LLMResponseCache(str(tmp_path / "cache.db"), ttl=60)
+    cache.put("k", "mock/recorded", "layout", response("a"))
+    clock.now += 59
+    assert cache.get("k") == response("a")
+    clock.now += 2
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_go_past_the_item_cap(tmp_path, clock):
+    cache = LLMResponseCache(str(tmp_path / "cache.db"), max_items=2)
+    for key in ("a", "b"):
+        cache.put(key, "m", "layout", response(key))
+        clock.now += 1
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") is not None
+    clock.now += 1
+    cache.put("c", "m", "layout", response("c"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_least_recently_used_entries_go_past_the_byte_cap(tmp_path, clock):
+    entry_bytes = len('{"parts":[{"text":"xxxxxxxx"}]}')
+    cache = LLMResponseCache(str(tmp_path / "cache.db"), max_bytes=2 * entry_bytes)
+    for key in ("a", "b", "c"):
+        cache.put(key, "m", "layout", response(key * 8))
+        clock.now += 1
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] <= 2 * entry_bytes
+
+
+def test_concurrent_identical_calls_share_one_backend_call(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.db"))
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(cache.shared_call("k", call) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["result"] * 3
+    assert len(calls) == 1
+    assert cache.shared == 2
+
+
+def test_waiter_makes_the_call_when_the_first_caller_is_cancelled(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.db"))
+    started = []
+
+    async def call():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return len(started)
+
+    async def main():
+        first = asyncio.ensure_future(cache.shared_call("k", call))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.shared_call("k", call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == 2
+    assert not cache._inflight
@@ -0,0 +1,87 @@
+# test_llm_scheduler.py
+"""LLMScheduler admission order and slot accounting under cancellation."""
+import asyncio
+
+import pytest
+
+from llm_scheduler import LLMScheduler
+
+
+def test_jobs_are_admitted_round_robin():
+    scheduler = LLMScheduler(max_concurrent=1, rpm=0, tpm=0)
+    order = []
+
+    async def request(job, n):
+        async def call():
+            order.append(f"{job}{n}")
+            await asyncio.sleep(0)
+        await scheduler.run(job, 10, call)
+
+    async def main():
+        # Hold the only slot while both jobs queue, job a first with all its requests
+        await scheduler.acquire("x", 10)
+        tasks = [asyncio.ensure_future(request("a", n)) for n in range(3)]
+        tasks += [asyncio.ensure_future(request("b", n)) for n in range(3)]
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth == 6
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["a0", "b0", "a1", "b1", "a2", "b2"]
+    assert scheduler.in_flight == 0
+
+
+def test_cancel_after_admission_gives_the_slot_back():
+    scheduler = LLMScheduler(max_concurrent=1, rpm=0, tpm=0)
+
+    async def main():
+        await scheduler.acquire("x", 10)
+        waiter = asyncio.ensure_future(scheduler.acquire("a", 10))
+        await asyncio.sleep(0)
+        # Releasing admits the waiter synchronously; it is cancelled before it resumes
+        scheduler.release()
+        assert scheduler.in_flight == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.in_flight == 0
+        await asyncio.wait_for(scheduler.acquire("b", 10), 1)
+        scheduler.release()
+
+    asyncio.run(main())
+    assert scheduler.in_flight == 0
+
+
+def test_cancel_while_queued_removes_the_request():
+    scheduler = LLMScheduler(max_concurrent=1, rpm=0, tpm=0)
+
+    async def main():
+        await scheduler.acquire("x", 10)
+        waiter = asyncio.ensure_future(scheduler.acquire("a", 10))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.queue_depth == 0
+        scheduler.release()
+
+    asyncio.run(main())
+    assert scheduler.in_flight == 0
+    assert scheduler.admitted == 1
+
+
+def test_requests_wait_for_the_token_budget():
+    # 600 tokens per minute refill at 10 per second
+    scheduler = LLMScheduler(max_concurrent=4, rpm=0, tpm=600)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        await scheduler.acquire("a", 600)
+        scheduler.release()
+        start = loop.time()
+        await scheduler.acquire("a", 2)
+        scheduler.release()
+        return loop.time() - start
+
+    assert 0.1 <= asyncio.run(main()) < 1.0
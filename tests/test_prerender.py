@@ -0,0 +1,36 @@
+# test_prerender.py
+"""Canvases prerendered at their slot size are reused by the tree render."""
+import contextlib
+import io
+
+from main import prerender_structure
+from render import BoxConstraints, WidgetTreeParser
+from schema import validate_phase_json, validate_tree
+from translator import translate_canvas_numbering
+
+REUSED = "Canvas content reused from prerender"
+
+
+def poster(background):
+    return {"canvas": {"width": 1080, "height": 1080, "background": background},
+            "layers": [{"type": "color_overlay", "color": "#FF0000", "opacity": 0.5}]}
+
+
+def render_column(first):
+    """Render first in the top half of a 1080x1620 column, as the server renders a phase"""
+    phase_json, _ = validate_phase_json({"container": {"width": 1080, "height": 1620, "column": {"children": [
+        {"canvas_1": first, "height": "50%"}, {"canvas_2": poster("#000000"), "height": "50%"}]}}})
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        tree, _ = validate_tree(translate_canvas_numbering(phase_json, phase="background"))
+        WidgetTreeParser.parse(tree).render(0, 0, BoxConstraints(1080, 1080, 1620, 1620))
+    return out.getvalue()
+
+
+def test_prerender_in_the_slot_is_reused():
+    # The 1080x810 slot shrinks the canvas to 810x810; a config-size prerender is not used
+    prerender_structure("background", poster("#102030"))
+    assert REUSED not in render_column(poster("#102030"))
+
+    prerender_structure("background", poster("#203040"), {"x": 0, "y": 0, "width": 1080, "height": 810})
+    assert REUSED in render_column(poster("#203040"))
@@ -0,0 +1,80 @@
+# test_render_scale.py
+"""Canvases drawn at a slot size other than their config size rescale their layers."""
+import os
+
+import numpy as np
+from PIL import Image
+
+from assets import measure_text
+from compiled_layers import TextLayer
+from main import PosterRenderManager
+from render import BoxConstraints, Canvas, scale_layer
+
+IMAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images", "layer_1.jpg")
+
+
+def blurred_image_layer(radius):
+    return {"type": "image", "src": IMAGE, "x": 0, "y": 0, "width": "100%", "height": "100%",
+            "filters": [{"type": "gaussian_blur", "radius": radius}]}
+
+
+def render_canvas(config_size, layers, size):
+    canvas = Canvas({"width": config_size, "height": config_size, "background": "#000000"}, layers,
+                    width=size, height=size)
+    return canvas.render(0, 0, BoxConstraints(size, size, size, size)).convert("RGB")
+
+
+def test_scale_layer_scales_gaussian_blur_radius():
+    scaled = scale_layer(blurred_image_layer(16), 0.5, 0.25)
+    assert scaled["filters"] == [{"type": "gaussian_blur", "radius": 4}]
+
+
+def test_half_size_render_matches_downsampled_full_render():
+    full = render_canvas(400, [blurred_image_layer(16)], 400).resize((200, 200), Image.BOX)
+    scaled = render_canvas(400, [blurred_image_layer(16)], 200)
+    # The same layer authored for a 200px canvas keeps its 16px radius
+    unscaled = render_canvas(200, [blurred_image_layer(16)], 200)
+
+    def error(img):
+        return np.abs(np.asarray(img, dtype=np.int16) - np.asarray(full, dtype=np.int16)).mean()
+
+    assert error(scaled) < 1.0
+    assert error(scaled) < error(unscaled) / 2
+
+
+def test_rescaled_text_is_refitted_to_the_drawn_box():
+    layer = {"type": "text", "text": "HEADLINE", "size": 120, "fitted": True}
+    scaled = scale_layer(layer, 0.5, 0.25)
+    assert scaled["size"] == 30
+    assert "fitted" not in scaled
+    assert layer["fitted"] is True
+
+
+def test_canvas_is_scaled_down_with_its_aspect_ratio_and_never_up():
+    config = {"width": 400, "height": 200, "background": "#000000"}
+    loose = BoxConstraints(0, 1000, 0, 1000)
+    assert Canvas(config, [], width=300, height=300).layout(loose).size == (300, 150)
+    assert Canvas(config, [], width=800, height=800).layout(loose).size == (400, 200)
+    # Tight constraints fill the slot; the content keeps its size inside it
+    image = Canvas(config, [], width=300, height=300).render(0, 0, BoxConstraints(300, 300, 300, 300))
+    alpha = np.asarray(image)[..., 3]
+    assert image.size == (300, 300)
+    assert alpha[:150].all() and not alpha[150:].any()
+
+
+def test_text_fitted_in_its_slot_is_not_refitted():
+    config = {"width": 1080, "height": 1080, "background": "#000000"}
+    layers = [{"type": "text", "text": "SUMMER LAUNCH PARTY", "size": 200}]
+    PosterRenderManager().fit_text_layers(config, layers, {"x": 0, "y": 0, "width": 1080, "height": 810})
+    assert layers[0]["fitted"] is True and layers[0]["fitted_box"] == [810, 810]
+
+    def text_layer(size):
+        (text,) = [layer for layer in Canvas(config, layers).render_plan(size, size).layers
+                   if isinstance(layer, TextLayer)]
+        return text
+
+    drawn = text_layer(810)
+    assert drawn.fitted
+    assert measure_text("SUMMER LAUNCH PARTY", None, drawn.size, (810, 810))["size"] == drawn.size
+    # Drawn at another size, the text is fitted again
+    assert not text_layer(1080).fitted
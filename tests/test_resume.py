@@ -0,0 +1,91 @@
+# test_resume.py
+"""Resuming a job: stale ACTIVE jobs can be picked up, and kept phases follow the requested size."""
+import asyncio
+import importlib
+import sqlite3
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+
+from database import DatabaseManager, PhaseType, ProjectStatus
+from server_pydantic import ResumeRequest
+from server_render import RenderDatabase
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # server opens its databases in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module("server")
+    monkeypatch.setattr(module, "db", DatabaseManager(str(tmp_path / "projects.db")))
+    monkeypatch.setattr(module, "render_db", RenderDatabase(str(tmp_path / "renders.db")))
+    return module
+
+
+def age_project(db, job_id, seconds):
+    with sqlite3.connect(db.db_path) as conn:
+        conn.execute("UPDATE projects SET updated_at = datetime('now', ?) WHERE id = ?",
+                     (f"-{seconds} seconds", job_id))
+
+
+def resume(server, job_id, request=None):
+    tasks = BackgroundTasks()
+    asyncio.run(server.resume_poster(job_id, tasks, request))
+    return tasks.tasks[0].kwargs
+
+
+def test_active_job_is_resumed_once_stale_or_forced(server):
+    db = server.db
+    job_id = db.create_project("summer launch")
+    db.update_project_status(job_id, ProjectStatus.ACTIVE)
+    with pytest.raises(HTTPException) as err:
+        resume(server, job_id)
+    assert err.value.status_code == 409
+    server.running_jobs.discard(job_id)
+
+    assert resume(server, job_id, ResumeRequest(force=True))["resume"]
+    server.running_jobs.discard(job_id)
+
+    age_project(db, job_id, server.RESUME_STALE_SECONDS + 60)
+    assert resume(server, job_id)["resume"]
+    # Running in this process: never resumed twice, even with force
+    with pytest.raises(HTTPException):
+        resume(server, job_id, ResumeRequest(force=True))
+    server.running_jobs.discard(job_id)
+
+
+def test_kept_phases_are_rerendered_at_a_new_size(server, monkeypatch):
+    db, render_db = server.db, server.render_db
+    job_id = db.create_project("summer launch")
+    for phase in server.PHASES_TO_RENDER:
+        db.save_phase_result(job_id, PhaseType(phase), {"phase": phase})
+        render_db.save_image(job_id, b"png", 540, 675, phase=phase)
+    db.update_project_status(job_id, ProjectStatus.COMPLETED)
+
+    # Without a size the job keeps the one it was rendered at
+    kwargs = resume(server, job_id)
+    assert (kwargs["width"], kwargs["height"]) == (540, 675)
+    server.running_jobs.discard(job_id)
+
+    class Agent:
+        def __init__(self, **kwargs):
+            pass
+
+        async def create_poster(self, prompt, project_id=None, resume=False):
+            return "{}"
+
+    rendered = []
+
+    def render(job_id, phase, phase_json, width, height):
+        rendered.append(phase)
+        render_db.save_image(job_id, b"png", width, height, phase=phase)
+
+    monkeypatch.setattr(server, "Posteragent", Agent)
+    monkeypatch.setattr(server, "render_phase_image", render)
+    asyncio.run(server.process_poster_generation(job_id, "summer launch", 540, 675, resume=True))
+    assert rendered == [] and db.get_project(job_id)["status"] == ProjectStatus.COMPLETED
+
+    asyncio.run(server.process_poster_generation(job_id, "summer launch", 1080, 1350, resume=True))
+    assert sorted(rendered) == sorted(server.PHASES_TO_RENDER)
+    assert set(render_db.get_rendered_sizes(job_id).values()) == {(1080, 1350)}
+    assert db.get_project(job_id)["status"] == ProjectStatus.COMPLETED
@@ -0,0 +1,47 @@
+# test_schema.py
+"""validate_tree repairs translated widget trees without reordering or recursing."""
+import asyncio
+import sys
+
+import pytest
+
+from database import PhaseType
+from llm_backend import MockBackend
+from main import Posteragent
+from schema import SchemaError, validate_tree
+
+
+def canvas(width=400):
+    return {"canvas": {"width": width, "height": 300, "background": "#000000"}, "layers": []}
+
+
+def test_old_format_children_keep_their_order():
+    tree = {"row": {"padding": 4,
+                    "column": {"children": [canvas(width="400")]},
+                    "stack": {"children": [canvas()]}}}
+    repaired, warnings = validate_tree(tree)
+    assert list(repaired["row"]) == ["padding", "column", "stack"]
+    assert repaired["row"]["column"]["children"][0]["canvas"]["width"] == 400
+    assert warnings
+
+
+def test_deep_trees_do_not_hit_the_recursion_limit():
+    depth = sys.getrecursionlimit() * 2
+    tree = canvas(width="400")
+    for _ in range(depth):
+        tree = {"container": tree}
+    repaired, warnings = validate_tree(tree)
+    for _ in range(depth):
+        repaired = repaired["container"]
+    assert repaired["canvas"]["width"] == 400
+    assert len(warnings) == 1
+
+
+def test_unrenderable_phase_is_not_saved(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    agent = Posteragent(backend=MockBackend(), use_cache=False)
+    agent.current_project_id = agent.db.create_project("test")
+    agent.current_json = {"grid": {"cells": 3}}
+    with pytest.raises(SchemaError):
+        asyncio.run(agent.store_phase_result(PhaseType.CANVAS))
+    assert agent.db.get_phase_result(agent.current_project_id, PhaseType.CANVAS) is None
@@ -0,0 +1,57 @@
+# test_shape_instances.py
+"""shape_instances layers draw their instances in order and skip malformed positions."""
+from PIL import Image
+
+from assets import draw_shape_instances
+from compiled_layers import compile_layer
+
+
+def render(layer, size=(64, 64)):
+    compiled = compile_layer(layer, *size)
+    base = Image.new("RGBA", size, (0, 0, 0, 255))
+    if compiled is not None:
+        draw_shape_instances(base, compiled, *size)
+    return base
+
+
+def test_instances_keep_draw_order_across_opacity_changes():
+    # The last instance shares (blur, opacity) with the first but must still paint over the second
+    layer = {"type": "shape_instances", "shape": "ellipse", "positions": [[32, 32]] * 3,
+             "sizes": [40], "colors": ["#ff0000", "#0000ff", "#ff0000"], "opacities": [1.0, 0.5, 1.0]}
+    assert render(layer).getpixel((32, 32)) == (255, 0, 0, 255)
+
+
+def test_blurred_instance_is_not_clipped_to_its_box():
+    layer = {"type": "shape_instances", "shape": "ellipse", "positions": [[32, 32]],
+             "sizes": [20], "colors": ["#ffffff"], "blurs": [4]}
+    # Just outside the 20px box the blur falloff is still visible
+    assert render(layer).getpixel((32, 44))[0] > 0
+
+
+def test_malformed_positions_are_skipped():
+    layer = {"type": "shape_instances", "shape": "ellipse", "positions": [[8, 8], 5, [1, 2, 3], [56, 56]],
+             "sizes": [10], "colors": ["#ffffff"]}
+    img = render(layer)
+    assert img.getpixel((8, 8)) == (255, 255, 255, 255)
+    assert img.getpixel((56, 56)) == (255, 255, 255, 255)
+    assert compile_layer(dict(layer, positions=[5, "x"]), 64, 64) is None
+
+
+def test_malformed_sizes_are_skipped():
+    layer = {"type": "shape_instances", "shape": "ellipse", "positions": [[8, 8], [32, 32], [56, 56]],
+             "sizes": [10, ["5", "5", "5"], [10]], "colors": ["#ffffff"]}
+    img = render(layer)
+    assert img.getpixel((8, 8)) == (255, 255, 255, 255)
+    assert img.getpixel((32, 32)) == (0, 0, 0, 255)
+    assert img.getpixel((56, 56)) == (0, 0, 0, 255)
+    assert compile_layer(dict(layer, sizes=[["5", "5", "5"]]), 64, 64) is None
+
+
+def test_blurred_fringe_keeps_the_instance_colour():
+    layer = {"type": "shape_instances", "shape": "ellipse", "positions": [[32, 32]],
+             "sizes": [20], "colors": ["#ff0000"], "blurs": [4]}
+    compiled = compile_layer(layer, 64, 64)
+    base = Image.new("RGBA", (64, 64), (0, 0, 0, 0))
+    draw_shape_instances(base, compiled, 64, 64)
+    r, g, b, a = base.getpixel((32, 44))
+    assert a > 0 and (r, g, b) == (255, 0, 0)
@@ -0,0 +1,74 @@
+# test_translator.py
+"""Translation cache keys and the translated trees they stand for."""
+import contextlib
+import io
+
+import pytest
+
+from schema import SchemaError
+from translator import translate_canvas_numbering, translate_phase_cached, translation_key
+
+
+def canvas(background):
+    return {"canvas": {"width": 400, "height": 400, "background": background}, "layers": []}
+
+
+def translate(data, phase):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return translate_canvas_numbering(data, phase=phase)
+
+
+class TranslationStore:
+    """The phase_translations part of DatabaseManager, in memory"""
+
+    def __init__(self):
+        self.saved = {}
+
+    def get_phase_translation(self, project_id, phase, key):
+        return self.saved.get((project_id, phase, key))
+
+    def save_phase_translation(self, project_id, phase, key, json_data):
+        self.saved[(project_id, phase, key)] = json_data
+
+
+def test_key_order_changes_the_translation_and_the_key():
+    first = {"container": {"width": 800, "height": 400,
+                           "row": {"canvas_1": canvas("#111111"), "canvas_2": canvas("#222222")}}}
+    swapped = {"container": {"width": 800, "height": 400,
+                             "row": {"canvas_2": canvas("#222222"), "canvas_1": canvas("#111111")}}}
+    assert translate(first, "canvas") != translate(swapped, "canvas")
+    assert translation_key(first, "canvas") != translation_key(swapped, "canvas")
+    assert translation_key(first, "canvas") == translation_key(dict(first), "canvas")
+
+
+def test_translation_does_not_share_dicts_with_the_phase_json():
+    data = {"column": {"children": [{"canvas_1": {
+        "canvas": {"width": 400, "height": 300, "background": {"gradient": ["#000000", "#FFFFFF"]}},
+        "layers": [{"type": "text", "text": "title", "x": 10, "shadow": {"offset_x": 2}}],
+    }}]}}
+    result = translate(data, "assets")
+    child = result["column"]["children"][0]
+    child["canvas"]["width"] = 1
+    child["canvas"]["background"]["gradient"].append("#FF0000")
+    child["layers"][0]["text"] = "changed"
+    child["layers"][0]["shadow"]["offset_x"] = 9
+
+    original = data["column"]["children"][0]["canvas_1"]
+    assert original["canvas"] == {"width": 400, "height": 300, "background": {"gradient": ["#000000", "#FFFFFF"]}}
+    assert original["layers"] == [{"type": "text", "text": "title", "x": 10, "shadow": {"offset_x": 2}}]
+
+
+def test_only_renderable_translations_are_cached():
+    store = TranslationStore()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with pytest.raises(SchemaError):
+            translate_phase_cached(store, "p", "canvas", {"grid": {"cells": 3}})
+        assert not store.saved
+
+        # Layout DSL slots become placeholder canvases, so layout phases render
+        layout = {"container": {"width": 800, "height": 400, "column": {"children": [
+            {"canvas_1": "PLACEHOLDER", "height": "50%"}, {"canvas_2": "PLACEHOLDER", "height": "50%"}]}}}
+        tree = translate_phase_cached(store, "p", "layout", layout)
+    children = tree["container"]["column"]["children"]
+    assert [child["canvas"]["width"] for child in children] == [800, 800]
+    assert len(store.saved) == 1
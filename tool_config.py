@@ -499,4 +499,69 @@ class Tool_config:
             },
             "required": ["color", "points"]
         }
-    }
\ No newline at end of file
+    }
+
+    generate_shape_instances = {
+        "name": "generate_shape_instances",
+        "description": "Generate many ellipses or polygons (confetti, dots, bokeh) as a single instanced shape layer. Prefer this over repeated generate_ellipse/generate_polygon calls.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "shape": {
+                    "type": "string",
+                    "enum": ["ellipse", "polygon"],
+                    "description": "Shape drawn for every instance"
+                },
+                "positions": {
+                    "type": "array",
+                    "items": {
+                        "type": "array",
+                        "items": {"type": "string"}
+                    },
+                    "description": "Array of [x, y] instance positions as strings (pixels or percentages). Example: [['10%', '20%'], ['300', '150']]"
+                },
+                "sizes": {
+                    "type": "array",
+                    "items": {
+                        "type": "array",
+                        "items": {"type": "string"}
+                    },
+                    "description": "Per-instance [width, height] as strings (pixels or percentages, default: 100x100). Shorter lists are cycled."
+                },
+                "colors": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Per-instance fill colors in hex format (default: #ffffff). Shorter lists are cycled."
+                },
+                "opacities": {
+                    "type": "array",
+                    "items": {"type": "number"},
+                    "description": "Per-instance opacity (0.0 to 1.0, default: 1.0). Shorter lists are cycled."
+                },
+                "blurs": {
+                    "type": "array",
+                    "items": {"type": "integer"},
+                    "description": "Per-instance blur radius in pixels (default: 0). Instances sharing a blur radius are blurred together."
+                },
+                "rotations": {
+                    "type": "array",
+                    "items": {"type": "number"},
+                    "description": "Per-instance rotation in degrees, polygons only (default: 0)"
+                },
+                "points": {
+                    "type": "array",
+                    "items": {
+                        "type": "array",
+                        "items": {"type": "number"}
+                    },
+                    "description": "Polygon template as [x, y] fractions (0.0 to 1.0) of each instance box (default: triangle [[0.5, 0], [1, 1], [0, 1]])"
+                },
+                "anchor": {
+                    "type": "string",
+                    "enum": ["center", "top-left"],
+                    "description": "Whether each position is the instance center or its top-left corner (default: 'center')"
+                }
+            },
+            "required": ["shape", "positions"]
+        }
+    }
@@ -1,168 +1,15 @@
 from typing import List, Optional, Dict, Any, Union
-import json,re
+from layout_dsl import compile_layout
 class Tools:
     @staticmethod
     def generate_layout(layout_string: str) -> Dict[str, Any]:
-        def parse_layout(layout_str: str) -> Dict[str, Any]:
-            canvas_counter = [1]  # Use list to maintain reference in nested functions
-            
-            # Remove all whitespace for easier parsing
-            layout_str = re.sub(r'\s+', '', layout_str)
-            
-            # Parse the root container
-            container_match = re.match(r'container\((\d+)x(\d+)\)\[(.*)\]$', layout_str)
-            if not container_match:
-                raise ValueError("Invalid layout string format. Expected: container(widthxheight)[...]")
-            
-            width = int(container_match.group(1))
-            height = int(container_match.group(2))
-            content = container_match.group(3)
-            
-            def parse_layout_element(content: str) -> Dict[str, Any]:
-                """Parse a single layout element (column, row, stack, or placeholder)"""
-                
-                # Check for placeholder
-                placeholder_match = re.match(r'placeholder\(([^)]*)\)$', content)
-                if placeholder_match:
-                    size_spec = placeholder_match.group(1)
-                    result = {f"canvas_{canvas_counter[0]}": "PLACEHOLDER"}
-                    canvas_counter[0] += 1
-                    
-                    # Add size specification if provided
-                    if size_spec:
-                        if 'x' in size_spec:
-                            # Dimension format
-                            w, h = size_spec.split('x')
-                            result["width"] = int(w)
-                            result["height"] = int(h)
-                        elif size_spec.endswith('%'):
-                            # Percentage format
-                            result["size"] = size_spec
-                        else:
-                            # Assume it's a flex value or other size
-                            result["size"] = size_spec
-                    
-                    return result
-                
-                # Check for column, row, or stack
-                layout_types = ['column', 'row', 'stack']
-                for layout_type in layout_types:
-                    pattern = rf'{layout_type}(?:\(([^)]*)\))?\[(.*)\]$'
-                    match = re.match(pattern, content)
-                    if match:
-                        size_spec = match.group(1)
-                        children_content = match.group(2)
-                        
-                        # Parse children
-                        children = parse_children(children_content)
-                        
-                        result = {
-                            layout_type: {
-                                "children": children
-                            }
-                        }
-                        
-                        # Add size specification if provided
-                        if size_spec:
-                            if size_spec.endswith('%'):
-                                result["size"] = size_spec
-                        
-                        return result
-                
-                raise ValueError(f"Could not parse layout element: {content}")
-            
-            def parse_children(children_content: str) -> List[Dict[str, Any]]:
-                """Parse children content, splitting by commas at the correct nesting level"""
-                
-                if not children_content:
-                    return []
-                
-                children = []
-                current_child = ""
-                bracket_depth = 0
-                paren_depth = 0
-                
-                i = 0
-                while i < len(children_content):
-                    char = children_content[i]
-                    
-                    if char == '[':
-                        bracket_depth += 1
-                    elif char == ']':
-                        bracket_depth -= 1
-                    elif char == '(':
-                        paren_depth += 1
-                    elif char == ')':
-                        paren_depth -= 1
-                    elif char == ',' and bracket_depth == 0 and paren_depth == 0:
-                        # Found a separator at top level
-                        if current_child.strip():
-                            child_data = parse_layout_element(current_child.strip())
-                            children.append(child_data)
-                        current_child = ""
-                        i += 1
-                        continue
-                    
-                    current_child += char
-                    i += 1
-                
-                # Add the last child
-                if current_child.strip():
-                    child_data = parse_layout_element(current_child.strip())
-                    children.append(child_data)
-                
-                return children
-            
-            def apply_size_context(layout_json: Dict[str, Any], parent_type: str = None) -> Dict[str, Any]:
-                """Apply size specifications based on context (width for rows, height for columns)"""
-                
-                def process_node(node, parent_layout_type=None):
-                    if isinstance(node, dict):
-                        new_node = {}
-                        for key, value in node.items():
-                            if key == "size":
-                                # Convert generic "size" to width/height based on parent context
-                                if parent_layout_type == "row":
-                                    new_node["width"] = value
-                                elif parent_layout_type == "column":
-                                    new_node["height"] = value
-                                else:
-                                    # For stack or unknown context, default to width
-                                    new_node["width"] = value
-                            elif key in ["column", "row", "stack"]:
-                                # Process layout containers
-                                new_node[key] = process_node(value, key)
-                            elif key == "children" and isinstance(value, list):
-                                # Process children with current layout type as parent
-                                new_node[key] = [process_node(child, parent_layout_type) for child in value]
-                            else:
-                                new_node[key] = process_node(value, parent_layout_type)
-                        return new_node
-                    elif isinstance(node, list):
-                        return [process_node(item, parent_layout_type) for item in node]
-                    else:
-                        return node
-                
-                return process_node(layout_json)
-            
-            # Parse the content inside container
-            child_layout = parse_layout_element(content)
-            
-            # Create the full structure
-            result = {
-                "container": {
-                    "width": width,
-                    "height": height,
-                    **child_layout
-                }
-            }
-            
-            # Apply size context
-            formatted_result = apply_size_context(result)
-            return formatted_result
-        
+        """
+        Parse a layout string such as
+        container(1920x1080)[column[placeholder(20%), row[placeholder(), placeholder()]]]
+        into layout JSON with numbered PLACEHOLDER canvases.
+        """
         try:
-            return parse_layout(layout_string)
+            return compile_layout(layout_string)["layout"]
         except Exception as e:
             raise ValueError(f"Error parsing layout string: {str(e)}")
 
@@ -509,6 +356,58 @@ class Tools:
                 "blur": blur
             
         }
-
-
-
+    
+    @staticmethod
+    def generate_shape_instances(
+        shape: str,
+        positions: List[List[Union[int, str]]],
+        sizes: Optional[List[Union[int, str, List[Union[int, str]]]]] = None,
+        colors: Optional[List[str]] = None,
+        opacities: Optional[List[float]] = None,
+        blurs: Optional[List[int]] = None,
+        rotations: Optional[List[float]] = None,
+        points: Optional[List[List[float]]] = None,
+        anchor: str = "center"
+    ) -> Dict[str, Any]:
+        """
+        Generate an instanced shape layer: many ellipses or polygons drawn in one layer.
+        
+        Args:
+            shape: 'ellipse' or 'polygon'
+            positions: List of [x, y] instance positions (pixels or percentages)
+            sizes: Per-instance size, either a single value or [width, height] (pixels or percentages)
+            colors: Per-instance fill colors (hex)
+            opacities: Per-instance opacity (0.0 to 1.0)
+            blurs: Per-instance blur radius in pixels
+            rotations: Per-instance rotation in degrees (polygons only)
+            points: Polygon template as [x, y] fractions of the instance box (default: triangle)
+            anchor: 'center' (position is the instance center) or 'top-left'
+            
+        Per-instance lists shorter than positions are cycled.
+            
+        Example:
+            positions = [["10%", "20%"], ["30%", "70%"], ["80%", "40%"]]
+            sizes = [24, 40, [30, 18]]
+            colors = ["#ffd166", "#ef476f"]
+        """
+        layer = {
+            "type": "shape_instances",
+            "shape": shape,
+            "positions": positions,
+            "anchor": anchor
+        }
+        
+        if sizes:
+            layer["sizes"] = sizes
+        if colors:
+            layer["colors"] = colors
+        if opacities:
+            layer["opacities"] = opacities
+        if blurs:
+            layer["blurs"] = blurs
+        if rotations:
+            layer["rotations"] = rotations
+        if points:
+            layer["points"] = points
+            
+        return layer
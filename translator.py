@@ -272,8 +272,21 @@
     
 #     return process_node(llm_output)
 
+import argparse
+import contextlib
+import copy
+import importlib.util
+import io
 import random
 import json
+import hashlib
+import time
+
+from layout_dsl import main_axis_share, stack_is_column
+from schema import validate_tree
+
+# Bump when translation output changes so cached translations are not reused
+TRANSLATOR_VERSION = 4
 
 def translate_canvas_numbering(llm_output: dict, phase: str = "assets") -> dict:
     """
@@ -325,15 +338,19 @@ def translate_canvas_numbering(llm_output: dict, phase: str = "assets") -> dict:
                     return value
         return value
     
+    # Fields that might have 'px' suffix
+    dimension_fields = {'width', 'height', 'x', 'y', 'shape_width', 'shape_height',
+                        'shape_x', 'shape_y', 'blur_radius', 'blur'}
+    
     def sanitize_layer(layer):
-        """Sanitize all dimension fields in a layer"""
+        """
+        Sanitize all dimension fields in a layer.
+        Always returns a fresh dict: the translation is cached, so it must not
+        share dicts with the phase JSON it came from.
+        """
         if not isinstance(layer, dict):
             return layer
         
-        # Fields that might have 'px' suffix
-        dimension_fields = ['width', 'height', 'x', 'y', 'shape_width', 'shape_height', 
-                           'shape_x', 'shape_y', 'blur_radius', 'blur']
-        
         sanitized = {}
         for key, value in layer.items():
             if key in dimension_fields:
@@ -347,6 +364,14 @@ def translate_canvas_numbering(llm_output: dict, phase: str = "assets") -> dict:
         
         return sanitized
     
+    def copy_canvas(canvas):
+        """Fresh copy of a canvas config (see sanitize_layer)"""
+        if isinstance(canvas, dict):
+            return {key: copy_canvas(value) for key, value in canvas.items()}
+        if isinstance(canvas, list):
+            return [copy_canvas(item) for item in canvas]
+        return canvas
+    
     def create_placeholder_canvas(width=800, height=600, color=None):
         """Create a placeholder canvas for layout visualization"""
         if color is None:
@@ -367,121 +392,38 @@ def translate_canvas_numbering(llm_output: dict, phase: str = "assets") -> dict:
             ]
         }
     
-    def inject_placeholder_canvases(node, parent_context=None):
-        """
-        For layout phase: Inject placeholder canvases into leaf nodes.
-        This makes the structure renderable for visualization.
-        """
-        if not isinstance(node, dict):
-            return node
-        
-        result = {}
-        
-        # Check if this is a layout container
-        is_container = any(key in node for key in ['container', 'column', 'row', 'stack'])
-        
-        if is_container:
-            # Process container nodes recursively
-            for key, value in node.items():
-                if key in ['container', 'column', 'row', 'stack']:
-                    result[key] = inject_placeholder_canvases(value, {"type": key})
-                else:
-                    result[key] = inject_placeholder_canvases(value, parent_context)
-        
-        elif 'children' in node:
-            # Process children array
-            result['children'] = []
-            for child in node['children']:
-                processed_child = inject_placeholder_canvases(child, parent_context)
-                result['children'].append(processed_child)
-            
-            # Copy other keys
-            for key, value in node.items():
-                if key != 'children':
-                    result[key] = value
-        
-        else:
-            # Leaf node - check if it needs a placeholder canvas
-            has_canvas = any(k.startswith('canvas_') or k == 'canvas' for k in node.keys())
-            
-            if not has_canvas:
-                # Add placeholder canvas for visualization
-                placeholder = create_placeholder_canvas()
-                result.update(placeholder)
-                print(f"  → Added placeholder canvas for layout visualization")
-            
-            # Copy all original keys
-            for key, value in node.items():
-                result[key] = inject_placeholder_canvases(value, parent_context) if isinstance(value, dict) else value
-        
-        return result
-    
-    def ensure_canvas_structure(node):
-        """
-        For canvas/background/assets phases: Ensure all canvas_N have proper structure.
-        """
-        if not isinstance(node, dict):
-            return node
-        
-        result = {}
-        
-        for key, value in node.items():
-            if key.startswith('canvas_'):
-                # Ensure canvas_N has both 'canvas' and 'layers'
-                if isinstance(value, dict) and 'canvas' in value:
-                    result[key] = {
-                        'canvas': value['canvas'],
-                        'layers': value.get('layers', [])
-                    }
-                elif value == "PLACEHOLDER":
-                    result[key] = {
-                    "canvas": {
-                        "width": 800,  # Use proper width/height as needed
-                        "height": 600,
-                        "background": "#FFFFFF"
-                    },
-                    "layers": []
-                }
-                else:
-                    # Malformed canvas_N - try to fix
-                    print(f"  ⚠️ Malformed {key}, attempting to fix...")
-                    result[key] = value
-            else:
-                # Recursively process other nodes
-                if isinstance(value, dict):
-                    result[key] = ensure_canvas_structure(value)
-                elif isinstance(value, list):
-                    result[key] = [ensure_canvas_structure(item) if isinstance(item, dict) else item for item in value]
-                else:
-                    result[key] = value
-        
-        return result
+    def validate_canvas(key, canvas):
+        """Warn about canvas configs the renderer cannot size"""
+        if not isinstance(canvas, dict) or 'width' not in canvas or 'height' not in canvas:
+            print(f"  ⚠️ {key}: canvas config without width/height")
+
+    def gets_placeholder(node):
+        """Whether layout preprocessing adds a placeholder canvas to this node"""
+        if any(key in node for key in ['container', 'column', 'row', 'stack']) or 'children' in node:
+            return False
+        return not any(k.startswith('canvas_') or k == 'canvas' for k in node.keys())
     
-    def should_convert_stack_to_column(stack_data):
+    def should_convert_stack_to_column(stack_data, mode="plain"):
         """
-        Detect if a stack should actually be a column.
-        If all children have explicit canvas heights, it's likely a vertical layout.
+        Detect if a stack should actually be a column, with the rule
+        layout_dsl.compute_slot_geometry uses. Canvases the phase
+        preprocessing fills in (PLACEHOLDER in the canvas phases, placeholder
+        canvases in the layout phase) count as well.
         """
         if "children" not in stack_data:
             return False
-            
-        children = stack_data["children"]
-        if len(children) <= 1:
-            return False
         
-        # Check if multiple children have canvases with explicit heights
-        canvas_count = 0
-        for child in children:
-            if isinstance(child, dict):
-                # Look for canvas_N pattern with height
-                for key, value in child.items():
-                    if key.startswith("canvas_") and isinstance(value, dict):
-                        if "canvas" in value and "height" in value["canvas"]:
-                            canvas_count += 1
-                            break
+        # Layout preprocessing only reaches children of plain stacks
+        layout_children = mode == "layout" and not any(
+            key in stack_data for key in ['container', 'column', 'row', 'stack'])
+        
+        def becomes_canvas(child, value):
+            if not layout_children or (
+                    'children' in child and not any(key in child for key in ['container', 'column', 'row', 'stack'])):
+                return False
+            return value == "PLACEHOLDER" or (isinstance(value, dict) and gets_placeholder(value))
         
-        # If 2+ children have explicit canvas heights, likely a column layout
-        return canvas_count >= 2
+        return stack_is_column(stack_data["children"], placeholders=mode == "ensure", becomes_canvas=becomes_canvas)
     
     def enforce_stack_semantics(children):
         """
@@ -495,139 +437,146 @@ def translate_canvas_numbering(llm_output: dict, phase: str = "assets") -> dict:
     
     def enforce_column_semantics(children):
         """
-        Enforce column semantics: heights should be properly distributed.
+        Enforce column semantics: heights should be properly distributed
+        (layout_dsl.main_axis_share).
         """
         if not children:
             return
         
-        # Check if all children have percentage heights
-        percentage_heights = []
-        has_non_percentage = False
-        
+        share = main_axis_share([child.get("height") for child in children if isinstance(child, dict)], len(children))
+        if share is None:
+            print("  ✓ Column: heights properly distributed")
+            return
         for child in children:
             if isinstance(child, dict):
-                height = child.get("height")
-                if height is None:
-                    percentage_heights.append(None)
-                elif isinstance(height, str) and height.endswith('%'):
-                    try:
-                        percentage_heights.append(float(height[:-1]))
-                    except ValueError:
-                        has_non_percentage = True
-                        break
-                else:
-                    # Pixel value or other format
-                    has_non_percentage = True
-                    break
-        
-        # If any non-percentage values or missing heights, redistribute
-        if has_non_percentage or None in percentage_heights:
-            height_percent = round(100 / len(children), 2)
-            for child in children:
-                if isinstance(child, dict):
-                    child["height"] = f"{height_percent}%"
-            print(f"  ⚠️  Column: redistributed heights evenly ({height_percent}% each)")
-        else:
-            # All percentages - check if they sum to ~100%
-            total = sum(percentage_heights)
-            if total < 95 or total > 105:
-                height_percent = round(100 / len(children), 2)
-                for child in children:
-                    if isinstance(child, dict):
-                        child["height"] = f"{height_percent}%"
-                print(f"  ⚠️  Column: heights sum to {total}%, redistributed to {height_percent}% each")
-            else:
-                print(f"  ✓ Column: heights properly distributed (sum={total}%)")
+                child["height"] = f"{share}%"
+        print(f"  ⚠️  Column: redistributed heights evenly ({share}% each)")
     
     def enforce_row_semantics(children):
         """
-        Enforce row semantics: widths should be properly distributed.
+        Enforce row semantics: widths should be properly distributed
+        (layout_dsl.main_axis_share).
         """
         if not children:
             return
         
-        # Check if all children have percentage widths
-        percentage_widths = []
-        has_non_percentage = False
-        
+        share = main_axis_share([child.get("width") for child in children if isinstance(child, dict)], len(children))
+        if share is None:
+            print("  ✓ Row: widths properly distributed")
+            return
         for child in children:
             if isinstance(child, dict):
-                width = child.get("width")
-                if width is None:
-                    percentage_widths.append(None)
-                elif isinstance(width, str) and width.endswith('%'):
-                    try:
-                        percentage_widths.append(float(width[:-1]))
-                    except ValueError:
-                        has_non_percentage = True
-                        break
-                else:
-                    # Pixel value or other format
-                    has_non_percentage = True
-                    break
-        
-        # If any non-percentage values or missing widths, redistribute
-        if has_non_percentage or None in percentage_widths:
-            width_percent = round(100 / len(children), 2)
-            for child in children:
-                if isinstance(child, dict):
-                    child["width"] = f"{width_percent}%"
-            print(f"  ⚠️  Row: redistributed widths evenly ({width_percent}% each)")
-        else:
-            # All percentages - check if they sum to ~100%
-            total = sum(percentage_widths)
-            if total < 95 or total > 105:
-                width_percent = round(100 / len(children), 2)
-                for child in children:
-                    if isinstance(child, dict):
-                        child["width"] = f"{width_percent}%"
-                print(f"  ⚠️  Row: widths sum to {total}%, redistributed to {width_percent}% each")
-            else:
-                print(f"  ✓ Row: widths properly distributed (sum={total}%)")
+                child["width"] = f"{share}%"
+        print(f"  ⚠️  Row: redistributed widths evenly ({share}% each)")
     
-    def process_node(node, parent_context=None):
-        """Recursively process each node in the JSON tree"""
+    def node_entries(node, mode):
+        """
+        List (key, value, mode) for one node, applying the phase preprocessing
+        to this level only. Modes:
+          "ensure" - canvas/background/assets: canvas_N gets a proper structure
+          "layout" - layout: leaf nodes without a canvas get a placeholder canvas
+          "plain"  - no preprocessing
+          "done"   - value is already render-ready
+        """
+        if mode != "layout":
+            return [(key, value, mode) for key, value in node.items()]
+        
+        if any(key in node for key in ['container', 'column', 'row', 'stack']):
+            # Containers: nested dicts are visited, lists are left as-is
+            return [(key, value, "layout" if isinstance(value, dict) else "plain")
+                    for key, value in node.items()]
+        
+        if 'children' in node:
+            children = node['children']
+            entries = [('children', children if isinstance(children, list) else list(children), "layout")]
+            entries.extend((key, value, "plain") for key, value in node.items() if key != 'children')
+            return entries
+        
+        # Leaf node - check if it needs a placeholder canvas
+        entries = {}
+        if gets_placeholder(node):
+            # Add placeholder canvas for visualization
+            for key, value in create_placeholder_canvas().items():
+                entries[key] = (value, "done")
+            print(f"  → Added placeholder canvas for layout visualization")
         
+        for key, value in node.items():
+            if key.startswith('canvas_') and value == "PLACEHOLDER":
+                # A slot from the layout DSL: visualized like a leaf without a canvas
+                for placeholder_key, placeholder_value in create_placeholder_canvas().items():
+                    entries[placeholder_key] = (placeholder_value, "done")
+                continue
+            entries[key] = (value, "layout" if isinstance(value, dict) else "plain")
+        return [(key, value, entry_mode) for key, (value, entry_mode) in entries.items()]
+    
+    def translate_node(node, parent_context=None, mode="plain"):
+        """Translate one node into render-ready form in a single pass"""
         if not isinstance(node, dict):
             return node
-        
+        return translate_entries(node_entries(node, mode), parent_context)
+    
+    def translate_entries(entries, parent_context):
         processed = {}
         
-        for key, value in node.items():
+        for key, value, mode in entries:
+            if mode == "done":
+                processed[key] = value
+                continue
+            
             # Check if this is a canvas_N key
-            if key.startswith("canvas_") and isinstance(value, dict):
-                if "canvas" in value and "layers" in value:
-                    # Flatten the structure and sanitize layers
-                    processed["canvas"] = value["canvas"]
-                    processed["layers"] = [sanitize_layer(layer) for layer in value.get("layers", [])]
-                else:
-                    processed[key] = process_node(value, parent_context)
+            if key.startswith("canvas_"):
+                if mode == "ensure":
+                    # Ensure canvas_N has both 'canvas' and 'layers', then flatten
+                    if isinstance(value, dict) and 'canvas' in value:
+                        validate_canvas(key, value['canvas'])
+                        processed["canvas"] = copy_canvas(value['canvas'])
+                        processed["layers"] = [sanitize_layer(layer) for layer in value.get('layers', [])]
+                        continue
+                    if value == "PLACEHOLDER":
+                        processed["canvas"] = {
+                            "width": 800,  # Use proper width/height as needed
+                            "height": 600,
+                            "background": "#FFFFFF"
+                        }
+                        processed["layers"] = []
+                        continue
+                    # Malformed canvas_N - keep it as-is
+                    print(f"  ⚠️ Malformed {key}, attempting to fix...")
+                    mode = "plain"
+                
+                if isinstance(value, dict):
+                    sub_entries = node_entries(value, mode)
+                    sub_keys = {sub_key for sub_key, _, _ in sub_entries}
+                    if "canvas" in sub_keys and "layers" in sub_keys:
+                        # Flatten the structure and sanitize layers
+                        resolved = {sub_key: (translate_node(sub_value, parent_context, sub_mode)
+                                              if sub_mode == "layout" else sub_value)
+                                    for sub_key, sub_value, sub_mode in sub_entries}
+                        validate_canvas(key, resolved["canvas"])
+                        processed["canvas"] = copy_canvas(resolved["canvas"])
+                        processed["layers"] = [sanitize_layer(layer) for layer in resolved["layers"]]
+                    else:
+                        processed[key] = translate_entries(sub_entries, parent_context)
+                    continue
             
             # Handle stack with fallback conversion
-            elif key == "stack" and isinstance(value, dict):
+            if key == "stack" and isinstance(value, dict):
                 # Check if this should be a column instead
-                if should_convert_stack_to_column(value):
+                if should_convert_stack_to_column(value, mode):
                     print("⚠️  Auto-converting 'stack' → 'column' (detected vertical layout pattern)")
-                    layout_context = {"type": "column"}
-                    processed["column"] = process_node(value, layout_context)
+                    processed["column"] = translate_node(value, {"type": "column"}, mode)
                 else:
-                    layout_context = {"type": "stack"}
-                    processed[key] = process_node(value, layout_context)
+                    processed[key] = translate_node(value, {"type": "stack"}, mode)
             
             # Handle other layout containers
             elif key in ["column", "row"] and isinstance(value, dict):
-                layout_context = {"type": key}
-                processed[key] = process_node(value, layout_context)
+                processed[key] = translate_node(value, {"type": key}, mode)
             
             # Handle children arrays
             elif key == "children" and isinstance(value, list):
-                processed[key] = []
+                processed[key] = [translate_node(child, parent_context, mode) for child in value]
                 num_children = len(value)
                 
-                for child in value:
-                    processed_child = process_node(child, parent_context)
-                    processed[key].append(processed_child)
-                
                 # Enforce semantic constraints AFTER processing all children
                 if parent_context:
                     layout_type = parent_context.get("type")
@@ -648,18 +597,13 @@ def translate_canvas_numbering(llm_output: dict, phase: str = "assets") -> dict:
             elif key == "layers" and isinstance(value, list):
                 processed[key] = [sanitize_layer(layer) for layer in value]
             
-            # Handle container
-            elif key == "container" and isinstance(value, dict):
-                processed[key] = process_node(value, parent_context)
-            
-            # Keep all other keys as-is
+            # Container and all other keys
+            elif isinstance(value, dict):
+                processed[key] = translate_node(value, parent_context, mode)
+            elif isinstance(value, list):
+                processed[key] = [translate_node(item, parent_context, mode) if isinstance(item, dict) else item for item in value]
             else:
-                if isinstance(value, dict):
-                    processed[key] = process_node(value, parent_context)
-                elif isinstance(value, list):
-                    processed[key] = [process_node(item, parent_context) if isinstance(item, dict) else item for item in value]
-                else:
-                    processed[key] = value
+                processed[key] = value
         
         return processed
     
@@ -669,27 +613,118 @@ def translate_canvas_numbering(llm_output: dict, phase: str = "assets") -> dict:
     print(f"Translating for phase: {phase}")
     print(f"{'='*60}\n")
     
-    # Phase-specific preprocessing
+    # Phase-specific preprocessing happens in the same pass as translation
     if phase == "layout":
         print("Phase: LAYOUT - Adding placeholder canvases for visualization...")
-        # Add placeholder canvases to make structure renderable
-        preprocessed = inject_placeholder_canvases(llm_output)
+        mode = "layout"
     
     elif phase in ["canvas", "background", "assets"]:
         print(f"Phase: {phase.upper()} - Ensuring proper canvas structure...")
-        # Ensure all canvas_N have proper structure
-        preprocessed = ensure_canvas_structure(llm_output)
+        mode = "ensure"
     
     else:
         print(f"⚠️  Unknown phase: {phase}, using default processing")
-        preprocessed = llm_output
+        mode = "plain"
     
-    # Main translation process
     print("\nProcessing structure and enforcing semantics...")
-    result = process_node(preprocessed)
+    result = translate_node(llm_output, mode=mode)
     
     print(f"\n{'='*60}")
     print(f"Translation complete for phase: {phase}")
     print(f"{'='*60}\n")
     
-    return result
\ No newline at end of file
+    return result
+
+
+def translation_key(llm_output: dict, phase: str) -> str:
+    """
+    Hash of (phase JSON, phase, translator version). Keys are hashed in their
+    original order: children and layers are translated in dict order.
+    """
+    encoded = json.dumps(llm_output, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(f"{TRANSLATOR_VERSION}:{phase}:{encoded}".encode('utf-8')).hexdigest()
+
+
+def translate_phase_cached(db, project_id: str, phase: str, llm_output: dict) -> dict:
+    """
+    translate_canvas_numbering memoized in the DatabaseManager next to
+    phase_results, returned after schema.validate_tree. The cache is keyed by
+    translation_key, so a changed phase JSON never reuses an old translation,
+    and only trees that validate are cached: an unrenderable one raises
+    SchemaError. Cache hits are validated again, which is cheap and restores
+    the tuples JSON turned into lists.
+    """
+    key = translation_key(llm_output, phase)
+    cached = db.get_phase_translation(project_id, phase, key)
+    if cached is not None:
+        print(f"Using cached translation for phase: {phase}")
+        return validate_tree(cached)[0]
+    
+    translated, schema_warnings = validate_tree(translate_canvas_numbering(llm_output, phase=phase))
+    for warning in schema_warnings:
+        print(f"Schema: {warning}")
+    db.save_phase_translation(project_id, phase, key, translated)
+    return translated
+
+def _bench_structure(n_canvases: int, layers_per_canvas: int = 12) -> dict:
+    """A column of rows, 10 canvases per row, wrapped in a stack that converts to a column"""
+    rows = []
+    for r in range(n_canvases // 10):
+        columns = []
+        for c in range(10):
+            index = r * 10 + c + 1
+            columns.append({f"canvas_{index}": {
+                "canvas": {"width": "192px", "height": "108px", "background": "#112233"},
+                "layers": [{"type": "text", "text": "t", "x": "10px", "y": "5%", "size": 20,
+                            "shadow": {"offset_x": 2}} for _ in range(layers_per_canvas)],
+            }})
+        rows.append({"row": {"children": columns}, "height": "10%"})
+    return {"stack": {"children": [{"column": {"children": rows}}]}}
+
+
+def _time_translate(translate, structure: dict, phase: str) -> tuple:
+    """(best ms of 3, output); translator progress output is discarded"""
+    best = None
+    for _ in range(3):
+        llm_output = copy.deepcopy(structure)
+        # Placeholder canvases get random colors; seed so outputs compare equal
+        random.seed(0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = translate(llm_output, phase)
+            elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_benchmark(baseline_path: str = None, phase: str = "assets"):
+    """Print ms per translation for 100/1000/5000 canvases, next to the baseline's when given"""
+    baseline = None
+    if baseline_path:
+        spec = importlib.util.spec_from_file_location("baseline_translator", baseline_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        baseline = module.translate_canvas_numbering
+
+    for n in (100, 1000, 5000):
+        structure = _bench_structure(n)
+        name = f"{n} canvases"
+        new_ms, new_result = _time_translate(translate_canvas_numbering, structure, phase)
+        if baseline is None:
+            print(f"{name:<16}{new_ms:>10.1f} ms")
+            continue
+        old_ms, old_result = _time_translate(baseline, structure, phase)
+        same = old_result == new_result
+        print(f"{name:<16}{old_ms:>10.1f} ->{new_ms:>8.1f} ms{'' if same else '  OUTPUT DIFFERS'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Phase JSON translator tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="Time translation of large phase JSON")
+    bench_parser.add_argument("--baseline", help="translator.py whose translate_canvas_numbering to compare against")
+    bench_parser.add_argument("--phase", default="assets", help="Phase to translate for (default: assets)")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        run_benchmark(args.baseline, args.phase)